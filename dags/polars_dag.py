@@ -52,7 +52,7 @@ def polars_dag():
         """,
             f"""
         create table logcontent.results 
-            engine = DeltaLake('http://miniostorage:9000/data/results', 
+            engine = DeltaLake('http://miniostorage:9000/data/results_scd2', 
                 {os.getenv("AWS_ACCESS_KEY_ID")}, 
                 {os.getenv("AWS_SECRET_ACCESS_KEY")});
         """,
@@ -1,12 +1,16 @@
-import os
 import dotenv
 from datetime import datetime
 
 from airflow.decorators import dag, task
 
 from src.scripts.pipeline import get_gold_table
-from src.scripts.support import sink_delta_to_s3, ingest_from_s3
+from src.scripts.support import (
+    scan_delta_from_s3,
+    sink_delta_to_s3,
+    sink_incremental_delta_to_s3,
+)
 from src.scripts.schema import PA_SCHEMA
+from src.scripts.storage import get_storage_options
 
 dotenv.load_dotenv()
 
@@ -23,15 +27,16 @@ def polars_dag():
         BASE_PATH = "data/log_content/"
         write_options = {
             "engine": "rust",
-            "partition": "Date",
+            "partition_by": "Date",
         }
-        df = ingest_from_s3(BASE_PATH, schema=PA_SCHEMA)
-        sink_delta_to_s3(
-            df,
+        result = sink_incremental_delta_to_s3(
+            BASE_PATH,
+            schema=PA_SCHEMA,
             target="s3://data/log_delta",
-            mode="overwrite",
+            manifest_target="s3://data/log_delta_manifest",
             delta_write_options=write_options,
         )
+        print(f"Ingested {len(result['files'])} new log files")
 
     sink_to_s3 = sink_raw_to_s3()
 
@@ -42,26 +47,18 @@ def polars_dag():
         table_uri = "s3://data/log_delta"
         dt = DeltaTable(
             table_uri=table_uri,
-            storage_options={
-                "AWS_REGION": os.getenv("AWS_REGION"),
-                "AWS_ACCESS_KEY_ID": os.getenv("AWS_ACCESS_KEY_ID"),
-                "AWS_SECRET_ACCESS_KEY": os.getenv("AWS_SECRET_ACCESS_KEY"),
-                "AWS_ENDPOINT_URL": "http://miniostorage:9000",
-                "AWS_ALLOW_HTTP": "true",
-                "AWS_S3_ALLOW_UNSAFE_RENAME": "true",
-            },
+            storage_options=get_storage_options(),
         )
         print("Starting to optimize tables")
         dt.optimize.compact()
-        dt.optimize.z_order(["Date", "Contract"])
+        # Date is the partition column, so the files are only clustered within a day.
+        dt.optimize.z_order(["Contract"])
         print("Finishing optimizing tables")
 
     optimize_tables = optimize_raw_tbls()
 
     @task
     def get_gold_tbls():
-        import polars as pl
-
         app_names = [
             "CHANNEL",
             "KPLUS",
@@ -83,24 +80,21 @@ def polars_dag():
             "ChildDuration",
             "RelaxDuration",
         ]
-        write_options = {"engine": "rust"}
-        df = pl.scan_delta(
+        # The layout of the results of etl.py, the current rows and the history in separate partitions.
+        write_options = {"engine": "rust", "partition_by": ["is_current"]}
+        df = scan_delta_from_s3(
             "s3://data/log_delta",
-            storage_options={
-                "AWS_REGION": os.getenv("AWS_REGION"),
-                "AWS_ACCESS_KEY_ID": os.getenv("AWS_ACCESS_KEY_ID"),
-                "AWS_SECRET_ACCESS_KEY": os.getenv("AWS_SECRET_ACCESS_KEY"),
-                "AWS_ENDPOINT_URL": "http://miniostorage:9000",
-                "AWS_ALLOW_HTTP": "true",
-                "AWS_S3_ALLOW_UNSAFE_RENAME": "true",
-            },
-        ).filter(pl.col("Date").is_between(datetime(2022, 4, 1), datetime(2022, 4, 2)))
+            partition_filters=[
+                ("Date", ">=", "2022-04-01"),
+                ("Date", "<=", "2022-04-02"),
+            ],
+        )
 
         tables = get_gold_table(df, app_names=app_names, column_names=column_names)
 
         sink_delta_to_s3(
             tables,
-            target="s3://data/results_delta",
+            target="s3://data/results_delta_scd2",
             mode="overwrite",
             delta_write_options=write_options,
         )
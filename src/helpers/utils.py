@@ -3,7 +3,9 @@ from datetime import datetime, timedelta
 from itertools import product
 
 
-def create_date_directories(base_path, start_date, end_date, format="%Y%m%d"):
+def create_date_directories(
+    base_path, start_date, end_date, format="%Y%m%d", extension=".json"
+):
     """
     Creates a list of directories for each date between start_date and end_date, inclusive.
 
@@ -12,6 +14,7 @@ def create_date_directories(base_path, start_date, end_date, format="%Y%m%d"):
         start_date: The start date as a string in the specified format.
         end_date: The end date as a string in the specified format.
         format: The date format string to use (default is YYYY-MM-DD).
+        extension: The file extension, e.g. ".json.gz" or ".json.zst" for compressed logs (default is ".json").
 
     Returns:
         A list of directory paths created.
@@ -37,7 +40,7 @@ def create_date_directories(base_path, start_date, end_date, format="%Y%m%d"):
         # Format date string
         date_str = current_date.strftime(format)
         # Create directory path
-        directory_path = os.path.join(base_path, f"{date_str}.json")
+        directory_path = os.path.join(base_path, f"{date_str}{extension}")
         # Add path to list
         directory_paths.append(directory_path)
         # Increment date
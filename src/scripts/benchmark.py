@@ -0,0 +1,276 @@
+import argparse
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from multiprocessing import get_context
+
+import numpy as np
+import polars as pl
+import polars.selectors as ps
+
+from src.scripts.pipeline import (
+    get_gold_table,
+    get_most_watch,
+    get_pivot_table,
+    get_rfm_table,
+)
+
+APP_NAMES = ["CHANNEL", "KPLUS", "VOD", "FIMS", "BHD", "SPORT", "CHILD", "RELAX"]
+COLUMN_NAMES = [
+    "TVDuration",
+    "TVDuration",
+    "MovieDuration",
+    "MovieDuration",
+    "MovieDuration",
+    "SportDuration",
+    "ChildDuration",
+    "RelaxDuration",
+]
+
+
+def synthetic_logs(rows: int, contracts: int, seed: int = 0) -> pl.DataFrame:
+    """
+    Generate a month of log rows shaped like the output of ``ingest_from_s3``.
+
+    Args:
+        rows (int): The number of rows.
+        contracts (int): The number of distinct contracts.
+        seed (int): The random seed. Defaults to 0.
+
+    Returns:
+        pl.DataFrame: The ``Date``, ``Contract``, ``AppName`` and ``TotalDuration`` columns.
+    """
+    rng = np.random.default_rng(seed)
+    days = pl.date_range(date(2022, 4, 1), date(2022, 4, 30), eager=True)
+
+    return pl.DataFrame(
+        {
+            "Date": days.gather(rng.integers(0, len(days), rows)),
+            "Contract": pl.Series(
+                [f"C{i:07d}" for i in range(contracts)] + ["0"]
+            ).gather(rng.integers(0, contracts + 1, rows)),
+            "AppName": pl.Series([*APP_NAMES, "OTHER"]).gather(
+                rng.integers(0, len(APP_NAMES) + 1, rows)
+            ),
+            "TotalDuration": rng.integers(0, 5000, rows) * (rng.random(rows) > 0.2),
+        }
+    )
+
+
+def joined_gold_table(
+    sources: pl.LazyFrame, reported_date: str = "20220501", **options
+) -> pl.LazyFrame:
+    """
+    The gold table as separate RFM, pivot and most-watch plans joined on ``Contract``.
+
+    This is how ``get_gold_table`` was built before its aggregations were fused, kept as the baseline.
+
+    Returns:
+        pl.LazyFrame: The gold table.
+    """
+    pivot_tbl = get_pivot_table(
+        sources, options.get("app_names"), options.get("column_names")
+    )
+
+    return (
+        pivot_tbl.join(get_rfm_table(sources), on="Contract", how="left")
+        .join(get_most_watch(pivot_tbl), on="Contract", how="left")
+        .with_columns(
+            pl.sum_horizontal(ps.ends_with("Duration")).alias("SumDuration"),
+            pl.lit(True).alias("is_current"),
+            pl.lit(reported_date)
+            .str.strptime(pl.Datetime, format="%Y %m %d")
+            .alias("effective_time"),
+            pl.lit(None, pl.Datetime).alias("end_time"),
+        )
+        .select(
+            pl.col("Contract"),
+            ps.ends_with("Duration"),
+            pl.col(
+                "RFM", "TypeOfCustomers", "is_current", "effective_time", "end_time"
+            ),
+        )
+    )
+
+
+def synthetic_pivot(contracts: int, seed: int = 0) -> pl.DataFrame:
+    """
+    Generate a pivot table shaped like the output of ``get_pivot_table``.
+
+    The durations are coarse multiples of 1000 seconds, so many contracts have tied categories.
+
+    Args:
+        contracts (int): The number of contracts.
+        seed (int): The random seed. Defaults to 0.
+
+    Returns:
+        pl.DataFrame: The ``Contract`` column followed by one duration column per category.
+    """
+    rng = np.random.default_rng(seed)
+
+    return pl.DataFrame(
+        {
+            "Contract": [f"C{i:07d}" for i in range(contracts)],
+            **{
+                column: rng.integers(0, 5, contracts) * 1000
+                for column in dict.fromkeys(COLUMN_NAMES)
+            },
+        }
+    )
+
+
+def sorted_most_watch(sources: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    The most watched item found by sorting a list of ``(duration, item)`` structs per contract.
+
+    This is how ``get_most_watch`` worked before it ranked the items with horizontal operations, kept as
+    the baseline.
+
+    Returns:
+        pl.LazyFrame: The ``Contract`` and ``MostWatch`` columns.
+    """
+    columns = sources.columns[1:]
+
+    return sources.with_columns(
+        pl.concat_list(
+            [
+                pl.struct(pl.col(c).alias("l"), pl.lit(c[:-8]).alias("k"))
+                for c in columns
+            ]
+        ).alias("temp")
+    ).select(
+        pl.col("Contract"),
+        pl.col("temp")
+        .list.sort(descending=True)
+        .list.first()
+        .struct.field("k")
+        .alias("MostWatch"),
+    )
+
+
+IMPLEMENTATIONS = {"joined": joined_gold_table, "fused": get_gold_table}
+MOST_WATCH_IMPLEMENTATIONS = {"sorted": sorted_most_watch, "horizontal": get_most_watch}
+
+
+def _measure(target: str, implementation: str, path: str) -> dict[str, float]:
+    """
+    Build the gold table from a Parquet file of logs, or the most watched items from a Parquet pivot table,
+    in a fresh process.
+
+    Args:
+        target (str): ``gold`` or ``most_watch``.
+        implementation (str): The key of the implementation in ``IMPLEMENTATIONS`` or
+        ``MOST_WATCH_IMPLEMENTATIONS``.
+        path (str): The Parquet file of logs, or of the pivot table.
+
+    Returns:
+        dict[str, float]: The ``seconds`` taken and the ``peak_mib`` of resident memory added by the run.
+    """
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    if target == "gold":
+        IMPLEMENTATIONS[implementation](
+            pl.scan_parquet(path), app_names=APP_NAMES, column_names=COLUMN_NAMES
+        ).collect()
+    else:
+        MOST_WATCH_IMPLEMENTATIONS[implementation](pl.scan_parquet(path)).collect()
+    seconds = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+
+    return {"seconds": seconds, "peak_mib": peak / 1024}
+
+
+def benchmark_gold_table(rows: int, contracts: int, repeat: int = 3) -> pl.DataFrame:
+    """
+    Compare the joined and the fused gold table on synthetic logs.
+
+    Every run happens in its own process, so the peak resident memory of one run does not hide the next.
+
+    Args:
+        rows (int): The number of log rows.
+        contracts (int): The number of distinct contracts.
+        repeat (int): The number of runs per implementation, the fastest is kept. Defaults to 3.
+
+    Returns:
+        pl.DataFrame: The ``rows_per_sec`` and ``peak_mib`` of every implementation.
+    """
+    return _compare("gold", synthetic_logs(rows, contracts), repeat)
+
+
+def benchmark_most_watch(contracts: int, repeat: int = 3) -> pl.DataFrame:
+    """
+    Compare the sorted and the horizontal most watched items on a synthetic pivot table.
+
+    Args:
+        contracts (int): The number of contracts.
+        repeat (int): The number of runs per implementation, the fastest is kept. Defaults to 3.
+
+    Returns:
+        pl.DataFrame: The ``rows_per_sec`` and ``peak_mib`` of every implementation.
+    """
+    return _compare("most_watch", synthetic_pivot(contracts), repeat)
+
+
+def _compare(target: str, data: pl.DataFrame, repeat: int) -> pl.DataFrame:
+    """
+    Run every implementation of a target on the same data, each run in its own process.
+
+    Args:
+        target (str): ``gold`` or ``most_watch``.
+        data (pl.DataFrame): The input, written to a Parquet file read by every run.
+        repeat (int): The number of runs per implementation, the fastest is kept.
+
+    Returns:
+        pl.DataFrame: The ``rows_per_sec`` and ``peak_mib`` of every implementation.
+    """
+    implementations = (
+        IMPLEMENTATIONS if target == "gold" else MOST_WATCH_IMPLEMENTATIONS
+    )
+    rows = data.height
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"{target}.parquet")
+        data.write_parquet(path)
+        del data
+
+        for implementation in implementations:
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                    runs.append(
+                        pool.submit(_measure, target, implementation, path).result()
+                    )
+
+            best = min(runs, key=lambda run: run["seconds"])
+            results.append(
+                {
+                    "implementation": implementation,
+                    "rows": rows,
+                    "seconds": round(best["seconds"], 3),
+                    "rows_per_sec": round(rows / best["seconds"]),
+                    "peak_mib": round(max(run["peak_mib"] for run in runs), 1),
+                }
+            )
+
+    return pl.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the gold table and most watched item builds."
+    )
+    parser.add_argument("--target", choices=["gold", "most_watch"], default="gold")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--contracts", type=int, default=500_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with pl.Config(tbl_rows=-1, tbl_cols=-1):
+        if args.target == "gold":
+            print(benchmark_gold_table(args.rows, args.contracts, args.repeat))
+        else:
+            print(benchmark_most_watch(args.contracts, args.repeat))
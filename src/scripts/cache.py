@@ -0,0 +1,111 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Set
+
+import dotenv
+from pyarrow import fs
+
+dotenv.load_dotenv()
+
+# Directory of the local read-through cache of log objects.
+CACHE_DIR = os.getenv(
+    "LOG_CACHE_DIR", os.path.join(tempfile.gettempdir(), "polarspipeline-cache")
+)
+# Size cap of the cache, the least recently used objects are evicted above it.
+CACHE_MAX_BYTES = int(os.getenv("LOG_CACHE_MAX_BYTES", str(20 * 1024**3)))
+# Number of objects downloaded at once on a cache miss.
+CACHE_DOWNLOAD_WORKERS = int(os.getenv("LOG_CACHE_DOWNLOAD_WORKERS", "8"))
+
+
+def cache_objects(
+    files: List[fs.FileInfo],
+    filesystem: fs.FileSystem,
+    cache_dir: str = CACHE_DIR,
+    max_bytes: int = CACHE_MAX_BYTES,
+) -> List[str]:
+    """
+    Make local copies of object-store files through a read-through disk cache.
+
+    An object is cached under a key made of its path, size and modification time, so an unchanged object is
+    never downloaded twice while a rewritten one gets a fresh entry. Cached files keep their original file
+    name. Every hit refreshes the entry's modification time, and once the cache grows above ``max_bytes``
+    the least recently used entries, other than the requested ones, are evicted.
+
+    Args:
+        files (List[fs.FileInfo]): The files to cache, with their size and modification time.
+        filesystem (fs.FileSystem): The filesystem holding the files.
+        cache_dir (str): The cache directory. Defaults to ``LOG_CACHE_DIR``.
+        max_bytes (int): The size cap of the cache. Defaults to ``LOG_CACHE_MAX_BYTES``.
+
+    Returns:
+        List[str]: The local paths of the cached files, in the given order.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=CACHE_DOWNLOAD_WORKERS) as pool:
+        paths = list(pool.map(lambda info: _fetch(info, filesystem, cache_dir), files))
+
+    _evict(cache_dir, max_bytes, keep=set(paths))
+    return paths
+
+
+def _fetch(info: fs.FileInfo, filesystem: fs.FileSystem, cache_dir: str) -> str:
+    """
+    Return the cached copy of a file, downloading it on a miss.
+
+    Args:
+        info (fs.FileInfo): The file to cache.
+        filesystem (fs.FileSystem): The filesystem holding the file.
+        cache_dir (str): The cache directory.
+
+    Returns:
+        str: The local path of the cached file.
+    """
+    key = hashlib.sha1(
+        f"{info.path}\0{info.size}\0{info.mtime_ns}".encode()
+    ).hexdigest()
+    local_path = os.path.join(cache_dir, key, os.path.basename(info.path))
+
+    if os.path.exists(local_path):
+        os.utime(local_path)
+        return local_path
+
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    partial_path = f"{local_path}.{os.getpid()}.part"
+    with filesystem.open_input_stream(info.path, compression=None) as source:
+        with open(partial_path, "wb") as target:
+            shutil.copyfileobj(source, target, length=8 * 1024 * 1024)
+    os.replace(partial_path, local_path)
+
+    return local_path
+
+
+def _evict(cache_dir: str, max_bytes: int, keep: Set[str]) -> None:
+    """
+    Evict the least recently used cache entries until the cache fits in ``max_bytes``.
+
+    Args:
+        cache_dir (str): The cache directory.
+        max_bytes (int): The size cap of the cache.
+        keep (Set[str]): The local paths that must not be evicted.
+    """
+    entries = []
+    for key in os.listdir(cache_dir):
+        for name in os.listdir(os.path.join(cache_dir, key)):
+            if name.endswith(".part"):
+                continue
+            path = os.path.join(cache_dir, key, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+        total -= size
@@ -1,10 +1,20 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import List
 
 import dotenv
-import polars as pl
-from pipeline import get_gold_table
-from validation import validate_df
-from support import ingest_from_s3, sink_delta_to_s3
+from pipeline import (
+    get_daily_summary,
+    get_gold_table_from_summaries,
+    get_rfm_snapshots,
+    with_contract_keys,
+)
+from support import (
+    convert_to_bronze,
+    ingest_from_bronze,
+    scan_delta_from_s3,
+    sink_delta_to_s3,
+    update_contract_keys,
+)
 from schema import PA_SCHEMA, Output
 
 dotenv.load_dotenv()
@@ -12,6 +22,8 @@ dotenv.load_dotenv()
 
 def main():
     base_path = "data/log_content/"
+    bronze_path = "data/log_bronze/"
+    summary_path = "s3a://data/daily_summary"
     start_date = "20220401"
     end_date = "20220430"
     app_names = [
@@ -35,18 +47,83 @@ def main():
         "ChildDuration",
         "RelaxDuration",
     ]
-    write_options = {"engine": "rust"}
-    sources = ingest_from_s3(base_path, PA_SCHEMA).filter(
-        pl.col("Date").is_between(datetime(2022, 4, 1), datetime(2022, 4, 2))
+    # The current rows and the history in separate partitions, so current reads skip the history, see
+    # read_scd2_as_of. deltalake cannot repartition the unpartitioned results table in place, so this
+    # layout is written to its own table.
+    results_path = "s3a://data/results_scd2"
+    write_options = {"engine": "rust", "partition_by": ["is_current"]}
+    convert_to_bronze(
+        base_path,
+        bronze_path,
+        PA_SCHEMA,
+        start_date=datetime(2022, 4, 1),
+        end_date=datetime(2022, 4, 2),
+    )
+    sources = ingest_from_bronze(
+        bronze_path,
+        PA_SCHEMA,
+        start_date=datetime(2022, 4, 1),
+        end_date=datetime(2022, 4, 2),
+        columns=["Date", "Contract", "AppName", "TotalDuration"],
+        filters=[("Contract", "len>", 1)],
+    )
+    contracts = update_contract_keys(sources, "s3a://data/contract_keys")
+    sink_delta_to_s3(
+        get_daily_summary(
+            with_contract_keys(sources, contracts), app_names, column_names
+        ),
+        target=summary_path,
+        mode="replace",
+        delta_write_options={"partition_by": ["Date"]},
+    )
+    tables = get_gold_table_from_summaries(
+        scan_delta_from_s3(summary_path),
+        app_names=app_names,
+        column_names=column_names,
+        contracts=contracts,
     )
-    tables = get_gold_table(sources, app_names=app_names, column_names=column_names)
-    validate_df(tables, Output)
     sink_delta_to_s3(
         tables,
-        target="s3a://data/results",
+        target=results_path,
         mode="overwrite",
         delta_write_options=write_options,
+        model=Output,
+    )
+
+
+def backfill_rfm(reported_dates: List[str], total_dates: List[int]) -> None:
+    """
+    Rebuild the RFM history of several reported dates and window lengths from one scan of the bronze logs.
+
+    Args:
+        reported_dates (List[str]): The dates to report, e.g. ``["20220401", "20220501"]``.
+        total_dates (List[int]): The window lengths in days, e.g. ``[7, 30, 90]``.
+    """
+    base_path = "data/log_content/"
+    bronze_path = "data/log_bronze/"
+    reported = [datetime.strptime(day, "%Y%m%d") for day in reported_dates]
+    start_date = min(reported) - timedelta(days=max(total_dates))
+    end_date = max(reported) - timedelta(days=1)
+
+    convert_to_bronze(
+        base_path, bronze_path, PA_SCHEMA, start_date=start_date, end_date=end_date
+    )
+    sources = ingest_from_bronze(
+        bronze_path,
+        PA_SCHEMA,
+        start_date=start_date,
+        end_date=end_date,
+        columns=["Date", "Contract", "TotalDuration"],
+        filters=[("Contract", "len>", 1)],
     )
+    for snapshots in get_rfm_snapshots(sources, reported_dates, total_dates).values():
+        sink_delta_to_s3(
+            snapshots,
+            target="s3a://data/rfm_snapshots",
+            mode="replace",
+            partition_col="ReportedDate",
+            delta_write_options={"partition_by": ["ReportedDate"]},
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,667 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pajson
+from pyarrow import fs
+
+# Default number of bytes parsed by one task of the byte-range reader.
+DEFAULT_BLOCK_SIZE = 64 * 1024 * 1024
+# Size of the window read around a nominal block boundary to find the next newline.
+_PROBE_SIZE = 64 * 1024
+# Compression codecs of the log files, by file extension.
+COMPRESSIONS = {".gz": "gzip", ".gzip": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+_ZSTD_MAGIC = 0xFD2FB528
+_ZSTD_SKIPPABLE_MAGIC = 0x184D2A50
+
+
+def read_ndjson(
+    path: str,
+    schema: pa.Schema,
+    filesystem: fs.FileSystem,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    max_workers: Optional[int] = None,
+    predicate: Optional[pc.Expression] = None,
+) -> pa.Table:
+    """
+    Read one NDJSON file by parsing newline-aligned byte ranges in parallel.
+
+    The file is cut into blocks of roughly ``block_size`` bytes whose boundaries are moved to the next
+    newline, so no record is split. Every block is fetched with a ranged read (a ranged GET on S3) and parsed
+    into Arrow against ``schema`` on a thread pool, so the parse throughput of a single large file scales with
+    the number of cores. Only the fields of ``schema`` are decoded, and rows failing ``predicate`` are
+    dropped inside the parsing tasks. See ``iter_ndjson`` to consume the blocks as they are parsed.
+
+    Gzip and zstd files, recognized by their ``.gz``/``.zst`` extension, are downloaded whole and
+    decompressed in ``block_size`` chunks, see ``_iter_compressed``.
+
+    Args:
+        path (str): The path of the file in ``filesystem``.
+        schema (pa.Schema): The schema of the records, fields missing from it are ignored.
+        filesystem (fs.FileSystem): The filesystem holding the file.
+        block_size (int): The approximate number of bytes parsed by one task. Defaults to 64 MiB.
+        max_workers (Optional[int]): The number of parsing threads. Defaults to the number of cores.
+        predicate (Optional[pc.Expression]): A filter on the parsed records. Defaults to None.
+
+    Returns:
+        pa.Table: The parsed records, in file order.
+    """
+    tables = list(
+        iter_ndjson(path, schema, filesystem, block_size, max_workers, predicate)
+    )
+    return pa.concat_tables(tables) if tables else schema.empty_table()
+
+
+def iter_ndjson(
+    path: str,
+    schema: pa.Schema,
+    filesystem: fs.FileSystem,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    max_workers: Optional[int] = None,
+    predicate: Optional[pc.Expression] = None,
+) -> Iterator[pa.Table]:
+    """
+    Parse one NDJSON file like ``read_ndjson``, yielding the records of every block as soon as it is parsed.
+
+    At most twice as many blocks as parsing threads are read or parsed ahead of the consumer, so the memory
+    depends on the block size rather than on the file size.
+
+    Args:
+        path (str): The path of the file in ``filesystem``.
+        schema (pa.Schema): The schema of the records, fields missing from it are ignored.
+        filesystem (fs.FileSystem): The filesystem holding the file.
+        block_size (int): The approximate number of bytes parsed by one task. Defaults to 64 MiB.
+        max_workers (Optional[int]): The number of parsing threads. Defaults to the number of cores.
+        predicate (Optional[pc.Expression]): A filter on the parsed records. Defaults to None.
+
+    Yields:
+        pa.Table: The parsed records of every block, in file order.
+    """
+    compression = compression_of(path)
+    if compression is not None:
+        with filesystem.open_input_stream(path, compression=None) as stream:
+            buffer = stream.read()
+        yield from _iter_compressed(
+            buffer, compression, schema, block_size, max_workers, predicate
+        )
+        return
+
+    max_workers = max_workers or os.cpu_count()
+    with filesystem.open_input_file(path) as file:
+        ranges = _block_ranges(file, file.size(), block_size)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = deque()
+            for start, end in ranges:
+                pending.append(
+                    pool.submit(
+                        lambda start, end: _parse_block(
+                            file.read_at(end - start, start), schema, predicate
+                        ),
+                        start,
+                        end,
+                    )
+                )
+                if len(pending) > 2 * max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+def prefetch_ndjson(
+    files: List[fs.FileInfo],
+    schema: pa.Schema,
+    filesystem: fs.FileSystem,
+    max_in_flight: int = 4,
+    max_buffered_bytes: int = 512 * 1024 * 1024,
+    stats: Optional[dict[str, Any]] = None,
+    predicate: Optional[pc.Expression] = None,
+) -> Iterator[Tuple[str, pa.Table]]:
+    """
+    Read NDJSON files while prefetching the next objects, so downloads overlap with parsing.
+
+    Up to ``max_in_flight`` objects are downloaded in the background while the current one is parsed. A new
+    download only starts if the bytes being downloaded or waiting to be parsed stay below
+    ``max_buffered_bytes``; a single object larger than the cap is still fetched on its own. An object is
+    only parsed once the consumer asks for it, and the records of the previous one are released first, so
+    the memory is bounded by ``max_buffered_bytes`` plus the records of one object.
+
+    When a ``stats`` dict is given it is filled, once the files are exhausted, with the seconds spent
+    ``downloading`` (summed over the background downloads), ``io_wait`` (the parser blocked on a download)
+    and ``parsing``, the number of ``bytes`` read and the ``overlap``, the share of download time hidden
+    behind parsing. Compressed objects are decompressed while they are parsed, and yielded in parts as their
+    chunks are parsed, see ``_iter_compressed``.
+
+    Args:
+        files (List[fs.FileInfo]): The files to read, with their sizes.
+        schema (pa.Schema): The schema of the records, fields missing from it are ignored.
+        filesystem (fs.FileSystem): The filesystem holding the files.
+        max_in_flight (int): The maximum number of objects downloaded at once. Defaults to 4.
+        max_buffered_bytes (int): The cap on bytes downloaded but not parsed yet. Defaults to 512 MiB.
+        stats (Optional[dict[str, Any]]): A dict receiving the overlap report. Defaults to None.
+        predicate (Optional[pc.Expression]): A filter on the parsed records. Defaults to None.
+
+    Yields:
+        Tuple[str, pa.Table]: The path and the parsed records of every file, or of every part of a compressed
+        file, in the given order.
+    """
+
+    def _download(path: str) -> Tuple[bytes, float]:
+        started = time.perf_counter()
+        with filesystem.open_input_stream(path, compression=None) as stream:
+            return stream.read(), time.perf_counter() - started
+
+    report = {"downloading": 0.0, "io_wait": 0.0, "parsing": 0.0, "bytes": 0}
+    remaining = deque(files)
+    pending = deque()
+    buffered = 0
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        while remaining or pending:
+            while (
+                remaining
+                and len(pending) < max_in_flight
+                and (not pending or buffered + remaining[0].size <= max_buffered_bytes)
+            ):
+                info = remaining.popleft()
+                pending.append((info, pool.submit(_download, info.path)))
+                buffered += info.size
+
+            info, future = pending.popleft()
+            waited = time.perf_counter()
+            buffer, downloading = future.result()
+            report["io_wait"] += time.perf_counter() - waited
+            report["downloading"] += downloading
+            report["bytes"] += len(buffer)
+
+            parsed = time.perf_counter()
+            compression = compression_of(info.path)
+            if compression is None:
+                parts = iter([parse_ndjson(buffer, schema, predicate)])
+            else:
+                parts = _iter_compressed(
+                    buffer, compression, schema, predicate=predicate
+                )
+            for table in parts:
+                report["parsing"] += time.perf_counter() - parsed
+                yield info.path, table
+                del table
+                parsed = time.perf_counter()
+            report["parsing"] += time.perf_counter() - parsed
+            buffered -= info.size
+            del buffer, parts
+
+    if stats is not None:
+        stats.update(report)
+        stats["overlap"] = (
+            max(0.0, 1.0 - report["io_wait"] / report["downloading"])
+            if report["downloading"]
+            else 1.0
+        )
+
+
+def _block_ranges(
+    file: pa.NativeFile, size: int, block_size: int
+) -> List[Tuple[int, int]]:
+    """
+    Cut a file into ``(start, end)`` byte ranges of roughly ``block_size`` bytes that end on a newline.
+
+    Args:
+        file (pa.NativeFile): The random-access file.
+        size (int): The size of the file in bytes.
+        block_size (int): The approximate size of a range.
+
+    Returns:
+        List[Tuple[int, int]]: The ranges, covering the whole file without overlap.
+    """
+    boundaries = [0]
+    while boundaries[-1] + block_size < size:
+        boundary = _next_newline(file, boundaries[-1] + block_size, size)
+        if boundary >= size:
+            break
+        boundaries.append(boundary)
+    boundaries.append(size)
+
+    return [
+        (start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start
+    ]
+
+
+def _next_newline(file: pa.NativeFile, offset: int, size: int) -> int:
+    """
+    Find the offset just after the first newline at or after ``offset``.
+
+    Args:
+        file (pa.NativeFile): The random-access file.
+        offset (int): The offset to search from.
+        size (int): The size of the file in bytes.
+
+    Returns:
+        int: The offset of the first byte of the next line, or ``size`` if there is none.
+    """
+    while offset < size:
+        window = file.read_at(min(_PROBE_SIZE, size - offset), offset)
+        index = window.find(b"\n")
+        if index >= 0:
+            return offset + index + 1
+        offset += len(window)
+    return size
+
+
+def _parse_block(
+    block: bytes, schema: pa.Schema, predicate: Optional[pc.Expression] = None
+) -> pa.Table:
+    """
+    Parse a block of complete NDJSON lines into Arrow.
+
+    Args:
+        block (bytes): The bytes of the block.
+        schema (pa.Schema): The schema of the records.
+        predicate (Optional[pc.Expression]): A filter on the parsed records. Defaults to None.
+
+    Returns:
+        pa.Table: The parsed records.
+    """
+    if not block:
+        return schema.empty_table()
+
+    table = pajson.read_json(
+        pa.BufferReader(block),
+        read_options=pajson.ReadOptions(use_threads=False, block_size=len(block) + 1),
+        parse_options=json_parse_options(schema),
+    )
+    return _encoded(table, schema, predicate)
+
+
+def parse_ndjson(
+    buffer: bytes,
+    schema: pa.Schema,
+    predicate: Optional[pc.Expression] = None,
+    compression: Optional[str] = None,
+) -> pa.Table:
+    """
+    Parse a whole downloaded NDJSON object into Arrow, using the pyarrow thread pool.
+
+    Compressed objects are decompressed and parsed in parallel chunks, see ``_parse_compressed``.
+
+    Args:
+        buffer (bytes): The bytes of the object.
+        schema (pa.Schema): The schema of the records.
+        predicate (Optional[pc.Expression]): A filter on the parsed records. Defaults to None.
+        compression (Optional[str]): The codec of the object, ``gzip`` or ``zstd``. Defaults to None.
+
+    Returns:
+        pa.Table: The parsed records.
+    """
+    if not buffer:
+        return schema.empty_table()
+
+    if compression is not None:
+        return _parse_compressed(buffer, compression, schema, predicate=predicate)
+
+    table = pajson.read_json(
+        pa.BufferReader(buffer), parse_options=json_parse_options(schema)
+    )
+    return _encoded(table, schema, predicate)
+
+
+def _parse_compressed(
+    buffer: bytes,
+    compression: str,
+    schema: pa.Schema,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    max_workers: Optional[int] = None,
+    predicate: Optional[pc.Expression] = None,
+) -> pa.Table:
+    """
+    Decompress and parse a whole gzip or zstd NDJSON object, see ``_iter_compressed``.
+
+    Args:
+        buffer (bytes): The compressed bytes.
+        compression (str): The codec, ``gzip`` or ``zstd``.
+        schema (pa.Schema): The schema of the records.
+        block_size (int): The approximate number of decompressed bytes parsed by one task. Defaults to 64 MiB.
+        max_workers (Optional[int]): The number of parsing threads. Defaults to the number of cores.
+        predicate (Optional[pc.Expression]): A filter on the parsed records. Defaults to None.
+
+    Returns:
+        pa.Table: The parsed records, in file order.
+    """
+    return pa.concat_tables(
+        _iter_compressed(
+            buffer, compression, schema, block_size, max_workers, predicate
+        )
+    )
+
+
+def _iter_compressed(
+    buffer: bytes,
+    compression: str,
+    schema: pa.Schema,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    max_workers: Optional[int] = None,
+    predicate: Optional[pc.Expression] = None,
+) -> Iterator[pa.Table]:
+    """
+    Decompress and parse a gzip or zstd NDJSON object in parallel chunks, yielding the records of every
+    chunk as soon as it is parsed.
+
+    A zstd object made of several frames, such as the seekable format or concatenated ``zstd`` outputs, is
+    cut on frame boundaries into groups of about ``block_size`` decompressed bytes, and every group is
+    decompressed and parsed by its own task. Other objects are decompressed as one stream, ``block_size``
+    bytes at a time, while the chunks already read are parsed on the pool. The lines straddling two chunks
+    are stitched back together and parsed in order.
+
+    At most twice as many chunks as parsing threads are decompressed ahead of the consumer, and
+    ``predicate`` is applied to every chunk, so only the compressed bytes and the records passing the
+    filter are held for the whole object.
+
+    Args:
+        buffer (bytes): The compressed bytes.
+        compression (str): The codec, ``gzip`` or ``zstd``.
+        schema (pa.Schema): The schema of the records.
+        block_size (int): The approximate number of decompressed bytes parsed by one task. Defaults to 64 MiB.
+        max_workers (Optional[int]): The number of parsing threads. Defaults to the number of cores.
+        predicate (Optional[pc.Expression]): A filter on the parsed records. Defaults to None.
+
+    Yields:
+        pa.Table: The parsed records, in file order.
+    """
+    frames = _zstd_frames(buffer) if compression == "zstd" else []
+    if len(frames) > 1:
+        view = memoryview(buffer)
+        tasks = (
+            partial(_parse_frames, view[start:end], compression)
+            for start, end in _group_frames(frames, block_size)
+        )
+    else:
+        tasks = (
+            partial(_parse_chunk, chunk)
+            for chunk in _decompressed_chunks(buffer, compression, block_size)
+        )
+
+    max_workers = max_workers or os.cpu_count()
+    carry = b""
+    pending = deque()
+
+    def _stitch(head: bytes, table: Optional[pa.Table], tail: bytes) -> List[pa.Table]:
+        nonlocal carry
+        carry += head
+        if table is None:
+            return []
+        stitched = _parse_block(carry, schema, predicate)
+        carry = bytes(tail)
+        return [stitched, table]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for task in tasks:
+            pending.append(pool.submit(task, schema, predicate))
+            if len(pending) > 2 * max_workers:
+                yield from _stitch(*pending.popleft().result())
+        while pending:
+            yield from _stitch(*pending.popleft().result())
+    yield _parse_block(carry, schema, predicate)
+
+
+def _parse_frames(
+    frames: memoryview,
+    compression: str,
+    schema: pa.Schema,
+    predicate: Optional[pc.Expression] = None,
+) -> Tuple[bytes, Optional[pa.Table], bytes]:
+    """
+    Decompress a run of complete frames and parse its complete lines, see ``_parse_chunk``.
+
+    Args:
+        frames (memoryview): The compressed frames.
+        compression (str): The codec.
+        schema (pa.Schema): The schema of the records.
+        predicate (Optional[pc.Expression]): A filter on the parsed records. Defaults to None.
+
+    Returns:
+        Tuple[bytes, Optional[pa.Table], bytes]: The partial first line, the records and the partial last line.
+    """
+    with pa.CompressedInputStream(pa.BufferReader(frames), compression) as stream:
+        return _parse_chunk(stream.read(), schema, predicate)
+
+
+def _parse_chunk(
+    chunk: bytes, schema: pa.Schema, predicate: Optional[pc.Expression] = None
+) -> Tuple[bytes, Optional[pa.Table], bytes]:
+    """
+    Parse the complete lines of a decompressed chunk.
+
+    Args:
+        chunk (bytes): The decompressed bytes, which may start and end in the middle of a line.
+        schema (pa.Schema): The schema of the records.
+        predicate (Optional[pc.Expression]): A filter on the parsed records. Defaults to None.
+
+    Returns:
+        Tuple[bytes, Optional[pa.Table], bytes]: The bytes up to the first newline, the records of the
+        lines in between, or None if the chunk holds no newline, and the bytes after the last newline.
+    """
+    first = chunk.find(b"\n")
+    if first < 0:
+        return chunk, None, b""
+
+    last = chunk.rfind(b"\n")
+    view = memoryview(chunk)
+    return (
+        view[: first + 1],
+        _parse_block(view[first + 1 : last + 1], schema, predicate),
+        view[last + 1 :],
+    )
+
+
+def _decompressed_chunks(
+    buffer: bytes, compression: str, chunk_size: int
+) -> Iterator[bytes]:
+    """
+    Decompress an object as one stream.
+
+    Args:
+        buffer (bytes): The compressed bytes, concatenated gzip members or zstd frames are supported.
+        compression (str): The codec, ``gzip`` or ``zstd``.
+        chunk_size (int): The number of decompressed bytes per chunk.
+
+    Yields:
+        bytes: The decompressed chunks, in order.
+    """
+    with pa.CompressedInputStream(pa.BufferReader(buffer), compression) as stream:
+        while chunk := stream.read(chunk_size):
+            yield chunk
+
+
+def _zstd_frames(buffer: bytes) -> List[Tuple[int, int, int]]:
+    """
+    Find the frames of a zstd object by walking the frame and block headers, without decompressing.
+
+    Skippable frames, such as the seek table of the seekable format, are left out.
+
+    Args:
+        buffer (bytes): The compressed bytes.
+
+    Returns:
+        List[Tuple[int, int, int]]: The start and end offsets of every frame with its decompressed size, or
+        its compressed size when the frame header does not record it. Empty if the object is not a
+        sequence of well-formed zstd frames.
+    """
+    frames = []
+    offset = 0
+    size = len(buffer)
+    while offset + 8 <= size:
+        magic = int.from_bytes(buffer[offset : offset + 4], "little")
+        if magic & 0xFFFFFFF0 == _ZSTD_SKIPPABLE_MAGIC:
+            offset += 8 + int.from_bytes(buffer[offset + 4 : offset + 8], "little")
+            continue
+        if magic != _ZSTD_MAGIC:
+            return []
+
+        start = offset
+        descriptor = buffer[offset + 4]
+        single_segment = descriptor >> 5 & 1
+        content_size_bytes = (single_segment, 2, 4, 8)[descriptor >> 6]
+        offset += 5 + (not single_segment) + (0, 1, 2, 4)[descriptor & 3]
+        content_size = int.from_bytes(
+            buffer[offset : offset + content_size_bytes], "little"
+        ) + (256 if content_size_bytes == 2 else 0)
+        offset += content_size_bytes
+
+        last_block = False
+        while not last_block and offset + 3 <= size:
+            header = int.from_bytes(buffer[offset : offset + 3], "little")
+            last_block = bool(header & 1)
+            offset += 3 + (1 if header >> 1 & 3 == 1 else header >> 3)
+        offset += 4 * (descriptor >> 2 & 1)
+
+        if not last_block or offset > size:
+            return []
+        frames.append(
+            (start, offset, content_size if content_size_bytes else offset - start)
+        )
+
+    return frames if offset == size else []
+
+
+def _group_frames(
+    frames: List[Tuple[int, int, int]], block_size: int
+) -> List[Tuple[int, int]]:
+    """
+    Group consecutive frames into runs of about ``block_size`` decompressed bytes.
+
+    Args:
+        frames (List[Tuple[int, int, int]]): The frames found by ``_zstd_frames``.
+        block_size (int): The approximate decompressed size of a run.
+
+    Returns:
+        List[Tuple[int, int]]: The start and end offsets of every run, skippable frames in between included.
+    """
+    groups = []
+    start, total = frames[0][0], 0
+    for frame_start, frame_end, frame_size in frames:
+        if total >= block_size:
+            groups.append((start, frame_start))
+            start, total = frame_start, 0
+        total += frame_size
+    groups.append((start, frames[-1][1]))
+
+    return groups
+
+
+def compression_of(path: str) -> Optional[str]:
+    """
+    Get the compression codec of a log file from its extension.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        Optional[str]: ``gzip``, ``zstd``, or None for plain NDJSON.
+    """
+    return COMPRESSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def json_parse_options(schema: pa.Schema) -> pajson.ParseOptions:
+    """
+    Parse options decoding only the fields of ``schema``.
+
+    Fields that the schema does not declare, including nested struct fields, are skipped by the parser
+    instead of being materialized. Dictionary fields are parsed as their value type, since the JSON parser
+    cannot build dictionaries.
+
+    Args:
+        schema (pa.Schema): The schema of the records.
+
+    Returns:
+        pajson.ParseOptions: The parse options.
+    """
+    return pajson.ParseOptions(
+        explicit_schema=decoded_schema(schema), unexpected_field_behavior="ignore"
+    )
+
+
+def decoded_schema(schema: pa.Schema) -> pa.Schema:
+    """
+    Replace the dictionary types of a schema, including inside structs, by their value types.
+
+    Args:
+        schema (pa.Schema): The schema.
+
+    Returns:
+        pa.Schema: The schema without dictionaries.
+    """
+
+    def _decoded(data_type: pa.DataType) -> pa.DataType:
+        if pa.types.is_dictionary(data_type):
+            return data_type.value_type
+        if pa.types.is_struct(data_type):
+            return pa.struct(
+                [field.with_type(_decoded(field.type)) for field in data_type]
+            )
+        return data_type
+
+    return pa.schema(
+        [field.with_type(_decoded(field.type)) for field in schema], schema.metadata
+    )
+
+
+def _encoded(
+    table: pa.Table, schema: pa.Schema, predicate: Optional[pc.Expression] = None
+) -> pa.Table:
+    """
+    Filter freshly parsed records and dictionary-encode the fields that ``schema`` declares as dictionaries.
+
+    Encoding right after parsing means the low-cardinality strings are only held as codes from then on.
+
+    Args:
+        table (pa.Table): The records, as parsed with ``json_parse_options``.
+        schema (pa.Schema): The schema of the records.
+        predicate (Optional[pc.Expression]): A filter on the records. Defaults to None.
+
+    Returns:
+        pa.Table: The records with the types of ``schema``.
+    """
+    if predicate is not None:
+        table = table.filter(predicate)
+    if table.schema == schema:
+        return table
+
+    return pa.table(
+        [
+            pa.chunked_array(
+                [_encode(chunk, field.type) for chunk in column.chunks], field.type
+            )
+            for column, field in zip(table.columns, schema)
+        ],
+        schema=schema,
+    )
+
+
+def _encode(array: pa.Array, data_type: pa.DataType) -> pa.Array:
+    """
+    Dictionary-encode an array, or the children of a struct array, where ``data_type`` has dictionaries.
+
+    Args:
+        array (pa.Array): The parsed array.
+        data_type (pa.DataType): The target type.
+
+    Returns:
+        pa.Array: The array with the target type.
+    """
+    if pa.types.is_dictionary(data_type):
+        return pc.dictionary_encode(array.cast(data_type.value_type)).cast(data_type)
+    if pa.types.is_struct(data_type):
+        return pa.StructArray.from_arrays(
+            [
+                _encode(child, field.type)
+                for child, field in zip(array.flatten(), data_type)
+            ],
+            fields=list(data_type),
+            mask=array.is_null(),
+        )
+    return array.cast(data_type)
@@ -1,25 +1,40 @@
-from typing import List
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
 
 import dotenv
 import polars as pl
-import polars.selectors as ps
 from src.helpers.utils import all_combinations_with_replacement_iterative
+from src.scripts.sketches import QuantileSketch
 
 dotenv.load_dotenv()
 
+_RFM_METRICS = ["Recency", "Frequency", "Monetary"]
+
 
 def get_rfm_table(
     sources: pl.LazyFrame,
     reported_date: str = "20220501",
     total_date: int = 30,
+    sketch_size: Optional[int] = None,
+    stats: Optional[Dict[str, Any]] = None,
 ) -> pl.LazyFrame:
     """
     Generates an RFM (Recency, Frequency, Monetary) table from the provided data.
 
+    Sources keyed by ``with_contract_keys`` are grouped on ``ContractKey``, which the table keeps.
+
+    With ``sketch_size``, the tercile boundaries are read from quantile sketches instead of an exact
+    ``qcut``, see ``rfm_sketches``, and ``stats`` receives their error bounds once the table is collected.
+
     Args:
         sources (pl.LazyFrame): The source data to calculate RFM values from.
         reported_date (str, optional): The date to report. Defaults to "20220501".
         total_date (int, optional): The total number of dates to consider. Defaults to 30.
+        sketch_size (Optional[int]): The ``k`` of the quantile sketches, the rank error shrinks like ``1 / k``.
+        Defaults to None, which computes the exact terciles.
+        stats (Optional[Dict[str, Any]]): A dict filled with the error bounds of the sketches, see
+        ``rfm_sketch_stats``. Defaults to None.
 
     Returns:
         pl.LazyFrame: The resulting RFM table.
@@ -27,7 +42,8 @@ def get_rfm_table(
     if not isinstance(sources, pl.LazyFrame):
         sources = sources.lazy()
 
-    b: pl.LazyFrame = sources.group_by("Contract").agg(
+    key = _contract_key(sources)
+    b: pl.LazyFrame = sources.group_by(key).agg(
         pl.col("Date").max().alias("LatestDate")
     )
 
@@ -35,8 +51,197 @@ def get_rfm_table(
         pl.lit(reported_date).str.to_date("%Y %m %d").alias("ReportedDate")
     )
 
+    rfm = (
+        temp.filter(_is_contract(key))
+        .join(b, on=key, how="left")
+        .group_by(key)
+        .agg(
+            (pl.col("ReportedDate") - pl.col("LatestDate")).min().alias("Recency"),
+            _frequency(total_date),
+            pl.col("TotalDuration").sum().alias("Monetary"),
+        )
+        .pipe(_score_rfm, sketch_size, stats=stats)
+    )
+
+    return rfm
+
+
+def _frequency(total_date: int) -> pl.Expr:
+    """
+    The share of the ``total_date`` days on which a contract watched anything, in percent.
+
+    Args:
+        total_date (int): The total number of dates to consider.
+
+    Returns:
+        pl.Expr: The ``Frequency`` aggregation.
+    """
+    return (
+        (pl.col("Date").n_unique().cast(pl.Float32) / pl.lit(total_date) * 100.0)
+        .round(2)
+        .alias("Frequency")
+    )
+
+
+def get_rfm_snapshots(
+    sources: pl.LazyFrame,
+    reported_dates: List[str],
+    total_dates: List[int],
+    sketch_size: Optional[int] = None,
+    stats: Optional[Dict[Tuple[str, int], Dict[str, Any]]] = None,
+) -> Dict[str, pl.LazyFrame]:
+    """
+    Generates the RFM tables of several reported dates and window lengths from a single scan of the sources.
+
+    The sources are reduced once to the total duration of every contract and day, which holds everything
+    the RFM values depend on. Every snapshot is then computed lazily from that reduced frame, so only the
+    snapshots of the reported date being collected or written are held in memory. A snapshot equals ``get_rfm_table`` over the logs of the ``total_date`` days before its
+    ``reported_date``, scored against the contracts of that window only.
+
+    Args:
+        sources (pl.LazyFrame): The log rows or the daily summaries of ``get_daily_summary``, covering the
+        longest window before the earliest reported date up to the latest one.
+        reported_dates (List[str]): The dates to report, e.g. ``["20220401", "20220501"]``.
+        total_dates (List[int]): The window lengths in days, e.g. ``[7, 30, 90]``.
+        sketch_size (Optional[int]): The ``k`` of the quantile sketches, see ``get_rfm_table``. Defaults to
+        None.
+        stats (Optional[Dict[Tuple[str, int], Dict[str, Any]]]): A dict filled with the error bounds of the
+        sketches of every ``(reported_date, total_date)`` snapshot, see ``rfm_sketch_stats``. Defaults to None.
+
+    Returns:
+        Dict[str, pl.LazyFrame]: For every reported date, the ``RFM`` and ``TypeOfCustomers`` of every
+        contract, ``ReportedDate`` and ``TotalDate`` of its windows, e.g. to be written one ``ReportedDate``
+        partition at a time.
+    """
+    if not isinstance(sources, pl.LazyFrame):
+        sources = sources.lazy()
+
+    key = _contract_key(sources)
+    daily = (
+        sources.filter(_is_contract(key))
+        .group_by(key, pl.col("Date").cast(pl.Date))
+        .agg(pl.col("TotalDuration").sum())
+        .collect(streaming=True)
+        .lazy()
+    )
+
+    snapshots = {}
+    for reported_date in reported_dates:
+        reported = datetime.strptime(reported_date, "%Y%m%d").date()
+        windows = []
+        for total_date in total_dates:
+            if stats is not None:
+                stats[(reported_date, total_date)] = {}
+            windows.append(
+                daily.filter(
+                    pl.col("Date").is_between(
+                        reported - timedelta(days=total_date),
+                        reported,
+                        closed="left",
+                    )
+                )
+                .group_by(key)
+                .agg(
+                    (pl.lit(reported) - pl.col("Date").max()).alias("Recency"),
+                    _frequency(total_date),
+                    pl.col("TotalDuration").sum().alias("Monetary"),
+                )
+                .pipe(
+                    _score_rfm,
+                    sketch_size,
+                    stats=None if stats is None else stats[(reported_date, total_date)],
+                )
+                .with_columns(
+                    pl.lit(reported).alias("ReportedDate"),
+                    pl.lit(total_date, pl.Int64).alias("TotalDate"),
+                )
+            )
+
+        snapshots[reported_date] = pl.concat(windows)
+
+    return snapshots
+
+
+def _score_rfm(
+    rfm: pl.LazyFrame,
+    sketch_size: Optional[int] = None,
+    breaks: Optional[Dict[str, List[float]]] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> pl.LazyFrame:
+    """
+    Replace the ``Recency``, ``Frequency`` and ``Monetary`` values by their ``RFM`` tercile code and type of
+    customers.
+
+    Args:
+        rfm (pl.LazyFrame): One row per contract with the ``Recency``, ``Frequency`` and ``Monetary`` values.
+        sketch_size (Optional[int]): The ``k`` of the quantile sketches giving the tercile boundaries. Defaults
+        to None, which uses an exact ``qcut``. The sketches are fed when the plan runs, from the contracts
+        reaching the scoring step.
+        breaks (Optional[Dict[str, List[float]]]): The tercile boundaries of every metric, e.g. from
+        ``rfm_breaks``, used instead of computing them from ``rfm``. Defaults to None.
+        stats (Optional[Dict[str, Any]]): A dict filled with the error bounds of the sketches when the plan
+        runs, see ``rfm_sketch_stats``. Defaults to None.
+
+    Returns:
+        pl.LazyFrame: The other columns followed by ``RFM`` and ``TypeOfCustomers``.
+    """
+    if breaks is not None:
+        rfm = rfm.with_columns(
+            _tercile(metric, breaks[metric]) for metric in _RFM_METRICS
+        )
+    elif sketch_size is None:
+        rfm = rfm.with_columns(
+            pl.col(metric)
+            .qcut(3, labels=["1", "2", "3"], allow_duplicates=True)
+            .alias(metric[0])
+            for metric in _RFM_METRICS
+        )
+    else:
+
+        def _sketched(frame: pl.DataFrame) -> pl.DataFrame:
+            sketches = rfm_sketches(frame, sketch_size)
+            if stats is not None:
+                stats.update(rfm_sketch_stats(sketches))
+            return frame.with_columns(
+                _tercile(metric, metric_breaks)
+                for metric, metric_breaks in rfm_breaks(sketches).items()
+            )
+
+        # The terciles depend on every contract, so no filter, projection or slice may be pushed below the
+        # sketching.
+        rfm = rfm.map_batches(
+            _sketched,
+            schema={**rfm.schema, **{metric[0]: pl.String for metric in _RFM_METRICS}},
+            predicate_pushdown=False,
+            projection_pushdown=False,
+            slice_pushdown=False,
+        )
+
+    return (
+        rfm.with_columns(
+            pl.concat_str([pl.col("R"), pl.col("F"), pl.col("M")])
+            .alias("RFM")
+            .cast(pl.Int64),
+        )
+        .drop("Recency", "Frequency", "Monetary", "R", "F", "M")
+        # A lookup expression rather than a join, which keeps the plan on the streaming engine.
+        .with_columns(
+            pl.col("RFM")
+            .replace(_types_of_customers(), default=None, return_dtype=pl.String)
+            .alias("TypeOfCustomers")
+        )
+    )
+
+
+def _types_of_customers() -> Dict[int, str]:
+    """
+    Get the type of customers of every ``RFM`` code, the quartile of the code among the 27 possible ones.
+
+    Returns:
+        Dict[int, str]: The type of customers of every code, e.g. ``333`` is ``"champions"``.
+    """
     ref = (
-        pl.LazyFrame(
+        pl.DataFrame(
             {"RFM": all_combinations_with_replacement_iterative(["1", "2", "3"])}
         )
         .select(pl.col("RFM").list.join("").cast(pl.Int64).alias("RFM"))
@@ -55,42 +260,107 @@ def get_rfm_table(
             .alias("TypeOfCustomers"),
         )
     )
-    rfm = (
-        temp.filter(pl.col("Contract").str.len_chars() > 1)
-        .join(b, on="Contract", how="left")
-        .group_by("Contract")
-        .agg(
-            (pl.col("ReportedDate") - pl.col("LatestDate")).min().alias("Recency"),
-            (pl.col("Date").n_unique().cast(pl.Float32) / pl.lit(total_date) * 100.0)
-            .round(2)
-            .alias("Frequency"),
-            pl.col("TotalDuration").sum().alias("Monetary"),
-        )
-        .with_columns(
-            pl.col("Recency")
-            .qcut(3, labels=["1", "2", "3"], allow_duplicates=True)
-            .alias("R"),
-            pl.col("Frequency")
-            .qcut(3, labels=["1", "2", "3"], allow_duplicates=True)
-            .alias("F"),
-            pl.col("Monetary")
-            .qcut(3, labels=["1", "2", "3"], allow_duplicates=True)
-            .alias("M"),
-        )
-        .select(
-            pl.col("Contract"),
-            pl.concat_str([pl.col("R"), pl.col("F"), pl.col("M")])
-            .alias("RFM")
-            .cast(pl.Int64),
-        )
-        .join(
-            ref,
-            on="RFM",
-            how="left",
-        )
-    )
+    return dict(ref.iter_rows())
 
-    return rfm
+
+def rfm_sketches(
+    rfm: pl.DataFrame, sketch_size: int = 200
+) -> Dict[str, QuantileSketch]:
+    """
+    Summarize the ``Recency``, ``Frequency`` and ``Monetary`` values of contracts into quantile sketches.
+
+    The sketches of disjoint sets of contracts, e.g. the hash partitions of a larger-than-memory table, can
+    be combined with ``merge_rfm_sketches``, so the tercile boundaries of the whole table are known without
+    a second pass over the partitions. ``Recency`` is sketched on its physical value, in the time unit of
+    the durations.
+
+    Args:
+        rfm (pl.DataFrame): One row per contract with the ``Recency``, ``Frequency`` and ``Monetary`` values.
+        sketch_size (int): The ``k`` of the sketches. Defaults to 200.
+
+    Returns:
+        Dict[str, QuantileSketch]: The sketch of every metric.
+    """
+    return {
+        metric: QuantileSketch(sketch_size).update(rfm[metric].to_physical().to_numpy())
+        for metric in _RFM_METRICS
+    }
+
+
+def merge_rfm_sketches(
+    sketches: List[Dict[str, QuantileSketch]],
+) -> Dict[str, QuantileSketch]:
+    """
+    Combine the RFM sketches of disjoint sets of contracts.
+
+    Args:
+        sketches (List[Dict[str, QuantileSketch]]): The sketches returned by ``rfm_sketches``.
+
+    Returns:
+        Dict[str, QuantileSketch]: The sketches of all the contracts.
+    """
+    merged = {metric: QuantileSketch(sketches[0][metric].k) for metric in _RFM_METRICS}
+    for partition in sketches:
+        for metric, sketch in partition.items():
+            merged[metric].merge(sketch)
+
+    return merged
+
+
+def rfm_breaks(sketches: Dict[str, QuantileSketch]) -> Dict[str, List[float]]:
+    """
+    Get the tercile boundaries of every RFM metric from its sketch.
+
+    Args:
+        sketches (Dict[str, QuantileSketch]): The sketches of ``rfm_sketches``.
+
+    Returns:
+        Dict[str, List[float]]: The two boundaries of every metric.
+    """
+    return {
+        metric: sketch.quantiles([1 / 3, 2 / 3]) for metric, sketch in sketches.items()
+    }
+
+
+def rfm_sketch_stats(sketches: Dict[str, QuantileSketch]) -> Dict[str, Any]:
+    """
+    Get the error bounds of the RFM sketches, to check the approximate terciles.
+
+    Args:
+        sketches (Dict[str, QuantileSketch]): The sketches of ``rfm_sketches``.
+
+    Returns:
+        Dict[str, Any]: The number of ``contracts`` sketched and, for every metric, its guaranteed
+        ``rank_error`` and its ``probable_rank_error`` at 99% confidence.
+    """
+    return {
+        "contracts": next(iter(sketches.values())).count,
+        **{
+            metric: {
+                "rank_error": sketch.rank_error,
+                "probable_rank_error": sketch.probable_rank_error(),
+            }
+            for metric, sketch in sketches.items()
+        },
+    }
+
+
+def _tercile(metric: str, breaks: List[float]) -> pl.Expr:
+    """
+    Label a metric with ``1``, ``2`` or ``3`` like ``qcut(3, allow_duplicates=True)``, given its boundaries.
+
+    Args:
+        metric (str): The metric column.
+        breaks (List[float]): The two boundaries, a value equal to a boundary falls in the lower tercile.
+
+    Returns:
+        pl.Expr: The label, named after the first letter of the metric.
+    """
+    return (
+        (pl.sum_horizontal([pl.col(metric).to_physical() > b for b in breaks]) + 1)
+        .cast(pl.String)
+        .alias(metric[0])
+    )
 
 
 def get_pivot_table(
@@ -101,6 +371,8 @@ def get_pivot_table(
     """
     Function to pivot data based on the provided sources, app_names, and column_names.
 
+    Sources keyed by ``with_contract_keys`` are grouped on ``ContractKey``, which the table keeps.
+
     Args:
         sources (pl.LazyFrame): The input lazy frame containing the data.
         app_names (List[str]): The list of application names.
@@ -115,104 +387,569 @@ def get_pivot_table(
     if len(app_names) != len(column_names):
         raise ValueError("The lengths of app_names and column_names must be the same")
 
-    mapping = dict(zip(app_names, column_names))
+    key = _contract_key(sources)
+    categories = list(set(column_names))
     pivot_df: pl.LazyFrame = (
         sources.select(
-            pl.col("Contract"),
+            pl.col(key),
             pl.col("TotalDuration"),
-            pl.col("AppName").replace(mapping, default="Unknown").alias("Type"),
+            _category(app_names, column_names, categories).alias("Type"),
         )
         .filter(
-            (pl.col("Contract").str.len_chars() > 1)
-            & (pl.col("Type") != "Unknown")
+            _is_contract(key)
+            & pl.col("Type").is_not_null()
             & (pl.col("TotalDuration") > 0)
         )
-        .group_by(["Contract"])
+        .group_by([key])
         .agg(
             [
-                pl.when(pl.col("Type") == y)
+                pl.when(pl.col("Type").to_physical() == code)
                 .then(pl.col("TotalDuration"))
                 .sum()
                 .alias(y)
-                for y in set(column_names)
+                for code, y in enumerate(categories)
             ]
         )
-        .sort(["Contract", "TVDuration"])
+        .sort([key, "TVDuration"])
     )
 
     return pivot_df
 
 
+def _category(
+    app_names: List[str], column_names: List[str], categories: List[str]
+) -> pl.Expr:
+    """
+    Map ``AppName`` to its category as an Enum, so the categories are compared by their integer codes.
+
+    Args:
+        app_names (List[str]): The list of application names.
+        column_names (List[str]): The category of every application.
+        categories (List[str]): The categories, in the order of their codes.
+
+    Returns:
+        pl.Expr: The category, null for unknown applications.
+    """
+    return pl.col("AppName").replace(
+        dict(zip(app_names, column_names)),
+        default=None,
+        return_dtype=pl.Enum(categories),
+    )
+
+
+def with_contract_keys(
+    sources: pl.LazyFrame, contracts: pl.DataFrame | pl.LazyFrame
+) -> pl.LazyFrame:
+    """
+    Replace the ``Contract`` strings of the log rows by their integer surrogate keys.
+
+    The rows are matched to the dictionary once, so the later group-bys and joins hash a fixed-width
+    ``ContractKey`` instead of strings. Rows of contracts without a key, the placeholders, are dropped. A
+    ``Mac`` column is packed into a ``UInt64`` as well.
+
+    Args:
+        sources (pl.LazyFrame): The log rows.
+        contracts (pl.DataFrame | pl.LazyFrame): The contract dictionary from ``update_contract_keys``.
+
+    Returns:
+        pl.LazyFrame: The log rows with ``ContractKey`` in place of ``Contract``.
+    """
+    if not isinstance(sources, pl.LazyFrame):
+        sources = sources.lazy()
+
+    keyed = sources.with_columns(pl.col("Contract").cast(pl.String)).join(
+        contracts.lazy(), on="Contract", how="inner"
+    )
+    if "Mac" in sources.columns:
+        keyed = keyed.with_columns(pack_mac())
+
+    return keyed.select(
+        pl.col("ContractKey" if name == "Contract" else name)
+        for name in sources.columns
+    )
+
+
+def restore_contracts(
+    table: pl.LazyFrame, contracts: pl.DataFrame | pl.LazyFrame
+) -> pl.LazyFrame:
+    """
+    Replace the ``ContractKey`` of a table by the ``Contract`` string it stands for.
+
+    Args:
+        table (pl.LazyFrame): A table keyed by ``ContractKey``, e.g. an aggregate of ``with_contract_keys``.
+        contracts (pl.DataFrame | pl.LazyFrame): The contract dictionary the table was keyed with.
+
+    Returns:
+        pl.LazyFrame: The table with ``Contract`` in place of ``ContractKey``.
+    """
+    if not isinstance(table, pl.LazyFrame):
+        table = table.lazy()
+
+    return table.join(contracts.lazy(), on="ContractKey", how="left").select(
+        pl.col("Contract" if name == "ContractKey" else name) for name in table.columns
+    )
+
+
+def pack_mac(column: str = "Mac") -> pl.Expr:
+    """
+    Pack a MAC address of 12 hex digits, with or without ``:``, ``-`` or ``.`` separators, into a ``UInt64``.
+
+    Args:
+        column (str): The MAC column. Defaults to "Mac".
+
+    Returns:
+        pl.Expr: The packed address, null for a malformed one.
+    """
+    digits = pl.col(column).str.replace_all("[:.-]", "")
+    return (
+        pl.when(digits.str.contains("^[0-9A-Fa-f]{12}$"))
+        .then(digits.str.to_integer(base=16, strict=False))
+        .cast(pl.UInt64)
+        .alias(column)
+    )
+
+
+def _contract_key(sources: pl.LazyFrame) -> str:
+    """The contract column of the sources, ``ContractKey`` once keyed by ``with_contract_keys``."""
+    return "ContractKey" if "ContractKey" in sources.columns else "Contract"
+
+
+def _is_contract(key: str) -> pl.Expr:
+    """
+    Filter out the placeholder contracts of one character or less, which keyed sources no longer hold.
+
+    Args:
+        key (str): The contract column, see ``_contract_key``.
+
+    Returns:
+        pl.Expr: The filter.
+    """
+    if key == "Contract":
+        return pl.col("Contract").str.len_chars() > 1
+    return pl.col(key).is_not_null()
+
+
 def get_most_watch(
     sources: pl.LazyFrame,
     reported_date: str = "20220501",
+    top_k: int = 1,
+    priority: Optional[List[str]] = None,
+    shares: bool = False,
 ) -> pl.LazyFrame:
     """
     Get the most watched item for each contract in the LazyFrame.
 
+    The items are ranked with horizontal column operations: every rank takes the maximum of the durations
+    not ranked yet and masks the winning column, so no list is built per contract. A tie goes to the item
+    coming first in ``priority``.
+
     Args:
         sources (pl.LazyFrame): The pivot lazyframe from the get_pivot_data function
         reported_date (str): the new reported date for log data
+        top_k (int): The number of items to rank. Defaults to 1, which only gives ``MostWatch``; the item of
+        rank ``i > 1`` is ``MostWatch{i}``.
+        priority (Optional[List[str]]): The items, e.g. ``"TV"`` for ``TVDuration``, in the order that wins
+        ties. Defaults to None, the descending order of the items.
+        shares (bool): Add the share of the total duration of every ranked item, ``MostWatchShare`` and
+        ``MostWatch{i}Share``. Defaults to False.
 
     Returns:
         pl.LazyFrame: The LazyFrame with the most watched item for each contract.
     """
     if not isinstance(sources, pl.LazyFrame):
         sources = sources.lazy()
+    key = _contract_key(sources)
     columns = sources.columns[1:]
-    watch_type = [item[:-8] for item in columns]
+    watch_type = {item[:-8]: item for item in columns}
 
-    return sources.with_columns(
-        pl.concat_list(
-            [
-                pl.struct(pl.col(c).alias("l"), pl.lit(v).alias("k"))
-                for c, v in zip(columns, watch_type)
-            ]
-        ).alias("temp")
-    ).select(
-        pl.col("Contract"),
-        pl.col("temp")
-        .list.sort(descending=True)
-        .list.first()
-        .struct.field("k")
-        .alias("MostWatch"),
+    if priority is None:
+        priority = sorted(watch_type, reverse=True)
+    if sorted(priority) != sorted(watch_type):
+        raise ValueError(
+            f"The priority, {priority!r}, has to list the items {sorted(watch_type)!r}"
+        )
+    if not 1 <= top_k <= len(columns):
+        raise ValueError(f"top_k must be between 1 and {len(columns)}, got {top_k}")
+
+    remaining = {item: f"_{watch_type[item]}" for item in priority}
+    ranked = sources.with_columns(
+        pl.col(column).alias(remaining[item]) for item, column in watch_type.items()
+    )
+    outputs = []
+    for rank in range(1, top_k + 1):
+        name = "MostWatch" if rank == 1 else f"MostWatch{rank}"
+        ranked = ranked.with_columns(
+            _most_watched(remaining).alias(name),
+            pl.max_horizontal(remaining.values()).alias(f"{name}Share"),
+        ).with_columns(
+            pl.when(pl.col(name) == item)
+            .then(None)
+            .otherwise(pl.col(column))
+            .alias(column)
+            for item, column in remaining.items()
+        )
+        outputs.append(name)
+
+    total = pl.sum_horizontal(columns)
+    selected = [pl.col(key)]
+    for name in outputs:
+        selected.append(pl.col(name))
+        if shares:
+            selected.append(
+                pl.when(total > 0)
+                .then(pl.col(f"{name}Share") / total)
+                .alias(f"{name}Share")
+            )
+
+    return ranked.select(selected)
+
+
+def _most_watched(columns: Dict[str, str]) -> pl.Expr:
+    """
+    Get the item of the longest duration, a tie going to the item coming first.
+
+    Args:
+        columns (Dict[str, str]): The duration column of every item, in the order that wins ties.
+
+    Returns:
+        pl.Expr: The item, null when every duration is null.
+    """
+    best = pl.max_horizontal(columns.values())
+    return pl.coalesce(
+        pl.when(pl.col(column) == best).then(pl.lit(item))
+        for item, column in columns.items()
     )
 
 
 def get_gold_table(
     sources: pl.LazyFrame,
     reported_date="20220501",
+    total_date: int = 30,
     **options,
 ) -> pl.LazyFrame:
     """
     Get the gold table from the delta lake.
 
+    The RFM values and the per-category durations are computed in a single group-by over the sources, instead
+    of joining the separate ``get_rfm_table`` and ``get_pivot_table`` plans, which scan and group the sources
+    twice and join every row back to its latest date. The result is the same: one row per contract having
+    a positive duration in a known category, scored against every contract of the sources. The
+    ``sketch_size`` option scores with approximate terciles, whose error bounds fill the ``stats`` option,
+    see ``get_rfm_table``.
+
+    Sources keyed by ``with_contract_keys`` are aggregated on ``ContractKey``, and the ``contracts``
+    option, the dictionary they were keyed with, restores the ``Contract`` strings of the gold rows only.
+
+    Args:
+        sources (pl.LazyFrame): The log rows of the ``total_date`` days before ``reported_date``.
+        reported_date (str): The date to report. Defaults to "20220501".
+        total_date (int): The number of days the ``Frequency`` is relative to. Defaults to 30.
+
     Returns:
         pl.LazyFrame: The gold table.
     """
+    if not isinstance(sources, pl.LazyFrame):
+        sources = sources.lazy()
+
     app_names = options.get("app_names")
     column_names = options.get("column_names")
+    if len(app_names) != len(column_names):
+        raise ValueError("The lengths of app_names and column_names must be the same")
 
-    rfm_tbl = get_rfm_table(sources)
-    pivot_tbl = get_pivot_table(sources, app_names, column_names)
-    most_watch_tbl = get_most_watch(pivot_tbl)
+    key = _contract_key(sources)
+    contracts = options.get("contracts")
+    if key != "Contract" and contracts is None:
+        raise ValueError("Sources keyed by ContractKey need the contracts option")
+
+    duration_names = list(set(column_names))
+    gold = (
+        _gold_aggregates(
+            sources, app_names, column_names, duration_names, reported_date, total_date
+        )
+        .pipe(_score_rfm, options.get("sketch_size"), stats=options.get("stats"))
+        .filter(pl.col("Watched"))
+    )
+
+    return _publish_gold(gold, duration_names, reported_date, contracts)
+
+
+def get_gold_table_from_buckets(
+    buckets: List[str],
+    directory: str,
+    reported_date: str = "20220501",
+    total_date: int = 30,
+    **options,
+) -> pl.LazyFrame:
+    """
+    Get the gold table bucket by bucket from the hash partitions of ``support.partition_by_contract``.
+
+    Every contract lives in a single bucket, so a bucket is aggregated on its own and only one bucket is in
+    memory at a time. The aggregates, one row per contract, are written to ``directory``. The RFM terciles
+    are the only values depending on all the contracts: they are the exact quantiles of the aggregated
+    metrics or, with the ``sketch_size`` option, the merged sketches of every bucket, which keeps the
+    memory bounded by the bucket size. The scored buckets are concatenated at the end, into a plan the
+    streaming engine runs, e.g. when it is written by ``support.sink_delta_to_s3``.
+
+    Args:
+        buckets (List[str]): The Parquet files of the buckets.
+        directory (str): The directory receiving the aggregates of the buckets, read by the returned plan.
+        reported_date (str): The date to report. Defaults to "20220501".
+        total_date (int): The number of days the ``Frequency`` is relative to. Defaults to 30.
+
+    Returns:
+        pl.LazyFrame: The gold table, the same rows as ``get_gold_table`` over all the buckets, sorted by
+        ``Contract`` within every bucket.
+    """
+    app_names = options.get("app_names")
+    column_names = options.get("column_names")
+    if len(app_names) != len(column_names):
+        raise ValueError("The lengths of app_names and column_names must be the same")
+
+    contracts = options.get("contracts")
+    sketch_size = options.get("sketch_size")
+    duration_names = list(set(column_names))
+    os.makedirs(directory, exist_ok=True)
+
+    aggregates = []
+    sketches = []
+    for bucket, path in enumerate(buckets):
+        sources = pl.scan_parquet(path)
+        if _contract_key(sources) != "Contract" and contracts is None:
+            raise ValueError("Sources keyed by ContractKey need the contracts option")
+
+        aggregate = _gold_aggregates(
+            sources, app_names, column_names, duration_names, reported_date, total_date
+        ).collect(streaming=True)
+        if sketch_size is not None:
+            sketches.append(rfm_sketches(aggregate, sketch_size))
+
+        aggregates.append(os.path.join(directory, f"aggregate-{bucket:05d}.parquet"))
+        aggregate.write_parquet(aggregates[-1])
+        del aggregate
+
+    if sketch_size is None:
+        quantiles = (
+            pl.concat([pl.scan_parquet(path) for path in aggregates])
+            .select(
+                pl.col(metric).to_physical().quantile(q, "linear").alias(f"{metric}{q}")
+                for metric in _RFM_METRICS
+                for q in (1 / 3, 2 / 3)
+            )
+            .collect()
+            .row(0)
+        )
+        breaks = {
+            metric: list(quantiles[2 * i : 2 * i + 2])
+            for i, metric in enumerate(_RFM_METRICS)
+        }
+    else:
+        merged = merge_rfm_sketches(sketches)
+        breaks = rfm_breaks(merged)
+        if options.get("stats") is not None:
+            options["stats"].update(rfm_sketch_stats(merged))
+
+    # Every contract lives in a single bucket, so every bucket is published and sorted on its own, which
+    # keeps the plan on the streaming engine without a sort over all the contracts.
+    return pl.concat(
+        [
+            _publish_gold(
+                pl.scan_parquet(path)
+                .pipe(_score_rfm, breaks=breaks)
+                .filter(pl.col("Watched")),
+                duration_names,
+                reported_date,
+                contracts,
+            )
+            for path in aggregates
+        ]
+    )
+
+
+def _gold_aggregates(
+    sources: pl.LazyFrame,
+    app_names: List[str],
+    column_names: List[str],
+    duration_names: List[str],
+    reported_date: str,
+    total_date: int,
+) -> pl.LazyFrame:
+    """
+    Aggregate the log rows into the unscored gold values of every contract.
+
+    Args:
+        sources (pl.LazyFrame): The log rows, optionally keyed by ``with_contract_keys``.
+        app_names (List[str]): The list of application names.
+        column_names (List[str]): The category of every application.
+        duration_names (List[str]): The categories, in the order of their codes.
+        reported_date (str): The date the ``Recency`` is measured from.
+        total_date (int): The number of days the ``Frequency`` is relative to.
+
+    Returns:
+        pl.LazyFrame: One row per contract with the ``Recency``, ``Frequency`` and ``Monetary`` values, the
+        durations and whether the contract ``Watched`` a known category.
+    """
+    key = _contract_key(sources)
+    watched = pl.col("TotalDuration") > 0
 
     return (
-        pivot_tbl.join(rfm_tbl, on="Contract", how="left")
-        .join(most_watch_tbl, on="Contract", how="left")
-        .with_columns(
-            pl.sum_horizontal(ps.ends_with("Duration")).alias("SumDuration"),
-            pl.lit(True).alias("is_current"),
-            pl.lit(reported_date)
-            .str.strptime(pl.Datetime, format="%Y %m %d")
-            .alias("effective_time"),
-            pl.lit(None, pl.Datetime).alias("end_time"),
-        )
-        .select(
-            pl.col("Contract"),
-            ps.ends_with("Duration"),
-            pl.col(
-                "RFM", "TypeOfCustomers", "is_current", "effective_time", "end_time"
-            ),
+        sources.filter(_is_contract(key))
+        .with_columns(_category(app_names, column_names, duration_names).alias("Type"))
+        .group_by(key)
+        .agg(
+            (
+                pl.lit(reported_date).str.to_date("%Y %m %d") - pl.col("Date").max()
+            ).alias("Recency"),
+            _frequency(total_date),
+            pl.col("TotalDuration").sum().alias("Monetary"),
+            *[
+                pl.col("TotalDuration")
+                .filter(watched & (pl.col("Type").to_physical() == code))
+                .sum()
+                .alias(y)
+                for code, y in enumerate(duration_names)
+            ],
+            (watched & pl.col("Type").is_not_null()).any().alias("Watched"),
+        )
+    )
+
+
+def get_daily_summary(
+    sources: pl.LazyFrame,
+    app_names: List[str],
+    column_names: List[str],
+) -> pl.LazyFrame:
+    """
+    Summarize the log rows per contract and day, the input of ``get_gold_table_from_summaries``.
+
+    A day of logs is summarized once and its summary kept, e.g. in a delta table partitioned by ``Date``, so
+    a daily gold refresh only scans the new day of raw logs.
+
+    Args:
+        sources (pl.LazyFrame): The log rows, optionally keyed by ``with_contract_keys``.
+        app_names (List[str]): The list of application names.
+        column_names (List[str]): The category of every application.
+
+    Returns:
+        pl.LazyFrame: One row per contract and ``Date`` with the number of ``Events``, the ``TotalDuration``
+        of all of them and the positive duration of every category.
+    """
+    if not isinstance(sources, pl.LazyFrame):
+        sources = sources.lazy()
+
+    if len(app_names) != len(column_names):
+        raise ValueError("The lengths of app_names and column_names must be the same")
+
+    key = _contract_key(sources)
+    watched = pl.col("TotalDuration") > 0
+    duration_names = list(dict.fromkeys(column_names))
+
+    return (
+        sources.filter(_is_contract(key))
+        .with_columns(_category(app_names, column_names, duration_names).alias("Type"))
+        .group_by(key, "Date")
+        .agg(
+            pl.len().cast(pl.Int64).alias("Events"),
+            pl.col("TotalDuration").sum(),
+            *[
+                pl.col("TotalDuration")
+                .filter(watched & (pl.col("Type").to_physical() == code))
+                .sum()
+                .alias(y)
+                for code, y in enumerate(duration_names)
+            ],
         )
     )
+
+
+def get_gold_table_from_summaries(
+    summaries: pl.LazyFrame,
+    reported_date: str = "20220501",
+    total_date: int = 30,
+    **options,
+) -> pl.LazyFrame:
+    """
+    Get the gold table from the daily summaries of the ``total_date`` days before ``reported_date``.
+
+    The contracts are scored and pivoted from one summary row per day instead of every log row, which gives
+    the same table as ``get_gold_table`` over the logs of these days. The most watched items follow from
+    the duration columns with ``get_most_watch``.
+
+    Args:
+        summaries (pl.LazyFrame): The daily summaries from ``get_daily_summary``, e.g. scanned from their
+        delta table.
+        reported_date (str): The date to report, the day after the last summarized one. Defaults to
+        "20220501".
+        total_date (int): The number of days to consider. Defaults to 30.
+
+    Returns:
+        pl.LazyFrame: The gold table.
+    """
+    if not isinstance(summaries, pl.LazyFrame):
+        summaries = summaries.lazy()
+
+    key = _contract_key(summaries)
+    contracts = options.get("contracts")
+    if key != "Contract" and contracts is None:
+        raise ValueError("Summaries keyed by ContractKey need the contracts option")
+
+    duration_names = list(set(options.get("column_names")))
+    reported = pl.lit(reported_date).str.to_date("%Y %m %d")
+    day = pl.col("Date").cast(pl.Date)
+
+    gold = (
+        summaries.filter(
+            (day < reported) & (day >= reported - pl.duration(days=total_date))
+        )
+        .group_by(key)
+        .agg(
+            (reported - pl.col("Date").max()).alias("Recency"),
+            _frequency(total_date),
+            pl.col("TotalDuration").sum().alias("Monetary"),
+            *[pl.col(y).sum() for y in duration_names],
+        )
+        .pipe(_score_rfm, options.get("sketch_size"), stats=options.get("stats"))
+        .filter(pl.sum_horizontal(duration_names) > 0)
+    )
+
+    return _publish_gold(gold, duration_names, reported_date, contracts)
+
+
+def _publish_gold(
+    gold: pl.LazyFrame,
+    duration_names: List[str],
+    reported_date: str,
+    contracts: Optional[pl.DataFrame | pl.LazyFrame],
+) -> pl.LazyFrame:
+    """
+    Shape the scored contracts into the published gold table, the columns of ``schema.Output``.
+
+    The ``MostWatch`` item is ranked like ``get_most_watch`` with its default priority.
+
+    Args:
+        gold (pl.LazyFrame): One row per contract with its durations, ``RFM`` and ``TypeOfCustomers``.
+        duration_names (List[str]): The duration columns.
+        reported_date (str): The date to report, the ``effective_time`` of the rows.
+        contracts (Optional[pl.DataFrame | pl.LazyFrame]): The contract dictionary restoring the ``Contract``
+        strings of a table keyed by ``ContractKey``.
+
+    Returns:
+        pl.LazyFrame: The gold table, sorted by ``Contract``.
+    """
+    if "ContractKey" in gold.columns:
+        gold = restore_contracts(gold, contracts)
+    watch_type = {column[:-8]: column for column in duration_names}
+
+    return gold.sort("Contract").select(
+        pl.col("Contract"),
+        *duration_names,
+        pl.sum_horizontal(duration_names).alias("SumDuration"),
+        pl.col("RFM", "TypeOfCustomers"),
+        _most_watched(
+            {item: watch_type[item] for item in sorted(watch_type, reverse=True)}
+        ).alias("MostWatch"),
+        pl.lit(True).alias("is_current"),
+        pl.lit(reported_date)
+        .str.strptime(pl.Datetime, format="%Y %m %d")
+        .alias("effective_time"),
+        pl.lit(None, pl.Datetime).alias("end_time"),
+    )
@@ -6,9 +6,11 @@ import pyarrow as pa
 import patito as pt
 from patito import Model
 
+# The low-cardinality fields (_index, _type and AppName) are dictionary-encoded from ingest onward and
+# read as Categorical by polars.
 PL_SCHEMA = {
-    "_index": pl.String,
-    "_type": pl.String,
+    "_index": pl.Categorical,
+    "_type": pl.Categorical,
     "_id": pl.String,
     "_score": pl.Int64,
     "_source": pl.Struct(
@@ -16,15 +18,15 @@ PL_SCHEMA = {
             pl.Field("Contract", pl.String),
             pl.Field("Mac", pl.String),
             pl.Field("TotalDuration", pl.Int64),
-            pl.Field("AppName", pl.String),
+            pl.Field("AppName", pl.Categorical),
         ]
     ),
 }
 
 PA_SCHEMA = pa.schema(
     [
-        pa.field("_index", pa.string()),
-        pa.field("_type", pa.string()),
+        pa.field("_index", pa.dictionary(pa.int32(), pa.string())),
+        pa.field("_type", pa.dictionary(pa.int32(), pa.string())),
         pa.field("_id", pa.string()),
         pa.field("_score", pa.int64()),
         pa.field(
@@ -34,7 +36,7 @@ PA_SCHEMA = pa.schema(
                     pa.field("Contract", pa.string()),
                     pa.field("Mac", pa.string()),
                     pa.field("TotalDuration", pa.int64()),
-                    pa.field("AppName", pa.string()),
+                    pa.field("AppName", pa.dictionary(pa.int32(), pa.string())),
                 ]
             ),
         ),
@@ -49,7 +51,9 @@ class Output(Model):
     SportDuration: int = pt.Field(dtype=pl.Int64)
     RelaxDuration: int = pt.Field(dtype=pl.Int64)
     MovieDuration: int = pt.Field(dtype=pl.Int64)
+    SumDuration: int = pt.Field(dtype=pl.Int64)
     RFM: int = pt.Field(dtype=pl.Int64)
+    TypeOfCustomers: str = pt.Field(dtype=pl.String)
     MostWatch: str = pt.Field(dtype=pl.String)
     is_current: bool = pt.Field(dtype=pl.Boolean)
     effective_time: datetime = pt.Field(dtype=pl.Datetime)
@@ -0,0 +1,156 @@
+import math
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+
+class QuantileSketch:
+    """
+    A mergeable KLL quantile sketch over a stream of numbers.
+
+    Values go into a hierarchy of compactors: level ``h`` holds items standing for ``2 ** h`` values each.
+    When a level outgrows its capacity it is sorted and every other item, starting at a random offset, is
+    promoted to the next level. The capacities shrink geometrically below the top level, so the sketch keeps
+    ``O(k)`` items whatever the number of values, and two sketches are merged by concatenating their levels.
+
+    Every compaction at level ``h`` moves the rank of any value by at most ``2 ** h``. The sketch sums these
+    weights into ``rank_error``, a guaranteed bound on the rank error it has accumulated. Since the random
+    offsets make the compaction errors zero-mean and independent, it also keeps their variance, from which
+    ``probable_rank_error`` derives a much tighter Hoeffding bound. Both are normalized by ``count``, and
+    are zero as long as nothing was compacted.
+    """
+
+    def __init__(self, k: int = 200, seed: Optional[int] = None) -> None:
+        """
+        Args:
+            k (int): The capacity of the top level, the normalized rank error shrinks like ``1 / k``.
+            Defaults to 200.
+            seed (Optional[int]): The seed of the compaction offsets. Defaults to None.
+        """
+        if k < 8:
+            raise ValueError("k must be at least 8")
+
+        self.k = k
+        self.count = 0
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self._error = 0
+        self._variance = 0
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values: Iterable[float]) -> "QuantileSketch":
+        """
+        Add values to the sketch, NaN and nulls are ignored.
+
+        Args:
+            values (Iterable[float]): The values, e.g. a numpy array or a polars Series.
+
+        Returns:
+            QuantileSketch: The sketch itself.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self._compress()
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """
+        Add the values summarized by another sketch, e.g. the one of another partition.
+
+        Args:
+            other (QuantileSketch): A sketch with the same ``k``.
+
+        Returns:
+            QuantileSketch: The sketch itself.
+        """
+        if other.k != self.k:
+            raise ValueError(f"Cannot merge sketches with k={self.k} and k={other.k}")
+
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+
+        self.count += other.count
+        self._error += other._error
+        self._variance += other._variance
+        self._compress()
+        return self
+
+    def quantiles(self, fractions: Iterable[float]) -> List[float]:
+        """
+        Get the values at the given fractions of the rank, like ``pl.Series.quantile`` with ``lower``.
+
+        As no value lies between two consecutive items, cutting at these quantiles puts the values in the
+        same bins as ``qcut``, which interpolates linearly.
+
+        Args:
+            fractions (Iterable[float]): The fractions, between 0 and 1.
+
+        Returns:
+            List[float]: The quantiles, or NaN for an empty sketch.
+        """
+        fractions = list(fractions)
+        if self.count == 0:
+            return [math.nan] * len(fractions)
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [np.full(len(kept), 2**level) for level, kept in enumerate(self.levels)]
+        )
+        order = np.argsort(items, kind="stable")
+        items, ranks = items[order], np.cumsum(weights[order])
+        total = ranks[-1]
+
+        return [
+            float(items[np.searchsorted(ranks, int(q * (total - 1)), side="right")])
+            for q in fractions
+        ]
+
+    @property
+    def rank_error(self) -> float:
+        """The guaranteed normalized rank error of the quantiles."""
+        return self._error / self.count if self.count else 0.0
+
+    def probable_rank_error(self, confidence: float = 0.99) -> float:
+        """
+        Get the normalized rank error that the quantiles stay within with the given probability.
+
+        Args:
+            confidence (float): The probability. Defaults to 0.99.
+
+        Returns:
+            float: The Hoeffding bound on the normalized rank error, never above ``rank_error``.
+        """
+        if not self.count:
+            return 0.0
+        bound = math.sqrt(2 * math.log(2 / (1 - confidence)) * self._variance)
+        return min(bound, self._error) / self.count
+
+    def _capacity(self, level: int) -> int:
+        """The number of items ``level`` holds before it is compacted."""
+        depth = len(self.levels) - 1 - level
+        return max(8, math.ceil(self.k * (2 / 3) ** depth))
+
+    def _compress(self) -> None:
+        """Compact every level above its capacity, from the bottom up."""
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+
+                items = np.sort(items)
+                kept = items[len(items) - len(items) % 2 :]
+                promoted = items[self._rng.integers(2) : len(items) - len(kept) : 2]
+
+                self.levels[level] = kept
+                self.levels[level + 1] = np.concatenate(
+                    [self.levels[level + 1], promoted]
+                )
+                self._error += 2**level
+                self._variance += 4**level
+            level += 1
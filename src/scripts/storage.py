@@ -0,0 +1,164 @@
+import os
+from functools import lru_cache
+from typing import Any
+from urllib.parse import urlparse
+
+import dotenv
+import pyarrow as pa
+from pyarrow import fs
+
+dotenv.load_dotenv()
+
+
+def get_settings() -> dict[str, Any]:
+    """
+    Read the settings of the object storage from the environment.
+
+    The settings are read on every call rather than once at import time, so a test or a task can point the
+    storage layer at another endpoint, e.g. a local MinIO or moto server, by changing the environment.
+
+    * ``AWS_ENDPOINT_URL``: the endpoint of the S3-compatible object storage, shared by pyarrow, polars and
+      deltalake. Defaults to "http://miniostorage:9000".
+    * ``AWS_ACCESS_KEY_ID``, ``AWS_SECRET_ACCESS_KEY`` and ``AWS_REGION``: the credentials and region.
+    * ``STORAGE_IO_THREADS``: the number of threads pyarrow uses for concurrent requests and uploads.
+      Defaults to 16.
+    * ``STORAGE_UPLOAD_PART_SIZE``: the size of the buffers streamed into a multipart upload. Defaults to
+      16 MiB.
+    * ``STORAGE_POOL_MAX_IDLE_PER_HOST``: the number of idle keep-alive connections deltalake keeps per host.
+      Defaults to 16.
+    * ``STORAGE_CONNECT_TIMEOUT`` and ``STORAGE_REQUEST_TIMEOUT``: the timeouts of the requests, in seconds.
+      Default to 5 and 60.
+
+    Returns:
+        dict[str, Any]: The settings.
+    """
+    return {
+        "endpoint": os.getenv("AWS_ENDPOINT_URL", "http://miniostorage:9000"),
+        "access_key": os.getenv("AWS_ACCESS_KEY_ID"),
+        "secret_key": os.getenv("AWS_SECRET_ACCESS_KEY"),
+        "region": os.getenv("AWS_REGION"),
+        "io_threads": int(os.getenv("STORAGE_IO_THREADS", "16")),
+        "upload_part_size": int(
+            os.getenv("STORAGE_UPLOAD_PART_SIZE", str(16 * 1024 * 1024))
+        ),
+        "pool_max_idle_per_host": int(
+            os.getenv("STORAGE_POOL_MAX_IDLE_PER_HOST", "16")
+        ),
+        "connect_timeout": float(os.getenv("STORAGE_CONNECT_TIMEOUT", "5")),
+        "request_timeout": float(os.getenv("STORAGE_REQUEST_TIMEOUT", "60")),
+    }
+
+
+def get_filesystem() -> fs.S3FileSystem:
+    """
+    Get the process-wide PyArrow filesystem of the object storage.
+
+    The filesystem is created once per settings and reused by every ingest and sink call, so its connection
+    pool is shared instead of being rebuilt per call. Uploads are written in the background on the pyarrow
+    IO thread pool, which is sized to ``STORAGE_IO_THREADS``.
+
+    Returns:
+        fs.S3FileSystem: The shared filesystem.
+    """
+    settings = get_settings()
+    return _filesystem(
+        settings["endpoint"],
+        settings["access_key"],
+        settings["secret_key"],
+        settings["region"],
+        settings["io_threads"],
+        settings["connect_timeout"],
+        settings["request_timeout"],
+    )
+
+
+@lru_cache(maxsize=None)
+def _filesystem(
+    endpoint: str,
+    access_key: str | None,
+    secret_key: str | None,
+    region: str | None,
+    io_threads: int,
+    connect_timeout: float,
+    request_timeout: float,
+) -> fs.S3FileSystem:
+    """Create the filesystem of ``get_filesystem`` for one set of settings."""
+    pa.set_io_thread_count(io_threads)
+    parsed = urlparse(endpoint)
+
+    return fs.S3FileSystem(
+        access_key=access_key,
+        secret_key=secret_key,
+        region=region,
+        scheme=parsed.scheme or "http",
+        endpoint_override=parsed.netloc or parsed.path,
+        connect_timeout=connect_timeout,
+        request_timeout=request_timeout,
+        background_writes=True,
+    )
+
+
+def get_storage_options() -> dict[str, str]:
+    """
+    Get the storage options of the object storage for polars ``scan_delta``/``write_delta`` and deltalake.
+
+    The options point at the same endpoint as ``get_filesystem`` and keep idle connections alive between
+    calls.
+
+    Returns:
+        dict[str, str]: The storage options.
+    """
+    settings = get_settings()
+    return {
+        "AWS_REGION": settings["region"],
+        "AWS_ACCESS_KEY_ID": settings["access_key"],
+        "AWS_SECRET_ACCESS_KEY": settings["secret_key"],
+        "AWS_ENDPOINT_URL": settings["endpoint"],
+        "AWS_ALLOW_HTTP": "true",
+        "AWS_S3_ALLOW_UNSAFE_RENAME": "true",
+        "pool_max_idle_per_host": str(settings["pool_max_idle_per_host"]),
+        "connect_timeout": f"{settings['connect_timeout']:g}s",
+        "timeout": f"{settings['request_timeout']:g}s",
+    }
+
+
+def get_scan_options() -> dict[str, str]:
+    """
+    Get the storage options of the object storage for polars ``scan_parquet``.
+
+    The native Parquet reader of polars only takes lower-case object_store keys, without the options that
+    are specific to deltalake, so it gets its own set of options pointing at the same endpoint.
+
+    Returns:
+        dict[str, str]: The storage options, unset credentials left out.
+    """
+    settings = get_settings()
+    options = {
+        "aws_region": settings["region"],
+        "aws_access_key_id": settings["access_key"],
+        "aws_secret_access_key": settings["secret_key"],
+        "aws_endpoint_url": settings["endpoint"],
+        "aws_allow_http": "true",
+        "pool_max_idle_per_host": str(settings["pool_max_idle_per_host"]),
+        "connect_timeout": f"{settings['connect_timeout']:g}s",
+        "timeout": f"{settings['request_timeout']:g}s",
+    }
+    return {key: value for key, value in options.items() if value is not None}
+
+
+def open_output_stream(path: str) -> pa.NativeFile:
+    """
+    Open a stream to an object that is uploaded in multipart parts of ``STORAGE_UPLOAD_PART_SIZE`` bytes.
+
+    Writes are buffered up to the part size and each full buffer is uploaded as one part in the
+    background, so up to ``STORAGE_IO_THREADS`` parts are in flight at once.
+
+    Args:
+        path (str): The destination path in the object storage.
+
+    Returns:
+        pa.NativeFile: The output stream, to be closed by the caller.
+    """
+    return get_filesystem().open_output_stream(
+        path, buffer_size=get_settings()["upload_part_size"]
+    )
@@ -1,206 +1,1741 @@
+import glob
+import hashlib
+import operator
 import os
-from typing import Any, List, Mapping, Literal, Optional
+import re
+import tempfile
+import warnings
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Literal,
+    Optional,
+    Tuple,
+)
 
 import dotenv
+import numpy as np
+import patito as pt
 import polars as pl
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as pads
 import pyarrow.parquet as pq
+from deltalake import DeltaTable, write_deltalake
+from deltalake.exceptions import TableNotFoundError
 from pyarrow import fs
-from pyarrow.dataset import dataset
+from src.scripts.cache import cache_objects
+from src.scripts.ndjson import (
+    DEFAULT_BLOCK_SIZE,
+    compression_of,
+    decoded_schema,
+    iter_ndjson,
+    json_parse_options,
+    parse_ndjson,
+    prefetch_ndjson,
+)
+from src.scripts.storage import (
+    get_filesystem,
+    get_scan_options,
+    get_storage_options,
+    open_output_stream,
+)
+from src.scripts.validation import validate_dataset
 
 dotenv.load_dotenv()
 
+# Output names of the top-level fields of the raw logs.
+_LOG_FIELDS = {"Index": "_index", "Type": "_type", "Id": "_id", "Score": "_score"}
+_LOG_NAMES = {raw: name for name, raw in _LOG_FIELDS.items()}
+
+_COMPARISONS = {
+    "==": operator.eq,
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+# Name of the manifest of the bronze files, ignored by dataset discovery thanks to its ``_`` prefix.
+_BRONZE_MANIFEST = "_manifest.parquet"
+_BRONZE_MANIFEST_SCHEMA = pa.schema(
+    [
+        pa.field("key", pa.string()),
+        pa.field("size", pa.int64()),
+        pa.field("mtime_ns", pa.int64()),
+        pa.field("sha256", pa.string()),
+        pa.field("bronze", pa.string()),
+    ]
+)
+
+_MANIFEST_SCHEMA = {
+    "key": pl.String,
+    "size": pl.Int64,
+    "mtime": pl.Datetime("us", "UTC"),
+    "delta_version": pl.Int64,
+    "ingested_at": pl.Datetime("us"),
+}
+
+_CONTRACT_KEY_SCHEMA = {"Contract": pl.String, "ContractKey": pl.Int32}
+_HASH_SEED = np.uint64(0x9E3779B97F4A7C15)
+_HASH_MULTIPLIER = np.uint64(0x100000001B3)
+_HASH_NULL = np.uint64(0x5BD1E9955BD1E995)
+
+_SCD2_PROGRESS_SCHEMA = {
+    "run_id": pl.String,
+    "bucket": pl.Int64,
+    "delta_version": pl.Int64,
+    "completed_at": pl.Datetime("us"),
+}
+
+
+class StreamingFallbackWarning(UserWarning):
+    """A plan the streaming engine of polars cannot run was collected in memory before being spilled."""
+
+
+class EmptyReplaceWarning(UserWarning):
+    """A ``replace`` write of ``sink_delta_to_s3`` had no rows, so nothing was replaced."""
+
 
 def ingest_from_s3(
     base_path: str,
     schema: pa.Schema,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    block_size: Optional[int] = None,
+    prefetch: Optional[int] = None,
+    max_buffered_bytes: int = 512 * 1024 * 1024,
+    cache: bool = False,
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[Tuple[str, str, Any]]] = None,
+    stats: Optional[dict[str, Any]] = None,
+) -> pl.LazyFrame:
+    """
+    Ingests data from specified paths using PyArrow, create a columns with date getting from the filename,
+    and returns a
+    Polars
+    LazyFrame.
+
+    All objects under ``base_path`` are scanned as a single PyArrow dataset. The ``Date`` column is attached to
+    every file as a partition expression derived from its ``YYYYMMDD`` filename, so ``start_date`` and
+    ``end_date`` discard whole objects before any of them is opened. Objects without a date stamp in their
+    name are skipped.
+
+    With ``block_size``, every object is instead cut into newline-aligned byte ranges of about ``block_size``
+    bytes that are fetched with ranged GETs and parsed in parallel, see ``ndjson.read_ndjson``. With
+    ``prefetch``, up to ``prefetch`` objects are downloaded while the previous ones are parsed, see
+    ``ndjson.prefetch_ndjson``, and ``stats`` receives the overlap reached, to tune the number of objects in
+    flight. Gzip and zstd objects (``.gz``/``.zst``) always take the ``ndjson`` readers,
+    which decompress them in parallel chunks, since the PyArrow JSON dataset reader cannot.
+
+    With ``cache``, the objects in the date range are first copied to the local read-through cache of the
+    ``cache`` module and read memory-mapped from there, so a rerun does no network I/O for unchanged objects.
+
+    ``columns`` and ``filters`` are pushed into the JSON parser: only the fields backing ``columns`` (and the
+    filtered columns) are decoded, including the nested ``_source`` fields, and rows failing ``filters`` are
+    dropped before they leave the reader. See ``_log_filter`` for the supported filters.
+
+    The frame scans a PyArrow dataset, which the streaming engine of polars cannot run, so sinking it
+    collects it first. To sink more logs than fit in memory, convert them once with ``convert_to_bronze``
+    and scan them with ``ingest_from_bronze``.
+
+    Args:
+        schema (pa.Schema): The schema to use for the data.
+        base_path (str, optional): The base path for the file system. Defaults to None.
+        start_date (Optional[date]): The first date (inclusive) to ingest. Defaults to None.
+        end_date (Optional[date]): The last date (inclusive) to ingest. Defaults to None.
+        block_size (Optional[int]): The size in bytes of the ranges parsed in parallel. Defaults to None,
+        which scans the objects with the PyArrow JSON dataset reader.
+        prefetch (Optional[int]): The number of objects downloaded ahead of the parser. Defaults to None.
+        max_buffered_bytes (int): The cap on prefetched bytes waiting to be parsed. Defaults to 512 MiB.
+        cache (bool): Whether to read the objects through the local disk cache. Defaults to False.
+        columns (Optional[List[str]]): The output columns to read, e.g. ``["Date", "Contract"]``. Defaults to
+        None, which reads every column.
+        filters (Optional[List[Tuple[str, str, Any]]]): Row filters on the output columns, e.g.
+        ``[("TotalDuration", ">", 0)]``, combined with AND. Defaults to None.
+        stats (Optional[dict[str, Any]]): A dict filled with the prefetch report of ``ndjson.prefetch_ndjson``
+        every time a scan of the frame has read all the objects. Defaults to None.
+
+    Returns:
+        pl.LazyFrame: A Polars LazyFrame containing the ingested data.
+    """
+    schema = _project_log_schema(schema, columns, filters)
+    predicate = _log_filter(filters, pc.field, pc.utf8_length, pads.Expression.isin)
+
+    cloudfs = get_filesystem()
+    s3_files = _list_objects(base_path, cloudfs)
+
+    if cache:
+        s3_files = [
+            entry
+            for entry in s3_files
+            if _in_date_range(entry.path, start_date, end_date)
+        ]
+        cached = cache_objects(s3_files, cloudfs)
+        cloudfs = fs.LocalFileSystem(use_mmap=True)
+        s3_files = cloudfs.get_file_info(cached)
+
+    if (
+        block_size is not None
+        or prefetch is not None
+        or any(compression_of(entry.path) for entry in s3_files)
+    ):
+        ds = _parsed_dataset(
+            s3_files,
+            schema,
+            cloudfs,
+            pa.date32(),
+            start_date,
+            end_date,
+            block_size=block_size,
+            prefetch=prefetch,
+            max_buffered_bytes=max_buffered_bytes,
+            predicate=predicate,
+            stats=stats,
+        )
+    else:
+        ds = _dated_dataset(
+            [entry.path for entry in s3_files],
+            schema,
+            cloudfs,
+            start_date,
+            end_date,
+            predicate=predicate,
+        )
+
+    return _scan_logs(ds, columns).pipe(_as_categorical, schema)
+
+
+def convert_to_bronze(
+    base_path: str,
+    target: str,
+    schema: pa.Schema,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    filesystem: Optional[fs.FileSystem] = None,
+    compression: str = "zstd",
+) -> dict[str, List[str]]:
+    """
+    Convert the daily json logs under ``base_path`` into flat Parquet bronze files under ``target``, once.
+
+    Every log becomes one Parquet file, already unnested and typed like ``ingest_from_s3`` returns it
+    (without ``Date``, which comes from the file name). A manifest next to the bronze files records the key,
+    size, modification time and SHA-256 of every converted log. A log whose size and modification time are
+    unchanged is not even downloaded; a rewritten log is downloaded and hashed, and only parsed again if its
+    content actually changed. JSON parsing is thus paid once per file instead of once per run.
+
+    Args:
+        base_path (str): The prefix holding the raw json logs.
+        target (str): The prefix receiving the bronze Parquet files.
+        schema (pa.Schema): The schema of the raw json logs, e.g. ``PA_SCHEMA``.
+        start_date (Optional[date]): The first date (inclusive) to convert. Defaults to None.
+        end_date (Optional[date]): The last date (inclusive) to convert. Defaults to None.
+        filesystem (Optional[fs.FileSystem]): The filesystem holding both prefixes. Defaults to the object
+        storage.
+        compression (str): The Parquet compression codec. Defaults to "zstd".
+
+    Returns:
+        dict[str, List[str]]: The ``converted`` bronze files and the ``reused`` ones.
+    """
+    filesystem = filesystem or get_filesystem()
+    target = target.rstrip("/")
+    manifest_path = f"{target}/{_BRONZE_MANIFEST}"
+    bronze_schema = _bronze_schema(schema)
+
+    manifest = {}
+    if filesystem.get_file_info(manifest_path).type != fs.FileType.NotFound:
+        manifest = {
+            entry["key"]: entry
+            for entry in pq.read_table(manifest_path, filesystem=filesystem).to_pylist()
+        }
+
+    converted, reused = [], []
+    updated = False
+    for info in _list_objects(base_path, filesystem):
+        if not _in_date_range(info.path, start_date, end_date):
+            continue
+
+        entry = manifest.get(info.path)
+        if entry is not None and (entry["size"], entry["mtime_ns"]) == (
+            info.size,
+            info.mtime_ns,
+        ):
+            reused.append(entry["bronze"])
+            continue
+
+        with filesystem.open_input_stream(info.path, compression=None) as stream:
+            buffer = stream.read()
+        digest = hashlib.sha256(buffer).hexdigest()
+        path = _bronze_path(info.path, base_path, target)
+
+        if entry is not None and entry["sha256"] == digest:
+            reused.append(path)
+        else:
+            table = parse_ndjson(buffer, schema, compression=compression_of(info.path))
+            logs = _scan_logs(pads.dataset(_flattened(table))).collect().to_arrow()
+            filesystem.create_dir(os.path.dirname(path), recursive=True)
+            pq.write_table(
+                logs.cast(bronze_schema),
+                path,
+                filesystem=filesystem,
+                compression=compression,
+            )
+            converted.append(path)
+
+        manifest[info.path] = {
+            "key": info.path,
+            "size": info.size,
+            "mtime_ns": info.mtime_ns,
+            "sha256": digest,
+            "bronze": path,
+        }
+        updated = True
+        del buffer
+
+    if updated:
+        pq.write_table(
+            pa.Table.from_pylist(
+                list(manifest.values()), schema=_BRONZE_MANIFEST_SCHEMA
+            ),
+            manifest_path,
+            filesystem=filesystem,
+        )
+
+    return {"converted": converted, "reused": reused}
+
+
+def ingest_from_bronze(
+    target: str,
+    schema: pa.Schema,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[Tuple[str, str, Any]]] = None,
+    filesystem: Optional[fs.FileSystem] = None,
+) -> pl.LazyFrame:
+    """
+    Scan the bronze Parquet files written by ``convert_to_bronze``.
+
+    The frame has the same columns as ``ingest_from_s3``. ``Date`` is attached to every file from its name,
+    so the date bounds skip whole files, and ``filters`` (see ``_log_filter``) are pushed into the Parquet
+    scans. The files are scanned by the native Parquet reader of polars, so the frame runs on the streaming
+    engine and can be sunk without being collected.
+
+    Args:
+        target (str): The prefix holding the bronze files.
+        schema (pa.Schema): The schema of the raw json logs, e.g. ``PA_SCHEMA``.
+        start_date (Optional[date]): The first date (inclusive) to read. Defaults to None.
+        end_date (Optional[date]): The last date (inclusive) to read. Defaults to None.
+        columns (Optional[List[str]]): The output columns to read. Defaults to None, which reads every column.
+        filters (Optional[List[Tuple[str, str, Any]]]): Row filters on the output columns. Defaults to None.
+        filesystem (Optional[fs.FileSystem]): The filesystem holding the files, the object storage or the
+        local disk. Defaults to the object storage.
+
+    Returns:
+        pl.LazyFrame: The log rows.
+    """
+    filesystem = filesystem or get_filesystem()
+    bronze_schema = _bronze_schema(schema)
+    days: dict[date, List[str]] = {}
+    for info in _list_objects(target, filesystem):
+        if (
+            info.path.endswith(".parquet")
+            and not os.path.basename(info.path).startswith("_")
+            and _in_date_range(info.path, start_date, end_date)
+        ):
+            days.setdefault(_date_from_path(info.path), []).append(info.path)
+
+    logs = pl.concat(
+        [
+            _scan_parquet(paths, filesystem).with_columns(
+                pl.lit(day, pl.Date).alias("Date")
+            )
+            for day, paths in sorted(days.items())
+        ]
+        or [
+            pl.LazyFrame(pl.DataFrame(bronze_schema.empty_table())).with_columns(
+                pl.lit(None, pl.Date).alias("Date")
+            )
+        ]
+    )
+    predicate = _log_filter(
+        filters, pl.col, lambda expr: expr.str.len_chars(), pl.Expr.is_in, nested=False
+    )
+    if predicate is not None:
+        logs = logs.filter(predicate)
+    return logs.select(columns or ["Date", *bronze_schema.names])
+
+
+def _scan_parquet(paths: List[str], filesystem: fs.FileSystem) -> pl.LazyFrame:
+    """
+    Scan Parquet files of a PyArrow filesystem with the native Parquet reader of polars.
+
+    Unlike a PyArrow dataset scan, the native reader runs on the streaming engine, so ``sink_parquet`` and
+    the streaming group-bys never hold the whole files in memory.
+
+    Args:
+        paths (List[str]): The paths of the files in ``filesystem``.
+        filesystem (fs.FileSystem): The object storage or the local disk.
+
+    Returns:
+        pl.LazyFrame: The rows of the files.
+
+    Raises:
+        ValueError: If the filesystem is neither S3 nor local.
+    """
+    if isinstance(filesystem, fs.S3FileSystem):
+        return pl.scan_parquet(
+            [f"s3://{path}" for path in paths], storage_options=get_scan_options()
+        )
+    if isinstance(filesystem, fs.LocalFileSystem):
+        return pl.scan_parquet(paths)
+    raise ValueError(
+        f"Cannot scan Parquet files of a {filesystem.type_name} filesystem"
+    )
+
+
+def _bronze_schema(schema: pa.Schema) -> pa.Schema:
+    """
+    Flatten the raw log schema into the schema of the bronze files.
+
+    Args:
+        schema (pa.Schema): The schema of the raw json logs.
+
+    Returns:
+        pa.Schema: The renamed top-level fields followed by the fields of ``_source``.
+    """
+    fields = [
+        pa.field(_LOG_NAMES.get(field.name, field.name), field.type)
+        for field in schema
+        if field.name != "_source"
+    ]
+    return pa.schema(fields + list(schema.field("_source").type))
+
+
+def _bronze_path(key: str, base_path: str, target: str) -> str:
+    """
+    Get the bronze file of a raw log, mirroring its path below ``base_path``.
+
+    Args:
+        key (str): The path of the raw log.
+        base_path (str): The prefix holding the raw json logs.
+        target (str): The prefix receiving the bronze files.
+
+    Returns:
+        str: The path of the Parquet file, e.g. ``<target>/20220401.parquet`` for ``20220401.json.gz``.
+    """
+    name = os.path.relpath(key, base_path)
+    stem = re.sub(r"(\.json)?(\.gz|\.gzip|\.zst|\.zstd)?$", "", name)
+    return f"{target}/{stem}.parquet"
+
+
+def _list_objects(base_path: str, filesystem: fs.FileSystem) -> List[fs.FileInfo]:
+    """
+    List every file under ``base_path`` in a single recursive listing.
+
+    Args:
+        base_path (str): The prefix to list.
+        filesystem (fs.FileSystem): The filesystem holding the files.
+
+    Returns:
+        List[fs.FileInfo]: The files under the prefix, with their size and modification time.
+    """
+    return [
+        entry
+        for entry in filesystem.get_file_info(
+            fs.FileSelector(base_path, recursive=True)
+        )
+        if entry.is_file
+    ]
+
+
+def _scan_logs(ds: pads.Dataset, columns: Optional[List[str]] = None) -> pl.LazyFrame:
+    """
+    Scan a dated log dataset into a LazyFrame with the ``_source`` struct unnested.
+
+    Args:
+        ds (pads.Dataset): The dataset built by ``_dated_dataset``, or by ``_parsed_dataset`` with ``_source``
+        already flattened.
+        columns (Optional[List[str]]): The output columns to keep. Defaults to None, which keeps all of them.
+
+    Returns:
+        pl.LazyFrame: The log rows with ``Date``, ``Index``, ``Type``, ``Id``, ``Score`` and the source fields.
+    """
+    logs = pl.scan_pyarrow_dataset(ds).select(_log_projection(ds.schema.names))
+    if "_source" in ds.schema.names:
+        logs = logs.unnest("_source")
+
+    return logs if columns is None else logs.select(columns)
+
+
+def _log_batches(
+    ds: pads.Dataset, batch_size: int = 128 * 1024
+) -> pa.RecordBatchReader:
+    """
+    Stream a dated log dataset as record batches with the columns of ``_scan_logs``.
+
+    Unlike the LazyFrame of ``_scan_logs``, the batches are produced by the PyArrow scanner as they are
+    parsed, so the logs can be spilled or written without being collected first.
+
+    Args:
+        ds (pads.Dataset): The dataset built by ``_dated_dataset`` or ``_parsed_dataset``.
+        batch_size (int): The maximum number of rows per batch. Defaults to 131072.
+
+    Returns:
+        pa.RecordBatchReader: The log rows with the ``_source`` fields as top-level columns.
+    """
+    renames = {"Date": "Date", **_LOG_FIELDS}
+    columns = {
+        name: pc.field(raw) for name, raw in renames.items() if raw in ds.schema.names
+    }
+    for field in ds.schema:
+        if field.name == "_source":
+            columns.update(
+                (child.name, pc.field("_source", child.name)) for child in field.type
+            )
+        elif field.name not in renames.values():
+            columns[field.name] = pc.field(field.name)
+
+    return ds.scanner(columns=columns, batch_size=batch_size).to_reader()
+
+
+def _log_projection(names: List[str]) -> List[pl.Expr]:
+    """
+    Rename the top-level fields of the raw logs that are present in ``names``.
+
+    Args:
+        names (List[str]): The columns of the raw log frame.
+
+    Returns:
+        List[pl.Expr]: The ``Date``, ``Index``, ``Type``, ``Id`` and ``Score`` expressions followed by the
+        other columns, ``_source`` or its flattened fields.
+    """
+    renames = {"Date": "Date", **_LOG_FIELDS}
+    return [
+        pl.col(raw).alias(name) for name, raw in renames.items() if raw in names
+    ] + [pl.col(name) for name in names if name not in renames.values()]
+
+
+def _flattened(table: pa.Table) -> pa.Table:
+    """
+    Replace the ``_source`` struct of parsed logs by its fields.
+
+    Polars cannot convert a struct with dictionary fields spread over several chunks, so parsed tables are
+    flattened before they reach it.
+
+    Args:
+        table (pa.Table): The parsed logs.
+
+    Returns:
+        pa.Table: The logs with the ``_source`` fields as top-level columns.
+    """
+    if "_source" not in table.column_names:
+        return table
+
+    index = table.column_names.index("_source")
+    source = table.column("_source")
+    for offset, field in enumerate(source.type):
+        table = table.add_column(
+            index + 1 + offset,
+            field,
+            pa.chunked_array(
+                [chunk.field(offset) for chunk in source.chunks], field.type
+            ),
+        )
+    return table.remove_column(index)
+
+
+def _log_field(name: str, field: Callable[..., Any]) -> Any:
+    """
+    Reference an output column of the logs in the raw nested json.
+
+    Args:
+        name (str): The output column, e.g. ``Index`` or ``Contract``.
+        field (Callable[..., Any]): The field constructor, ``pc.field`` or ``pl.col``.
+
+    Returns:
+        Any: The reference to ``_index``-like top-level fields or to the fields of ``_source``.
+    """
+    if name in _LOG_FIELDS:
+        return field(_LOG_FIELDS[name])
+    if field is pc.field:
+        return field("_source", name)
+    return field(name)
+
+
+def _project_log_schema(
+    schema: pa.Schema,
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[Tuple[str, str, Any]]] = None,
+) -> pa.Schema:
+    """
+    Prune the raw log schema to the fields backing the requested output columns and filters.
+
+    Args:
+        schema (pa.Schema): The raw log schema, e.g. ``PA_SCHEMA``.
+        columns (Optional[List[str]]): The output columns. Defaults to None, which keeps the whole schema.
+        filters (Optional[List[Tuple[str, str, Any]]]): The filters, whose columns are kept too.
+
+    Returns:
+        pa.Schema: The pruned schema.
+
+    Raises:
+        ValueError: If a column is not part of the logs.
+    """
+    if columns is None:
+        return schema
+
+    wanted = {*columns, *(column for column, _, _ in filters or [])} - {"Date"}
+    fields = []
+    for field in schema:
+        if field.name == "_source":
+            children = [child for child in field.type if child.name in wanted]
+            wanted -= {child.name for child in children}
+            if children:
+                fields.append(pa.field(field.name, pa.struct(children)))
+        elif _LOG_NAMES.get(field.name) in wanted:
+            wanted.discard(_LOG_NAMES[field.name])
+            fields.append(field)
+
+    if wanted:
+        raise ValueError(f"Unknown log columns: {sorted(wanted)!r}")
+    return pa.schema(fields)
+
+
+def _log_filter(
+    filters: Optional[List[Tuple[str, str, Any]]],
+    field: Callable[..., Any],
+    length: Callable[[Any], Any],
+    is_in: Callable[[Any, Any], Any],
+    nested: bool = True,
+) -> Optional[Any]:
+    """
+    Combine simple row filters on the output log columns into one expression.
+
+    A filter is a ``(column, op, value)`` tuple where ``op`` is one of ``==``, ``=``, ``!=``, ``<``, ``<=``,
+    ``>``, ``>=``, ``in`` or ``not in``. Prefixing the comparison with ``len`` compares the number of
+    characters of a string column instead, e.g. ``("Contract", "len>", 1)``.
+
+    Args:
+        filters (Optional[List[Tuple[str, str, Any]]]): The filters, combined with AND.
+        field (Callable[..., Any]): The field constructor, ``pc.field`` or ``pl.col``.
+        length (Callable[[Any], Any]): The string length of an expression.
+        is_in (Callable[[Any, Any], Any]): The membership test of an expression in a list of values.
+        nested (bool): Whether the columns live in the raw nested json, rather than in flat bronze files.
+        Defaults to True.
+
+    Returns:
+        Optional[Any]: The combined expression, or None without filters.
+
+    Raises:
+        ValueError: If an operator is not supported.
+    """
+    predicate = None
+    for column, op, value in filters or []:
+        expr = _log_field(column, field) if nested else field(column)
+        if op.startswith("len"):
+            expr, op = length(expr), op[3:]
+
+        if op == "in":
+            condition = is_in(expr, value)
+        elif op == "not in":
+            condition = ~is_in(expr, value)
+        elif op in _COMPARISONS:
+            condition = _COMPARISONS[op](expr, value)
+        else:
+            raise ValueError(f"Unsupported filter operator: {op!r}")
+
+        predicate = condition if predicate is None else predicate & condition
+
+    return predicate
+
+
+def _as_categorical(logs: pl.LazyFrame, schema: pa.Schema) -> pl.LazyFrame:
+    """
+    Cast the output columns backed by dictionary fields of the raw schema to Categorical.
+
+    Args:
+        logs (pl.LazyFrame): The log rows.
+        schema (pa.Schema): The raw log schema.
+
+    Returns:
+        pl.LazyFrame: The log rows, encoded like the schema says.
+    """
+    fields = [(_LOG_NAMES.get(field.name), field.type) for field in schema]
+    if "_source" in schema.names:
+        fields += [(field.name, field.type) for field in schema.field("_source").type]
+
+    return logs.with_columns(
+        pl.col(name).cast(pl.Categorical)
+        for name, data_type in fields
+        if pa.types.is_dictionary(data_type) and name in logs.columns
+    )
+
+
+def _date_from_path(path: str) -> Optional[date]:
+    """
+    Extract the ``YYYYMMDD`` date stamp from the filename of a log object.
+
+    Args:
+        path (str): The path or key of the log object.
+
+    Returns:
+        Optional[date]: The date of the log, or None if the filename has no date stamp.
+    """
+    matched = re.search(r"\d{8}", os.path.basename(path))
+    if matched is None:
+        return None
+    return datetime.strptime(matched.group(0), "%Y%m%d").date()
+
+
+def _dated_dataset(
+    paths: List[str],
+    schema: pa.Schema,
+    filesystem: fs.FileSystem,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    file_format: Optional[pads.FileFormat] = None,
+    predicate: Optional[pc.Expression] = None,
+) -> pads.Dataset:
+    """
+    Build one PyArrow dataset over many daily log files with ``Date`` as a file-level partition column.
+
+    Args:
+        paths (List[str]): The paths of the log files.
+        schema (pa.Schema): The schema of the log files, without the ``Date`` column.
+        filesystem (fs.FileSystem): The filesystem holding the files.
+        start_date (Optional[date]): The first date (inclusive) to keep. Defaults to None.
+        end_date (Optional[date]): The last date (inclusive) to keep. Defaults to None.
+        file_format (Optional[pads.FileFormat]): The format of the files. Defaults to JSON decoding only the
+        fields of ``schema``, in which case dictionary fields are scanned as their value type.
+        predicate (Optional[pc.Expression]): A row filter applied while scanning. Defaults to None.
+
+    Returns:
+        pads.Dataset: The dataset, filtered on ``Date`` when a date bound is given and on ``predicate``.
+    """
+    dated = [(path, _date_from_path(path)) for path in paths]
+    dated = [(path, day) for path, day in dated if day is not None]
+
+    ds = pads.FileSystemDataset.from_paths(
+        [path for path, _ in dated],
+        schema=(schema if file_format else decoded_schema(schema)).append(
+            pa.field("Date", pa.date32())
+        ),
+        format=file_format
+        or pads.JsonFileFormat(parse_options=json_parse_options(schema)),
+        filesystem=filesystem,
+        partitions=[
+            pc.field("Date") == pa.scalar(day, type=pa.date32()) for _, day in dated
+        ],
+    )
+
+    if start_date is not None:
+        lower = pc.field("Date") >= pa.scalar(_as_date(start_date), pa.date32())
+        predicate = lower if predicate is None else predicate & lower
+    if end_date is not None:
+        upper = pc.field("Date") <= pa.scalar(_as_date(end_date), pa.date32())
+        predicate = upper if predicate is None else predicate & upper
+
+    return ds if predicate is None else ds.filter(predicate)
+
+
+def _in_date_range(
+    path: str, start_date: Optional[date] = None, end_date: Optional[date] = None
+) -> bool:
+    """
+    Check whether a log file is dated and its date lies between ``start_date`` and ``end_date`` (inclusive).
+
+    Args:
+        path (str): The path or key of the log file.
+        start_date (Optional[date]): The first date to keep. Defaults to None.
+        end_date (Optional[date]): The last date to keep. Defaults to None.
+
+    Returns:
+        bool: True if the file should be read.
+    """
+    day = _date_from_path(path)
+    if day is None:
+        return False
+    if start_date is not None and day < _as_date(start_date):
+        return False
+    return end_date is None or day <= _as_date(end_date)
+
+
+def _as_date(value: date | datetime) -> date:
+    """Truncate a datetime to its date, so both can be used as a ``Date`` bound."""
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _parsed_dataset(
+    files: List[fs.FileInfo],
+    schema: pa.Schema,
+    filesystem: fs.FileSystem,
+    date_type: pa.DataType,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    block_size: Optional[int] = None,
+    prefetch: Optional[int] = None,
+    max_buffered_bytes: int = 512 * 1024 * 1024,
+    predicate: Optional[pc.Expression] = None,
+    stats: Optional[dict[str, Any]] = None,
+) -> "_LazyDataset":
+    """
+    Expose daily log files as a dataset with a ``Date`` column that parses them when it is scanned.
+
+    The files are either read one by one with the parallel byte-range reader, or, with ``prefetch``, with
+    up to ``prefetch`` objects downloaded in the background while the current one is parsed. Nothing is
+    downloaded before a scan runs, and every scan filters and projects each parsed block before the next
+    one is parsed.
+
+    Args:
+        files (List[fs.FileInfo]): The log files.
+        schema (pa.Schema): The schema of the log files, without the ``Date`` column.
+        filesystem (fs.FileSystem): The filesystem holding the files.
+        date_type (pa.DataType): The type of the ``Date`` column.
+        start_date (Optional[date]): The first date (inclusive) to keep. Defaults to None.
+        end_date (Optional[date]): The last date (inclusive) to keep. Defaults to None.
+        block_size (Optional[int]): The size in bytes of the ranges parsed in parallel. Defaults to 64 MiB.
+        prefetch (Optional[int]): The number of objects downloaded ahead of the parser. Defaults to None.
+        max_buffered_bytes (int): The cap on prefetched bytes waiting to be parsed. Defaults to 512 MiB.
+        predicate (Optional[pc.Expression]): A row filter applied while parsing. Defaults to None.
+        stats (Optional[dict[str, Any]]): A dict receiving the prefetch report of every complete scan.
+        Defaults to None.
+
+    Returns:
+        _LazyDataset: The dataset over the files, with the ``_source`` fields flattened.
+    """
+    selected = [
+        info for info in files if _in_date_range(info.path, start_date, end_date)
+    ]
+    dataset_schema = _flattened(schema.empty_table()).schema.append(
+        pa.field("Date", date_type)
+    )
+
+    def _tables() -> Iterator[pa.Table]:
+        if prefetch is not None:
+            parsed = prefetch_ndjson(
+                selected,
+                schema,
+                filesystem,
+                max_in_flight=prefetch,
+                max_buffered_bytes=max_buffered_bytes,
+                stats=stats,
+                predicate=predicate,
+            )
+        else:
+            parsed = (
+                (info.path, table)
+                for info in selected
+                for table in iter_ndjson(
+                    info.path,
+                    schema,
+                    filesystem,
+                    block_size or DEFAULT_BLOCK_SIZE,
+                    predicate=predicate,
+                )
+            )
+
+        for path, table in parsed:
+            dated = _flattened(table).append_column(
+                pa.field("Date", date_type),
+                pa.array([_date_from_path(path)] * table.num_rows, pa.date32()).cast(
+                    date_type
+                ),
+            )
+            # Released before the next object is parsed.
+            del table
+            yield dated
+            del dated
+
+    return _LazyDataset(_tables, dataset_schema)
+
+
+class _LazyDataset:
+    """
+    A dataset whose tables are produced by a function on every scan, e.g. parsed from raw logs.
+
+    It implements the part of the ``pads.Dataset`` interface used by ``pl.scan_pyarrow_dataset`` and
+    ``_log_batches``. Nothing is read until a scan runs, and a scan pulls the tables one at a time through
+    its projection and filter, so only the rows and columns that survive them are held. Every scan reads the
+    source again.
+    """
+
+    def __init__(
+        self, tables: Callable[[], Iterator[pa.Table]], schema: pa.Schema
+    ) -> None:
+        """
+        Args:
+            tables (Callable[[], Iterator[pa.Table]]): The function producing the tables of one scan, with
+            the dataset schema.
+            schema (pa.Schema): The schema of the dataset.
+        """
+        self.schema = schema
+        self._tables = tables
+
+    def scanner(
+        self,
+        columns: Optional[List[str] | dict[str, pc.Expression]] = None,
+        filter: Optional[pc.Expression] = None,
+        batch_size: int = 128 * 1024,
+    ) -> pads.Scanner:
+        """
+        Start a scan of the tables.
+
+        Args:
+            columns (Optional[List[str] | dict[str, pc.Expression]]): The columns to project. Defaults to
+            None, which keeps every column.
+            filter (Optional[pc.Expression]): The rows to keep. Defaults to None.
+            batch_size (int): The maximum number of rows per batch. Defaults to 131072.
+
+        Returns:
+            pads.Scanner: A scanner that can be consumed once.
+        """
+        return pads.Scanner.from_batches(
+            self._batches(),
+            schema=self.schema,
+            columns=columns,
+            filter=filter,
+            batch_size=batch_size,
+            batch_readahead=1,
+        )
+
+    def _batches(self) -> Iterator[pa.RecordBatch]:
+        """Split the tables into record batches, releasing every table before the next one is produced."""
+        for table in self._tables():
+            batches = table.to_batches()
+            del table
+            while batches:
+                yield batches.pop(0)
+
+    def to_batches(self, **options) -> Iterator[pa.RecordBatch]:
+        """Scan the tables into record batches, see ``scanner`` for the options."""
+        return self.scanner(**options).to_batches()
+
+    def to_table(self, **options) -> pa.Table:
+        """Scan the tables into one table, see ``scanner`` for the options."""
+        return self.scanner(**options).to_table()
+
+    def head(self, num_rows: int, **options) -> pa.Table:
+        """Scan the first ``num_rows`` rows, see ``scanner`` for the options."""
+        return self.scanner(**options).head(num_rows)
+
+
+def ingest_from_local(
+    paths: str | list[str],
+    schema: Mapping[str, pl.DataType],
+    block_size: Optional[int] = None,
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[Tuple[str, str, Any]]] = None,
+) -> pl.LazyFrame:
+    """
+    Function to ingest the logging json data, get the filename and add a "Date" column
+    Args:
+        paths (str | list[str]): a list of path to data, this path should be in glob pattern
+        schema (Mapping[str, pl.DataType]): schema of local log json data
+        block_size (Optional[int]): when given, every file is cut into newline-aligned byte ranges of about
+        this many bytes which are parsed in parallel, see ``ndjson.read_ndjson``. Gzip and zstd files
+        (``.gz``/``.zst``) are always read this way, decompressed in parallel chunks
+        columns (Optional[List[str]]): the output columns to read, the other json fields are not decoded
+        filters (Optional[List[Tuple[str, str, Any]]]): row filters on the output columns, see ``_log_filter``
+
+    Returns:
+        pl.LazyFame
+    """
+
+    # Define schema of logging data
+
+    if isinstance(paths, str):
+        paths = [paths]
+
+    arrow_schema = _project_log_schema(_arrow_log_schema(schema), columns, filters)
+
+    files = [path for pattern in paths for path in sorted(glob.glob(pattern))]
+    if block_size is not None or any(compression_of(path) for path in files):
+        localfs = fs.LocalFileSystem()
+        ds = _parsed_dataset(
+            localfs.get_file_info(files),
+            arrow_schema,
+            localfs,
+            pa.timestamp("us"),
+            block_size=block_size,
+            predicate=_log_filter(
+                filters, pc.field, pc.utf8_length, pads.Expression.isin
+            ),
+        )
+        return _scan_logs(ds, columns)
+
+    schema = pl.DataFrame(arrow_schema.empty_table()).schema
+    # The filter runs on the renamed and unnested columns.
+    predicate = _log_filter(
+        filters, pl.col, lambda expr: expr.str.len_chars(), pl.Expr.is_in, nested=False
+    )
+
+    def _scan_log(path, schema) -> pl.LazyFrame:
+        logs = (
+            pl.scan_ndjson(path, schema=schema, low_memory=True)
+            .with_columns(pl.Series("Date", [path]).str.extract(r"\d{8}", 0))
+            .select(
+                pl.col("Date").str.strptime(pl.Datetime, format="%Y %m %d"),
+                *_log_projection(list(schema)),
+            )
+        )
+        if "_source" in schema:
+            logs = logs.unnest("_source")
+        if predicate is not None:
+            logs = logs.filter(predicate)
+        return logs if columns is None else logs.select(columns)
+
+    dfs = []
+    # Function to scan and preprocess a single log data
+    try:
+        dfs = [_scan_log(path, schema) for path in paths]
+    except Exception as e:
+        print(f"Failed to read data from {paths}", {e})
+    # Concatenate the processed lazyframes
+    return pl.concat(dfs, how="vertical").lazy()
+
+
+def _arrow_log_schema(schema: Mapping[str, pl.DataType]) -> pa.Schema:
+    """
+    Convert a polars log schema to arrow, with Categorical fields as ``int32``-indexed string dictionaries
+    like ``PA_SCHEMA``.
+
+    Args:
+        schema (Mapping[str, pl.DataType]): The polars log schema, e.g. ``PL_SCHEMA``.
+
+    Returns:
+        pa.Schema: The arrow log schema.
+    """
+
+    def _arrow(data_type: pa.DataType) -> pa.DataType:
+        if pa.types.is_dictionary(data_type):
+            return pa.dictionary(pa.int32(), pa.string())
+        if pa.types.is_struct(data_type):
+            return pa.struct(
+                [field.with_type(_arrow(field.type)) for field in data_type]
+            )
+        return data_type
+
+    return pa.schema(
+        field.with_type(_arrow(field.type))
+        for field in pl.DataFrame(schema=schema).to_arrow().schema
+    )
+
+
+def sink_to_s3(
+    sources: pl.LazyFrame | pa.RecordBatchReader,
+    path: str,
+    compression: str = "zstd",
+    row_group_size: int = 128 * 1024,
+    **options,
+) -> dict[str, int]:
+    """
+    Writes a Polars LazyFrame to an S3 bucket as a Parquet file.
+
+    The LazyFrame is first streamed into a local Parquet spill with ``sink_parquet``. Plans the streaming
+    engine cannot sink (e.g. python dataset scans) are collected once and written to the spill instead, so
+    such sources are better passed as a record-batch reader, which is spilled batch by batch. The
+    spill is then read back in row groups of ``row_group_size`` rows and uploaded incrementally, so the result
+    is never held as a second Arrow copy and the upload buffers at most a few row groups.
+    The shared object-storage client of the ``storage`` module is used for the upload.
+
+    Args:
+        sources (pl.LazyFrame | pa.RecordBatchReader): The LazyFrame, or the record batches, to write to S3.
+        path (str): The S3 path where the data should be written.
+        compression (str): The compression is default to "zstd"
+        row_group_size (int): The number of rows per row group and per uploaded batch. Defaults to 131072.
+        **options: Additional options to pass to the pyarrow.dataset.write_dataset when ``partition_cols`` is
+        given, or to pa.parquet.ParquetWriter otherwise
+
+    Returns:
+        dict[str, int]: The number of ``rows`` and ``bytes`` written.
+
+    Raises:
+        Any exceptions raised by `write_dataset` will be propagated.
+    """
+    partition_cols = options.pop("partition_cols", None)
+
+    with _spilled(sources, row_group_size) as spill:
+        if partition_cols:
+            written: List[pads.WrittenFile] = []
+            pads.write_dataset(
+                spill,
+                base_dir=path,
+                format="parquet",
+                partitioning=partition_cols,
+                partitioning_flavor="hive",
+                filesystem=get_filesystem(),
+                file_options=pads.ParquetFileFormat().make_write_options(
+                    compression=compression
+                ),
+                min_rows_per_group=row_group_size,
+                max_rows_per_group=row_group_size,
+                file_visitor=written.append,
+                existing_data_behavior="overwrite_or_ignore",
+                **options,
+            )
+            return {
+                "rows": sum(file.metadata.num_rows for file in written),
+                "bytes": sum(file.size for file in written),
+            }
+
+        rows = 0
+        with open_output_stream(path) as sink:
+            with pq.ParquetWriter(
+                sink,
+                spill.schema,
+                compression=compression,
+                **options,
+            ) as writer:
+                for batch in spill.to_batches(batch_size=row_group_size):
+                    writer.write_batch(batch, row_group_size=row_group_size)
+                    rows += batch.num_rows
+            written_bytes = sink.tell()
+
+    return {"rows": rows, "bytes": written_bytes}
+
+
+@contextmanager
+def _spilled(
+    sources: pl.LazyFrame | pa.RecordBatchReader, row_group_size: int
+) -> Iterator[pads.Dataset]:
+    """
+    Stream a LazyFrame, or record batches, into a temporary local Parquet file exposed as a PyArrow dataset.
+
+    A LazyFrame is sunk with the streaming engine, which only works for plans over native scans such as
+    ``ingest_from_bronze`` or ``scan_delta_from_s3``. Plans the streaming engine cannot sink, e.g. scans of
+    PyArrow datasets, are collected once and written to the file instead. Record batches, e.g. a PyArrow
+    scanner of raw logs, are written as they arrive. The file is removed when the context exits.
+
+    Args:
+        sources (pl.LazyFrame | pa.RecordBatchReader): The LazyFrame or the record batches to write.
+        row_group_size (int): The number of rows per row group.
+
+    Yields:
+        pads.Dataset: The dataset over the spilled Parquet file.
+
+    Warns:
+        StreamingFallbackWarning: If the LazyFrame is collected rather than streamed.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "spill.parquet")
+        if isinstance(sources, pa.RecordBatchReader):
+            with pq.ParquetWriter(path, sources.schema, compression="lz4") as writer:
+                for batch in sources:
+                    writer.write_batch(batch, row_group_size=row_group_size)
+        else:
+            try:
+                sources.sink_parquet(
+                    path, compression="lz4", row_group_size=row_group_size
+                )
+            except pl.InvalidOperationError:
+                warnings.warn(
+                    "The plan cannot run on the streaming engine, it is collected before being spilled",
+                    StreamingFallbackWarning,
+                    stacklevel=3,
+                )
+                sources.collect(streaming=True).write_parquet(
+                    path, compression="lz4", row_group_size=row_group_size
+                )
+        yield pads.dataset(path, format="parquet")
+
+
+def partition_by_contract(
+    sources: pl.LazyFrame | pa.RecordBatchReader,
+    directory: str,
+    buckets: int = 16,
+    batch_size: int = 128 * 1024,
+    key: Optional[str] = None,
+) -> List[str]:
+    """
+    Hash-partition the log rows by contract into ``buckets`` Parquet files, in a single pass.
+
+    The rows are spilled to a local Parquet file and read back ``batch_size`` rows at a time, every batch
+    being split on the ``_stable_hash`` of its ``Contract``, or ``ContractKey`` once keyed, and appended to the file of
+    each bucket. Every contract ends up in exactly one bucket, e.g. for ``pipeline.get_gold_table_from_buckets``.
+
+    The memory stays bounded by the batch size whatever the size of the sources as long as the spill
+    streams: for plans the streaming engine runs, e.g. over ``ingest_from_bronze`` or ``scan_delta_from_s3``,
+    and for record-batch readers. Other plans, e.g. over ``ingest_from_s3``, are collected before being
+    spilled, see ``_spilled``.
+
+    Args:
+        sources (pl.LazyFrame | pa.RecordBatchReader): The log rows, or their record batches.
+        directory (str): The local directory receiving the bucket files.
+        buckets (int): The number of buckets. Defaults to 16.
+        batch_size (int): The number of rows read at a time. Defaults to 131072.
+        key (Optional[str]): The column to hash. Defaults to None, ``ContractKey`` if present and ``Contract``
+        otherwise.
+
+    Returns:
+        List[str]: The file of every bucket, an empty bucket has an empty file.
+    """
+    if key is None:
+        names = (
+            sources.schema.names
+            if isinstance(sources, pa.RecordBatchReader)
+            else sources.columns
+        )
+        key = "ContractKey" if "ContractKey" in names else "Contract"
+    paths = [
+        os.path.join(directory, f"bucket-{bucket:05d}.parquet")
+        for bucket in range(buckets)
+    ]
+    os.makedirs(directory, exist_ok=True)
+
+    writers = {}
+    try:
+        with _spilled(sources, batch_size) as spill:
+            for batch in spill.to_batches(batch_size=batch_size):
+                rows = pl.from_arrow(batch).with_columns(
+                    (_stable_hash([key]) % buckets).alias("_bucket")
+                )
+                for part in rows.partition_by("_bucket"):
+                    bucket = part["_bucket"][0]
+                    table = part.drop("_bucket").to_arrow()
+                    if bucket not in writers:
+                        writers[bucket] = pq.ParquetWriter(
+                            paths[bucket], table.schema, compression="lz4"
+                        )
+                    writers[bucket].write_table(table)
+
+            empty = pl.DataFrame(schema=pl.scan_pyarrow_dataset(spill).schema)
+            for bucket, path in enumerate(paths):
+                if bucket not in writers:
+                    empty.write_parquet(path)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return paths
+
+
+def _rows_per_file(spill: pads.Dataset, target_file_size: int) -> int:
+    """
+    Estimate how many rows fit in a data file of ``target_file_size`` bytes from the spilled Parquet sizes.
+
+    Args:
+        spill (pads.Dataset): The dataset returned by ``_spilled``.
+        target_file_size (int): The target size of a data file in bytes.
+
+    Returns:
+        int: The number of rows per data file, at least 1.
+    """
+    metadata = next(spill.get_fragments()).metadata
+    if metadata.num_rows == 0:
+        return 1
+    compressed = sum(
+        metadata.row_group(i).column(j).total_compressed_size
+        for i in range(metadata.num_row_groups)
+        for j in range(metadata.num_columns)
+    )
+    return max(1, target_file_size * metadata.num_rows // max(compressed, 1))
+
+
+def sink_delta_to_s3(
+    tables: pl.LazyFrame | pa.RecordBatchReader,
+    target: str,
+    mode: Literal["error", "append", "overwrite", "ignore", "replace"] = "append",
+    delta_write_options: Optional[dict[str, Any]] = None,
+    predicate: Optional[str] = None,
+    partition_col: str = "Date",
+    batch_size: int = 128 * 1024,
+    max_rows_per_file: Optional[int] = None,
+    target_file_size: Optional[int] = None,
+    model: Optional[pt.Model] = None,
+) -> None:
+    """
+    Sink the proprietary table to delta lake in s3.
+    Caution: Only the dimensional table not the sources' tables
+
+    The table is streamed into a local Parquet spill and fed to deltalake as a record-batch reader of
+    ``batch_size`` rows, so the writer memory depends on the batch size rather than on the table size. This
+    holds for plans the streaming engine runs, e.g. over ``ingest_from_bronze`` or ``scan_delta_from_s3``,
+    and for record-batch readers; other plans are collected before being spilled, see ``_spilled``.
+
+    The ``replace`` mode overwrites only the rows matching ``predicate`` in a single delta commit, leaving
+    the other partitions untouched. Without a predicate, the distinct values of ``partition_col`` in
+    ``tables`` are replaced, so backfilling one day only rewrites that day, and an empty table writes
+    nothing.
+
+    Args:
+        tables (pl.LazyFrame | pa.RecordBatchReader): a LazyFrame, or record batches
+        target (str): the path to store in s3 delta lake
+        mode (str): mode to sink delta lake (append, overwite, error, ignore, replace)
+        delta_write_options (Optional[dict[str, Any]]): delta write options
+        predicate (Optional[str]): the rows to replace in ``replace`` mode, e.g. ``"Date = '2022-04-01'"``
+        partition_col (str): the column whose values are replaced when no predicate is given. Defaults to
+        "Date".
+        batch_size (int): the number of rows per record batch handed to deltalake. Defaults to 131072.
+        max_rows_per_file (Optional[int]): the maximum number of rows per data file.
+        target_file_size (Optional[int]): the target size of a data file in bytes, converted to a number of
+        rows per file from the spilled data. Only the pyarrow engine of deltalake honours the rows per file.
+        model (Optional[pt.Model]): the patito model validating the spilled rows before anything is committed,
+        so the plan runs once for both. Defaults to None.
+
+    Returns:
+
+    Raises:
+        patito.exceptions.DataFrameValidationError: If the table does not match ``model``, in which case
+        nothing is written.
+
+    Warns:
+        EmptyReplaceWarning: If the table of a ``replace`` write without a predicate is empty.
+        StreamingFallbackWarning: If the table is collected before being spilled, see ``_spilled``.
+    """
+    delta_write_options = dict(delta_write_options or {})
+
+    with _spilled(tables, batch_size) as spill:
+        if model is not None:
+            validate_dataset(spill, model, batch_size)
+
+        if mode == "replace":
+            if predicate is None:
+                predicate = _in_predicate(
+                    partition_col,
+                    pc.unique(spill.to_table(columns=[partition_col])[partition_col]),
+                )
+                if predicate is None:
+                    warnings.warn(
+                        f"Nothing to replace in {target}, the table is empty",
+                        EmptyReplaceWarning,
+                        stacklevel=2,
+                    )
+                    return None
+            delta_write_options.update(engine="rust", predicate=predicate)
+            mode = "overwrite"
+
+        if target_file_size is not None:
+            max_rows_per_file = _rows_per_file(spill, target_file_size)
+        if max_rows_per_file is not None:
+            delta_write_options["max_rows_per_file"] = max_rows_per_file
+            delta_write_options.setdefault(
+                "max_rows_per_group", min(max_rows_per_file, batch_size)
+            )
+            delta_write_options.setdefault(
+                "min_rows_per_group", delta_write_options["max_rows_per_group"]
+            )
+
+        return write_deltalake(
+            target,
+            _delta_reader(spill, batch_size),
+            mode=mode,
+            storage_options=get_storage_options(),
+            large_dtypes=True,
+            **delta_write_options,
+        )
+
+
+def _delta_reader(spill: pads.Dataset, batch_size: int) -> pa.RecordBatchReader:
+    """
+    Stream a spilled frame as record batches that Delta accepts.
+
+    Delta has no dictionary type, so Categorical columns are decoded to strings; Parquet dictionary-encodes
+    them again in the written files.
+
+    Args:
+        spill (pads.Dataset): The spilled frame.
+        batch_size (int): The number of rows per batch.
+
+    Returns:
+        pa.RecordBatchReader: The batches.
+    """
+    return spill.scanner(
+        columns={
+            field.name: pc.field(field.name)
+            if field.type == spill.schema.field(field.name).type
+            else pc.field(field.name).cast(field.type)
+            for field in decoded_schema(spill.schema)
+        },
+        batch_size=batch_size,
+    ).to_reader()
+
+
+def _in_predicate(column: str, values: Iterable[Any]) -> Optional[str]:
+    """
+    Build a delta SQL predicate matching the given values of a column.
+
+    Null values are matched with ``IS NULL``, since ``IN`` never matches a null.
+
+    Args:
+        column (str): The column name.
+        values (Iterable[Any]): The values to match, dates are typed and strings are quoted.
+
+    Returns:
+        Optional[str]: A predicate such as ``Date IN (DATE '2022-04-01', DATE '2022-04-02')`` or
+        ``(Date IN (DATE '2022-04-01') OR Date IS NULL)``, None when there are no values.
+    """
+    literals = [_sql_literal(value) for value in values]
+    matched = sorted(literal for literal in literals if literal is not None)
+    conditions = [f"{column} IN ({', '.join(matched)})"] if matched else []
+    if len(matched) < len(literals):
+        conditions.append(f"{column} IS NULL")
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return f"({' OR '.join(conditions)})"
+
+
+def _sql_literal(value: Any) -> Optional[str]:
+    """
+    Format a value as a delta SQL literal.
+
+    Args:
+        value (Any): A python or PyArrow scalar, dates are typed and strings are quoted.
+
+    Returns:
+        Optional[str]: The literal, None for a null value.
+    """
+    if isinstance(value, pa.Scalar):
+        value = value.as_py()
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        # A typed literal, a plain string only compares with a Date column once it is a partition column.
+        return f"DATE '{value.isoformat()}'"
+    text = value.isoformat() if isinstance(value, date) else str(value)
+    return "'" + text.replace("'", "''") + "'"
+
+
+def scan_delta_from_s3(
+    target: str,
+    partition_filters: Optional[List[Tuple[str, str, Any]]] = None,
+    version: Optional[int] = None,
 ) -> pl.LazyFrame:
     """
-    Ingests data from specified paths using PyArrow, create a columns with date getting from the filename,
-    and returns a
-    Polars
-    LazyFrame.
+    Scan a delta table with the native Parquet reader of polars.
+
+    ``pl.scan_delta`` reads through a PyArrow dataset, which the streaming engine cannot run, so sinking
+    the frame collects the whole table. Here the data files of the snapshot are scanned with
+    ``pl.scan_parquet``, one scan per partition with the partition values attached as literal columns, so
+    the frame streams like ``ingest_from_bronze``. Tables with deletion vectors or column mapping are not
+    supported.
 
     Args:
-        schema (pa.Schema): The schema to use for the data.
-        base_path (str, optional): The base path for the file system. Defaults to None.
+        target (str): The path of the delta table.
+        partition_filters (Optional[List[Tuple[str, str, Any]]]): The partitions to read, e.g.
+        ``[("Date", ">=", "2022-04-01")]``, see ``DeltaTable.file_uris``. Defaults to None, which reads every
+        partition.
+        version (Optional[int]): The version of the table to read. Defaults to None, the latest one.
 
     Returns:
-        pl.LazyFrame: A Polars LazyFrame containing the ingested data.
+        pl.LazyFrame: The rows of the table.
     """
-    cloudfs = fs.S3FileSystem(
-        access_key=os.getenv("AWS_ACCESS_KEY_ID"),
-        secret_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        region=os.getenv("AWS_REGION"),
-        scheme="http",
-        endpoint_override="miniostorage:9000",
+    table = DeltaTable(target, version=version, storage_options=get_storage_options())
+    schema = pl.DataFrame(table.schema().to_pyarrow().empty_table()).schema
+    partition_cols = table.metadata().partition_columns
+    root = table.table_uri.rstrip("/")
+    options = get_scan_options() if "://" in root else None
+
+    uris = set(table.file_uris(partition_filters))
+    files = (
+        pl.from_arrow(table.get_add_actions(flatten=True))
+        .select(
+            pl.concat_str(pl.lit(root + "/"), pl.col("path")).alias("uri"),
+            *(pl.col(f"partition.{name}").alias(name) for name in partition_cols),
+        )
+        .filter(pl.col("uri").is_in(list(uris)))
     )
 
-    s3_files = [
-        entry.path
-        for entry in cloudfs.get_file_info(fs.FileSelector(base_path, recursive=True))
+    scans = [
+        pl.scan_parquet(part["uri"].to_list(), storage_options=options)
+        .with_columns(
+            pl.lit(part[name][0], schema[name]).alias(name) for name in partition_cols
+        )
+        .select(schema.keys())
+        for part in (
+            files.partition_by(partition_cols, maintain_order=True)
+            if partition_cols
+            else [files]
+        )
+        if not part.is_empty()
     ]
+    return pl.concat(scans) if scans else pl.LazyFrame(schema=schema)
 
-    df = []
 
-    for path in s3_files:
-        ds = dataset(
-            source=path,
-            schema=schema,
-            filesystem=cloudfs,
-            format="json",
-        )
-        df.append(
-            pl.scan_pyarrow_dataset(ds)
-            .with_columns(pl.Series("Date", [path]).str.extract(r"\d{8}", 0))
-            .select(
-                pl.col("Date").str.to_date("%Y %m %d"),
-                pl.col("_index").alias("Index"),
-                pl.col("_type").alias("Type"),
-                pl.col("_id").alias("Id"),
-                pl.col("_score").alias("Score"),
-                pl.col("_source"),
+def sink_incremental_delta_to_s3(
+    base_path: str,
+    schema: pa.Schema,
+    target: str,
+    manifest_target: str,
+    delta_write_options: Optional[dict[str, Any]] = None,
+) -> dict[str, Any]:
+    """
+    Incrementally ingest the raw logs under ``base_path`` into the bronze delta table.
+
+    A manifest delta table at ``manifest_target`` records every object already ingested (key, size,
+    modification time and the bronze delta version that holds it). Only objects that are missing from the
+    manifest, or whose size or modification time changed, trigger a read. Their ``Date`` partitions are
+    replaced in a single delta commit from every object of these days, the unchanged ones included, so a
+    changed object never duplicates rows nor drops the rows of another object of the same day. A run
+    therefore costs one listing plus the new days, not the whole history.
+
+    Args:
+        base_path (str): The prefix holding the raw json logs.
+        schema (pa.Schema): The schema of the raw json logs.
+        target (str): The path of the bronze delta table.
+        manifest_target (str): The path of the manifest delta table.
+        delta_write_options (Optional[dict[str, Any]]): delta write options for the bronze table
+
+    Returns:
+        dict[str, Any]: The ingested ``files``, every object of the replaced days, the bronze delta
+        ``version`` and the ``watermark``, the latest modification time recorded in the manifest.
+    """
+    storage_options = get_storage_options()
+    cloudfs = get_filesystem()
+
+    try:
+        manifest = (
+            pl.from_arrow(
+                DeltaTable(
+                    manifest_target, storage_options=storage_options
+                ).to_pyarrow_table()
             )
-            .unnest("_source")
+            .cast(_MANIFEST_SCHEMA)
+            .sort("delta_version")
+            .group_by("key")
+            .last()
         )
+    except TableNotFoundError:
+        manifest = pl.DataFrame(schema=_MANIFEST_SCHEMA)
 
-    return pl.concat(df)
+    listed = pl.DataFrame(
+        [
+            (entry.path, entry.size, entry.mtime)
+            for entry in _list_objects(base_path, cloudfs)
+            if _date_from_path(entry.path) is not None
+        ],
+        schema={k: _MANIFEST_SCHEMA[k] for k in ("key", "size", "mtime")},
+        orient="row",
+    )
+    pending = listed.join(
+        manifest.select("key", "size", "mtime"),
+        on=["key", "size", "mtime"],
+        how="anti",
+    )
 
+    watermark = pl.concat([manifest.select("mtime"), pending.select("mtime")])
+    if pending.is_empty():
+        return {"files": [], "version": None, "watermark": watermark["mtime"].max()}
 
-def ingest_from_local(
-    paths: str | list[str],
-    schema: Mapping[str, pl.DataType],
-) -> pl.LazyFrame:
+    # A Date partition is replaced whole, so the objects sharing a day with a pending one are read again
+    # with it; otherwise their rows would be dropped from the partition.
+    days = {_date_from_path(key) for key in pending["key"]}
+    ingested = listed.filter(
+        pl.Series(
+            [_date_from_path(key) in days for key in listed["key"]], dtype=pl.Boolean
+        )
+    )
+    keys = ingested["key"].to_list()
+    if any(compression_of(key) for key in keys):
+        ds = _parsed_dataset(cloudfs.get_file_info(keys), schema, cloudfs, pa.date32())
+    else:
+        ds = _dated_dataset(keys, schema, cloudfs)
+    sink_delta_to_s3(
+        _log_batches(ds),
+        target=target,
+        mode="replace",
+        delta_write_options=delta_write_options,
+        predicate=_in_predicate("Date", days),
+    )
+    version = DeltaTable(target, storage_options=storage_options).version()
+
+    ingested.with_columns(
+        pl.lit(version, pl.Int64).alias("delta_version"),
+        pl.lit(datetime.now(), pl.Datetime("us")).alias("ingested_at"),
+    ).write_delta(manifest_target, mode="append", storage_options=storage_options)
+
+    return {
+        "files": keys,
+        "version": version,
+        "watermark": watermark["mtime"].max(),
+    }
+
+
+def update_contract_keys(sources: pl.LazyFrame, target: str) -> pl.DataFrame:
     """
-    Function to ingest the logging json data, get the filename and add a "Date" column
+    Assign stable integer surrogate keys to the contracts of the sources.
+
+    The contract dictionary is a delta table at ``target`` mapping every contract ever seen to its
+    ``ContractKey``. A key never changes once assigned: the contracts missing from the dictionary get the
+    next keys, in sorted order, and are appended in a single commit. Contracts of one character or less are
+    placeholders and get no key. The dictionary expects a single writer.
+
     Args:
-        paths (str | list[str]): a list of path to data, this path should be in glob pattern
-        schema (Mapping[str, pl.DataType]): schema of local log json data
+        sources (pl.LazyFrame): The log rows, only their ``Contract`` column is read.
+        target (str): The path of the contract dictionary delta table.
 
     Returns:
-        pl.LazyFame
+        pl.DataFrame: The whole dictionary, with the ``Contract`` and ``ContractKey`` columns.
     """
+    storage_options = get_storage_options()
 
-    # Define schema of logging data
+    try:
+        contracts = pl.from_arrow(
+            DeltaTable(target, storage_options=storage_options).to_pyarrow_table()
+        ).cast(_CONTRACT_KEY_SCHEMA)
+    except TableNotFoundError:
+        contracts = pl.DataFrame(schema=_CONTRACT_KEY_SCHEMA)
 
-    if isinstance(paths, str):
-        paths = [paths]
+    new_contracts = (
+        sources.select(pl.col("Contract").cast(pl.String))
+        .filter(pl.col("Contract").str.len_chars() > 1)
+        .unique()
+        .join(contracts.lazy(), on="Contract", how="anti")
+        .sort("Contract")
+        .collect(streaming=True)
+    )
+    if new_contracts.is_empty():
+        return contracts
 
-    def _scan_log(path, schema) -> pl.LazyFrame:
-        return (
-            pl.scan_ndjson(path, schema=schema, low_memory=True)
-            .with_columns(pl.Series("Date", [path]).str.extract(r"\d{8}", 0))
-            .select(
-                pl.col("Date").str.strptime(pl.Datetime, format="%Y %m %d"),
-                pl.col("_index").alias("Index"),
-                pl.col("_type").alias("Type"),
-                pl.col("_id").alias("Id"),
-                pl.col("_score").alias("Score"),
-                pl.col("_source"),
-            )
-            .unnest("_source")
-        )
+    next_key = 0 if contracts.is_empty() else contracts["ContractKey"].max() + 1
+    new_contracts = new_contracts.with_row_index("ContractKey", offset=next_key).select(
+        pl.col("Contract"), pl.col("ContractKey").cast(pl.Int32)
+    )
+    new_contracts.write_delta(target, mode="append", storage_options=storage_options)
 
-    dfs = []
-    # Function to scan and preprocess a single log data
-    try:
-        dfs = [_scan_log(path, schema) for path in paths]
-    except Exception as e:
-        print(f"Failed to read data from {paths}", {e})
-    # Concatenate the processed lazyframes
-    return pl.concat(dfs, how="vertical").lazy()
+    return pl.concat([contracts, new_contracts])
 
 
-def sink_to_s3(
-    sources: pl.LazyFrame,
-    path: str,
-    compression: str = "zstd",
-    **options,
-) -> None:
+def with_row_hash(
+    table: pl.LazyFrame, attr_cols: List[str], hash_col: str = "row_hash"
+) -> pl.LazyFrame:
     """
-    Writes a Polars LazyFrame to an S3 bucket as a Parquet file.
+    Add the row hash of the attributes to a dimension, e.g. when it is first written, so that
+    ``type2_scd_upsert_pl`` compares a stored hash instead of hashing the dimension on every upsert.
+
+    Args:
+        table (pl.LazyFrame): The dimension rows.
+        attr_cols (List[str]): A list of attribute column names.
+        hash_col (str): The name of the hash column. Defaults to "row_hash".
 
-    This function collects the data from the LazyFrame, converts it to an Arrow table, and then writes it to the
-    specified S3 path.
-    The AWS credentials and region are fetched from environment variables. The S3 endpoint is overridden to
-    "http://127.0.0.1:9000".
+    Returns:
+        pl.LazyFrame: The rows with the hash column.
+    """
+    return table.with_columns(_row_hash(attr_cols).alias(hash_col))
+
+
+def _row_hash(attr_cols: List[str]) -> pl.Expr:
+    """
+    Hash the attributes of a row into one 64-bit value, nulls included.
+
+    The hash is stored as an ``Int64`` because delta has no unsigned types. It is computed by
+    ``_stable_hash`` rather than ``Expr.hash``, whose values may change with the polars version, which would
+    turn every stored hash into a change.
 
     Args:
-        sources (pl.LazyFrame): The LazyFrame to write to S3.
-        path (str): The S3 path where the data should be written.
-        compression (str): The compression is default to "zstd"
-        **options: Additional options to pass to the pa.parquet.write_to_dataset or
-        pa.parquet.write_table
+        attr_cols (List[str]): A list of attribute column names.
 
     Returns:
-        The result of the `write_dataset` function.
+        pl.Expr: The hash.
+    """
+    return _stable_hash(attr_cols).reinterpret(signed=True)
 
-    Raises:
-        Any exceptions raised by `write_dataset` will be propagated.
+
+def _stable_hash(columns: List[str]) -> pl.Expr:
     """
-    tbl = sources.collect(streaming=True).to_arrow()
+    Hash the values of several columns into one 64-bit value that only depends on the values.
+
+    Every value is encoded canonically: strings and other non-numeric values by the ``blake2b`` digest of
+    their text, numbers, booleans and temporal values by their 64-bit pattern, times in microseconds, and
+    nulls by a constant. The encodings are then mixed column after column with the ``splitmix64`` finalizer,
+    so the hash is the same across polars versions and processes, e.g. for stored row hashes or buckets.
+
+    Args:
+        columns (List[str]): The columns to hash, in order.
 
-    s3fs = fs.S3FileSystem(
-        access_key=os.getenv("AWS_ACCESS_KEY_ID"),
-        secret_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        region=os.getenv("AWS_REGION"),
-        endpoint_override="http://127.0.0.1:9000",
+    Returns:
+        pl.Expr: The ``UInt64`` hash.
+    """
+    return pl.struct(columns).map_batches(
+        _hash_struct, return_dtype=pl.UInt64, is_elementwise=True
     )
 
-    if options is None:
-        options = {}
 
-    options["compression"] = compression
+def _hash_struct(rows: pl.Series) -> pl.Series:
+    """
+    Compute ``_stable_hash`` over a struct series.
 
-    if options.get("partition_cols"):
-        pq.write_to_dataset(
-            table=tbl,
-            root_path=path,
-            filesystem=s3fs,
-            **(options or {}),
-        )
-    else:
-        pq.write_table(
-            table=tbl,
-            where=path,
-            filesystem=s3fs,
-            **(options or {}),
-        )
+    Args:
+        rows (pl.Series): The struct of the hashed columns.
 
+    Returns:
+        pl.Series: The ``UInt64`` hash of every row.
+    """
+    hashes = np.full(len(rows), _HASH_SEED, dtype=np.uint64)
+    for field in rows.struct.unnest():
+        hashes = _mix(hashes * _HASH_MULTIPLIER + _mix(_encode(field)))
 
-def sink_delta_to_s3(
-    tables: pl.LazyFrame,
-    target: str,
-    mode: Literal["error", "append", "overwrite", "ignore"] = "append",
-    delta_write_options: Optional[dict[str, Any]] = None,
-) -> None:
+    return pl.Series(rows.name, hashes, dtype=pl.UInt64)
+
+
+def _encode(values: pl.Series) -> np.ndarray:
     """
-    Sink the proprietary table to delta lake in s3.
-    Caution: Only the dimensional table not the sources' tables
+    Encode every value of a column into 64 bits, see ``_stable_hash``.
+
     Args:
-        tables (pl.LazyFrame): a LazyFrame
-        target (str): the path to store in s3 delta lake
-        mode (str): mode to sink delta lake (append, overwite, error)
-        delta_write_options (Optional[dict[str, Any]]): delta write options
+        values (pl.Series): The column.
 
     Returns:
+        np.ndarray: The ``uint64`` encodings.
+    """
+    dtype = values.dtype
+    if dtype in (pl.Datetime, pl.Duration):
+        values = values.cast(dtype.base_type()("us"))
+    if dtype.is_temporal():
+        values = values.to_physical()
+    elif not (dtype.is_integer() or dtype.is_float() or dtype == pl.Boolean):
+        text = values.cast(pl.String)
+        # Every distinct value is digested once.
+        distinct = text.unique().drop_nulls()
+        digests = pl.Series(
+            [
+                int.from_bytes(
+                    hashlib.blake2b(value.encode(), digest_size=8).digest(), "little"
+                )
+                for value in distinct
+            ],
+            dtype=pl.UInt64,
+        )
+        values = text.replace(distinct, digests, default=None, return_dtype=pl.UInt64)
+
+    if values.dtype.is_float():
+        # -0.0 and 0.0 are equal, so they get the same encoding.
+        encoded = (
+            (values.cast(pl.Float64) + 0.0).fill_null(0).to_numpy().view(np.uint64)
+        )
+    elif values.dtype == pl.UInt64:
+        encoded = values.fill_null(0).to_numpy()
+    else:
+        encoded = values.cast(pl.Int64).fill_null(0).to_numpy().view(np.uint64)
+
+    return np.where(values.is_null().to_numpy(), _HASH_NULL, encoded)
+
 
+def _mix(values: np.ndarray) -> np.ndarray:
     """
-    tbl = tables.collect(streaming=True)
+    Apply the ``splitmix64`` finalizer, which spreads every input bit over the whole 64-bit output.
 
-    return tbl.write_delta(
-        target=target,
-        mode=mode,
-        storage_options={
-            "AWS_REGION": os.getenv("AWS_REGION"),
-            "AWS_ACCESS_KEY_ID": os.getenv("AWS_ACCESS_KEY_ID"),
-            "AWS_SECRET_ACCESS_KEY": os.getenv("AWS_SECRET_ACCESS_KEY"),
-            "AWS_ENDPOINT_URL": "http://miniostorage:9000",
-            "AWS_ALLOW_HTTP": "true",
-            "AWS_S3_ALLOW_UNSAFE_RENAME": "true",
-        },
-        delta_write_options=delta_write_options,
-    )
+    Args:
+        values (np.ndarray): The ``uint64`` values.
+
+    Returns:
+        np.ndarray: The mixed values.
+    """
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
 
 
 def type2_scd_upsert_pl(
@@ -212,15 +1747,22 @@ def type2_scd_upsert_pl(
     is_current_col: str = "is_current",
     effective_time_col: str = "effective_time",
     end_time_col: str = "end_time",
+    batch_size: int = 128 * 1024,
+    hash_col: str = "row_hash",
 ) -> dict[str, Any]:
     """
     Perform a Type 2 Slowly Changing Dimension (SCD) upsert operation using Polars LazyFrame/DataFrame and
-    write to Delta Lake using pl.write_delta().
+    merge into Delta Lake from a batched record-batch reader.
     Note that, the datatypes of **effective_time_col** and **end_time_col** should be in **pl.Datetime** dtypes
 
+    A contract changed when the 64-bit hash of its attributes differs from the one of its current row, so
+    the diff costs one comparison whatever the number of attributes, and treats nulls as values. Unchanged
+    contracts are dropped before the merge. The hash of the current rows is read from ``hash_col`` when the
+    dimension has it, see ``with_row_hash``, and computed otherwise.
+
     Args:
         sources_df (pl.LazyFrame): The source or target Polars LazyFrame scanned from DeltaLake using
-        pl.scan_delta().
+        ``scan_delta_from_s3``, which streams, unlike pl.scan_delta().
         updates_df (pl.LazyFrame): The Polars LazyFrame representing the updates data.
         primary_key (str): The name of the primary key column.
         target (str): The name of the target table to write the upserted records.
@@ -231,15 +1773,26 @@ def type2_scd_upsert_pl(
         Defaults to "effective_time".
         end_time_col (str, optional): The name of the column indicating the end time of a record. Defaults to
         "end_time".
+        batch_size (int, optional): The number of rows per record batch streamed into the merge. Defaults to
+        131072.
+        hash_col (str, optional): The name of the row hash column of the dimension, if it has one. Defaults to
+        "row_hash".
 
     Returns:
-        dict[str, Any]: A dictionary representing the result of the upsert operation.
+        dict[str, Any]: A dictionary representing the result of the upsert operation: the merge metrics of
+        deltalake, plus ``num_target_files``, ``num_target_files_rewritten`` and
+        ``num_target_files_candidates``. The last one is an estimate, see ``_merge_candidates``: deltalake does
+        not report the files it actually scans.
     """
     # validate updates delta tables
     base_cols = sources_df.columns
+    stored_hash = hash_col in base_cols
 
     required_base_cols = (
-        [primary_key] + attr_cols + [is_current_col, effective_time_col, end_time_col]
+        [primary_key]
+        + attr_cols
+        + [is_current_col, effective_time_col, end_time_col]
+        + ([hash_col] if stored_hash else [])
     )
 
     if sorted(base_cols) != sorted(required_base_cols):
@@ -271,18 +1824,31 @@ def type2_scd_upsert_pl(
             f"{updates_df.schema.get(effective_time_col)}"
         )
 
-    new_records = updates_df.join(sources_df, on=primary_key, how="anti").with_columns(
-        pl.lit(True).alias(is_current_col),
-        pl.lit(None, pl.Datetime).alias(end_time_col),
-    )
-    updates_conds = [
-        (pl.col(f"{attr}") != pl.col(f"{attr}_right")) for attr in attr_cols
-    ]
-    updates_records = sources_df.join(updates_df, on=primary_key, how="inner").filter(
-        pl.any_horizontal(
-            (pl.col(is_current_col) == True),  # noqa: E712
-            *updates_conds,
+    hashed_updates = with_row_hash(updates_df, attr_cols, hash_col)
+    current = sources_df.filter(pl.col(is_current_col))
+    if not stored_hash:
+        current = with_row_hash(current, attr_cols, hash_col)
+    stored_cols = [hash_col] if stored_hash else []
+
+    # A left join and a null test rather than an anti join, which the streaming engine cannot run.
+    new_records = (
+        hashed_updates.join(
+            current.select(primary_key, pl.lit(True).alias("_matched")),
+            on=primary_key,
+            how="left",
         )
+        .filter(pl.col("_matched").is_null())
+        .select(
+            pl.col(primary_key),
+            *attr_cols,
+            pl.lit(True).alias(is_current_col),
+            pl.col(effective_time_col),
+            pl.lit(None, pl.Datetime).alias(end_time_col),
+            *stored_cols,
+        )
+    )
+    updates_records = current.join(hashed_updates, on=primary_key, how="inner").filter(
+        pl.col(hash_col) != pl.col(f"{hash_col}_right")
     )
 
     open_exprs = [(pl.col(f"{attr}_right").alias(f"{attr}")) for attr in attr_cols]
@@ -292,6 +1858,7 @@ def type2_scd_upsert_pl(
         pl.lit(True).alias(is_current_col),
         pl.col(f"{effective_time_col}_right").alias(f"{effective_time_col}"),
         pl.lit(None, pl.Datetime).alias(end_time_col),
+        *([pl.col(f"{hash_col}_right").alias(hash_col)] if stored_hash else []),
     )
 
     close_exprs = [(pl.col(f"{attr}").alias(f"{attr}")) for attr in attr_cols]
@@ -301,30 +1868,308 @@ def type2_scd_upsert_pl(
         pl.lit(False).alias(is_current_col),
         pl.col(effective_time_col),
         pl.col(f"{effective_time_col}_right").alias(end_time_col),
+        *stored_cols,
     )
 
-    # merging
+    # merging, the three frames share their column order. An aligning concat joins them, which the
+    # streaming engine gets wrong.
     upsert_records = pl.concat(
         [
             new_records,
             open_records,
             close_records,
         ],
-        how="align",
+        how="vertical_relaxed",
+    )
+
+    with _spilled(upsert_records, batch_size) as spill:
+        table = DeltaTable(target, storage_options=get_storage_options())
+        if spill.count_rows() == 0:
+            files, candidates = len(table.files()), 0
+            metrics = {"num_source_rows": 0, "num_target_files_removed": 0}
+        else:
+            files, candidates = _merge_candidates(table, is_current_col)
+            metrics = (
+                table.merge(
+                    _delta_reader(spill, batch_size),
+                    predicate=" AND ".join(
+                        _merge_predicates(primary_key, is_current_col)
+                    ),
+                    source_alias="source",
+                    target_alias="target",
+                )
+                .when_matched_update(
+                    {
+                        is_current_col: f"source.{is_current_col}",
+                        end_time_col: f"source.{end_time_col}",
+                    }
+                )
+                .when_not_matched_insert_all(
+                    predicate=f"source.{is_current_col} = true"
+                )
+                .execute()
+            )
+
+    metrics.update(
+        num_target_files=files,
+        num_target_files_candidates=candidates,
+        num_target_files_rewritten=metrics["num_target_files_removed"],
     )
+    return metrics
+
+
+def type2_scd_upsert_bucketed(
+    sources_df: pl.LazyFrame,
+    updates_df: pl.LazyFrame,
+    primary_key: str,
+    target: str,
+    attr_cols: List[str],
+    buckets: int = 16,
+    buckets_per_commit: int = 1,
+    progress_target: Optional[str] = None,
+    run_id: Optional[str] = None,
+    **scd_options,
+) -> List[dict[str, Any]]:
+    """
+    Perform the Type 2 SCD upsert of ``type2_scd_upsert_pl`` bucket by bucket, for update batches too large
+    to diff in memory at once.
+
+    The updates and the current rows of the dimension are hash-partitioned on ``primary_key`` into
+    ``buckets`` local files each, in one pass each, see ``partition_by_contract``. Every
+    ``buckets_per_commit`` buckets of updates are then diffed against the dimension files of the same
+    buckets and merged in one delta commit, so the memory of the diff depends on the bucket size rather
+    than on the number of updates, and the dimension is scanned and hashed once whatever the number of
+    commits.
+
+    This holds when both frames run on the streaming engine, e.g. updates over ``ingest_from_bronze`` or
+    native Parquet scans, and the dimension from ``scan_delta_from_s3``; other plans are collected before
+    being spilled, see ``_spilled``. Every merge also reads the current rows of the dimension, so its memory
+    grows with the dimension, not with the updates.
+
+    With a ``progress_target``, a delta table recording the buckets committed by every ``run_id``, a failed
+    run resumes after its last committed bucket. A bucket committed without its progress being recorded
+    is harmless to merge again: its contracts are unchanged by then, so the hash diff drops them.
+
+    Args:
+        sources_df (pl.LazyFrame): The dimension scanned from DeltaLake using ``scan_delta_from_s3``.
+        updates_df (pl.LazyFrame): The Polars LazyFrame representing the updates data.
+        primary_key (str): The name of the primary key column.
+        target (str): The name of the target table to write the upserted records.
+        attr_cols (List[str]): A list of attribute column names.
+        buckets (int): The number of buckets. Defaults to 16.
+        buckets_per_commit (int): The number of buckets merged per delta commit. Defaults to 1.
+        progress_target (Optional[str]): The path of the progress delta table. Defaults to None, which does not
+        record the progress.
+        run_id (Optional[str]): The identifier of the run in the progress table, e.g. the reported date.
+        Required with ``progress_target``.
+        **scd_options: The other options of ``type2_scd_upsert_pl``.
+
+    Returns:
+        List[dict[str, Any]]: The result of every merge of this run.
+    """
+    if progress_target is not None and run_id is None:
+        raise ValueError("A run_id is required to record the progress")
+
+    storage_options = get_storage_options()
+    done = set()
+    if progress_target is not None:
+        try:
+            progress = pl.from_arrow(
+                DeltaTable(
+                    progress_target, storage_options=storage_options
+                ).to_pyarrow_table()
+            ).cast(_SCD2_PROGRESS_SCHEMA)
+            done = set(progress.filter(pl.col("run_id") == run_id)["bucket"])
+        except TableNotFoundError:
+            pass
+
+    pending = [bucket for bucket in range(buckets) if bucket not in done]
+    if done:
+        print(f"Resuming run {run_id}: {len(done)} of {buckets} buckets already merged")
+    if not pending:
+        return []
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = partition_by_contract(
+            updates_df.with_columns(
+                pl.col(primary_key).cast(sources_df.schema[primary_key])
+            ),
+            os.path.join(tmpdir, "updates"),
+            buckets,
+            key=primary_key,
+        )
+        # Only the current rows take part in the diff.
+        dimension = partition_by_contract(
+            sources_df.filter(pl.col(scd_options.get("is_current_col", "is_current"))),
+            os.path.join(tmpdir, "dimension"),
+            buckets,
+            key=primary_key,
+        )
+
+        for start in range(0, len(pending), buckets_per_commit):
+            group = pending[start : start + buckets_per_commit]
+            results.append(
+                type2_scd_upsert_pl(
+                    pl.concat([pl.scan_parquet(dimension[bucket]) for bucket in group]),
+                    pl.concat([pl.scan_parquet(paths[bucket]) for bucket in group]),
+                    primary_key,
+                    target,
+                    attr_cols,
+                    **scd_options,
+                )
+            )
+
+            if progress_target is not None:
+                version = DeltaTable(target, storage_options=storage_options).version()
+                pl.DataFrame(
+                    {
+                        "run_id": run_id,
+                        "bucket": group,
+                        "delta_version": version,
+                        "completed_at": datetime.now(),
+                    },
+                    schema=_SCD2_PROGRESS_SCHEMA,
+                ).write_delta(
+                    progress_target, mode="append", storage_options=storage_options
+                )
+
+    return results
+
+
+def read_scd2_as_of(
+    target: str,
+    as_of: Optional[datetime] = None,
+    keys: Optional[Iterable[Any]] = None,
+    primary_key: str = "Contract",
+    is_current_col: str = "is_current",
+    effective_time_col: str = "effective_time",
+    end_time_col: str = "end_time",
+) -> pl.LazyFrame:
+    """
+    Read the rows of a Type 2 SCD dimension that were current at a point in time.
+
+    A row is valid from its ``effective_time`` included to its ``end_time`` excluded. The filter is applied
+    to the delta files before they are read: deltalake exposes the partition values and the min/max
+    statistics of every file, so the current snapshot only reads the ``is_current`` partition of a
+    dimension partitioned on it, and an as-of read skips the history files whose time range excludes
+    ``as_of``, see ``cluster_scd2_history``.
+
+    Args:
+        target (str): The path of the dimension delta table.
+        as_of (Optional[datetime]): The point in time. Defaults to None, which reads the current rows.
+        keys (Optional[Iterable[Any]]): The keys to read. Defaults to None, which reads every key.
+        primary_key (str): The name of the primary key column. Defaults to "Contract".
+        is_current_col (str): The name of the column indicating if a record is current. Defaults to
+        "is_current".
+        effective_time_col (str): The name of the column indicating the effective time of a record. Defaults
+        to "effective_time".
+        end_time_col (str): The name of the column indicating the end time of a record. Defaults to
+        "end_time".
+
+    Returns:
+        pl.LazyFrame: One row per key valid at ``as_of``.
+    """
+    dataset = DeltaTable(
+        target, storage_options=get_storage_options()
+    ).to_pyarrow_dataset()
 
-    return (
-        upsert_records.collect(streaming=True)
-        .write_delta(
-            target=target,
-            mode="merge",
-            delta_merge_options={
-                "predicate": f"source.{primary_key} = target.{primary_key}",
-                "source_alias": "source",
-                "target_alias": "target",
-            },
+    if as_of is None:
+        condition = pc.field(is_current_col) == True  # noqa: E712
+    else:
+        moment = pa.scalar(as_of, dataset.schema.field(effective_time_col).type)
+        condition = (pc.field(effective_time_col) <= moment) & (
+            pc.field(end_time_col).is_null() | (pc.field(end_time_col) > moment)
         )
-        .when_matched_update_all()
-        .when_not_matched_insert_all()
-        .execute()
+    if keys is not None:
+        condition &= pc.field(primary_key).isin(
+            pa.array(list(keys), dataset.schema.field(primary_key).type)
+        )
+
+    return pl.scan_pyarrow_dataset(dataset.filter(condition))
+
+
+def cluster_scd2_history(
+    target: str,
+    is_current_col: str = "is_current",
+    effective_time_col: str = "effective_time",
+    end_time_col: str = "end_time",
+    target_size: Optional[int] = None,
+) -> dict[str, Any]:
+    """
+    Z-order the history of a Type 2 SCD dimension partitioned on ``is_current`` by its validity times.
+
+    Merges append closed rows to the history in arbitrary order, which leaves every history file spanning
+    most of the timeline. Clustering them on ``effective_time`` and ``end_time`` narrows the time range of
+    each file, so ``read_scd2_as_of`` skips most of them. The current partition is left untouched.
+
+    Args:
+        target (str): The path of the dimension delta table.
+        is_current_col (str): The name of the partition column indicating if a record is current. Defaults to
+        "is_current".
+        effective_time_col (str): The name of the column indicating the effective time of a record. Defaults
+        to "effective_time".
+        end_time_col (str): The name of the column indicating the end time of a record. Defaults to
+        "end_time".
+        target_size (Optional[int]): The target size of a history file in bytes. Defaults to None, the
+        table's ``delta.targetFileSize`` or 256 MiB.
+
+    Returns:
+        dict[str, Any]: The metrics of the optimization.
+    """
+    return DeltaTable(target, storage_options=get_storage_options()).optimize.z_order(
+        [effective_time_col, end_time_col],
+        partition_filters=[(is_current_col, "=", "false")],
+        target_size=target_size,
+    )
+
+
+def _merge_predicates(primary_key: str, is_current_col: str) -> List[str]:
+    """
+    Build the predicates of an SCD2 merge.
+
+    Only the closing rows of the source match, and only against the current target rows, so the opening and
+    new rows are inserted. The target side is not bounded by the range of the upserted keys: delta-rs drops
+    the rows of a rewritten file falling outside such a range when the table is partitioned, e.g. on
+    ``is_current``. The upserted keys are pruned on the source side instead, by the hash diff.
+
+    Args:
+        primary_key (str): The name of the primary key column.
+        is_current_col (str): The name of the column indicating if a record is current.
+
+    Returns:
+        List[str]: The predicates, to be joined with ``AND``.
+    """
+    return [
+        f"source.{primary_key} = target.{primary_key}",
+        f"source.{is_current_col} = false",
+        f"target.{is_current_col} = true",
+    ]
+
+
+def _merge_candidates(table: DeltaTable, is_current_col: str) -> tuple[int, int]:
+    """
+    Estimate the number of files of a dimension that an SCD2 merge may have to scan.
+
+    A file is a candidate when it may hold current rows, from its partition value or its statistics. Files
+    without either are always candidates. This is an upper bound read from the delta log, not the files
+    deltalake actually scans, which it does not report.
+
+    Args:
+        table (DeltaTable): The dimension.
+        is_current_col (str): The name of the column indicating if a record is current.
+
+    Returns:
+        tuple[int, int]: The number of files and the number of candidate files.
+    """
+    actions = pl.from_arrow(table.get_add_actions(flatten=True))
+
+    def stat(name: str) -> pl.Expr:
+        return pl.col(name) if name in actions.columns else pl.lit(None)
+
+    current = stat(f"partition.{is_current_col}").fill_null(
+        stat(f"max.{is_current_col}")
     )
+    candidates = actions.filter(current.fill_null(True))
+
+    return actions.height, candidates.height
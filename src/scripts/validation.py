@@ -1,5 +1,7 @@
 import polars as pl
 import patito as pt
+import pyarrow.dataset as pads
+from patito.exceptions import DataFrameValidationError, ErrorWrapper, RowValueError
 
 
 def validate_df(df: pl.DataFrame | pl.LazyFrame, schema: pt.Model) -> None:
@@ -18,3 +20,47 @@ def validate_df(df: pl.DataFrame | pl.LazyFrame, schema: pt.Model) -> None:
         df = df.collect(streaming=True)
 
     schema.validate(df)
+
+
+def validate_dataset(
+    dataset: pads.Dataset, schema: pt.Model, batch_size: int = 128 * 1024
+) -> None:
+    """
+    Validate an already materialized table, e.g. a spilled LazyFrame, batch by batch.
+
+    Every batch is validated by the patito schema, so the memory depends on the batch size rather than on
+    the table size. The unique columns, whose duplicates may lie in different batches, are then checked
+    over the whole table.
+
+    Args:
+        dataset (pads.Dataset): The table to validate.
+        schema (pt.Model): The patito schema to validate the table with.
+        batch_size (int): The number of rows validated at a time. Defaults to 131072.
+    Raises:
+        patito.exceptions.DataFrameValidationError: If the given table does not match
+        the given schema
+    """
+    empty = True
+    for batch in dataset.to_batches(batch_size=batch_size):
+        schema.validate(pl.from_arrow(batch))
+        empty = False
+    if empty:
+        schema.validate(pl.from_arrow(dataset.schema.empty_table()))
+
+    errors = []
+    for column in sorted(schema.unique_columns):
+        duplicated = (
+            pl.scan_pyarrow_dataset(dataset)
+            .select(pl.col(column).is_duplicated().sum())
+            .collect()
+            .item()
+        )
+        if duplicated:
+            errors.append(
+                ErrorWrapper(
+                    RowValueError(f"{duplicated} rows with duplicated values."),
+                    loc=column,
+                )
+            )
+    if errors:
+        raise DataFrameValidationError(errors=errors, model=schema)
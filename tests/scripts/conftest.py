@@ -0,0 +1,124 @@
+"""Fixtures shared by the tests of the pipeline scripts."""
+
+import gzip
+import json
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pyarrow as pa
+import pytest
+from pyarrow import fs
+
+import src.scripts.support as support
+
+LOGS = [
+    {
+        "_index": "history",
+        "_type": "kplus",
+        "_id": f"id-{i}",
+        "_score": 0,
+        "_source": {
+            "Contract": f"HNH{i % 7:06d}" if i % 11 else "0",
+            "Mac": f"0C96E62F{i:04X}",
+            "TotalDuration": i * 37 % 5000,
+            "AppName": ["CHANNEL", "KPLUS", "VOD", "RELAX"][i % 4],
+        },
+    }
+    for i in range(500)
+]
+
+
+def ndjson_bytes(records):
+    """Encode records as NDJSON."""
+    return b"".join(json.dumps(record).encode() + b"\n" for record in records)
+
+
+@pytest.fixture
+def logs():
+    """A day of raw log records."""
+    return LOGS
+
+
+@pytest.fixture
+def log_files(tmp_path):
+    """
+    Write the same day of logs as plain, gzip and multi-frame zstd NDJSON files.
+    """
+    content = ndjson_bytes(LOGS)
+    half = content.index(b"\n", len(content) // 2) + 1
+    paths = {
+        "plain": tmp_path / "20220401.json",
+        "gzip": tmp_path / "20220401.json.gz",
+        "zstd": tmp_path / "20220401.json.zst",
+    }
+    paths["plain"].write_bytes(content)
+    paths["gzip"].write_bytes(gzip.compress(content))
+    paths["zstd"].write_bytes(
+        pa.compress(content[:half], "zstd", asbytes=True)
+        + pa.compress(content[half:], "zstd", asbytes=True)
+    )
+    return {name: str(path) for name, path in paths.items()}
+
+
+@pytest.fixture
+def local_delta(monkeypatch):
+    """Let the delta helpers of ``support`` read and write local tables."""
+    monkeypatch.setattr(support, "get_storage_options", lambda: {})
+
+
+@pytest.fixture(scope="session")
+def moto_endpoint():
+    """
+    Run a moto S3 server holding an empty ``test`` bucket for the whole session.
+
+    The server runs in its own process: deltalake blocks without releasing the GIL, which would starve a
+    server thread of this process.
+    """
+    pytest.importorskip("moto.server")
+    boto3 = pytest.importorskip("boto3")
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    endpoint = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(endpoint)
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    boto3.client(
+        "s3",
+        endpoint_url=endpoint,
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+        region_name="us-east-1",
+    ).create_bucket(Bucket="test")
+
+    yield endpoint
+    server.terminate()
+    server.wait()
+    # Shut the AWS SDK of pyarrow down before the interpreter exits, which aborts otherwise.
+    fs.finalize_s3()
+
+
+@pytest.fixture
+def s3(moto_endpoint, monkeypatch):
+    """Point the storage layer at the moto server, yielding the name of its bucket."""
+    for name, value in {
+        "AWS_ENDPOINT_URL": moto_endpoint,
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_REGION": "us-east-1",
+    }.items():
+        monkeypatch.setenv(name, value)
+    return "test"
@@ -0,0 +1,91 @@
+import os
+
+from pyarrow import fs
+
+from src.scripts.cache import cache_objects
+
+
+class _CountingFileSystem:
+    """A local filesystem counting the files it opens, i.e. the downloads of the cache."""
+
+    def __init__(self):
+        self.local = fs.LocalFileSystem()
+        self.opened = []
+
+    def open_input_stream(self, path, compression=None):
+        self.opened.append(os.path.basename(path))
+        return self.local.open_input_stream(path, compression=compression)
+
+
+def _objects(tmp_path, sizes):
+    remote = tmp_path / "remote"
+    remote.mkdir(exist_ok=True)
+    for name, size in sizes.items():
+        (remote / name).write_bytes(name[0].encode() * size)
+    return {
+        name: fs.LocalFileSystem().get_file_info(str(remote / name)) for name in sizes
+    }
+
+
+def test_hits_are_not_downloaded_again(tmp_path):
+    objects = _objects(tmp_path, {"a.json": 10, "b.json": 20})
+    filesystem = _CountingFileSystem()
+    cache_dir = str(tmp_path / "cache")
+
+    first = cache_objects(list(objects.values()), filesystem, cache_dir)
+    second = cache_objects(list(objects.values()), filesystem, cache_dir)
+
+    assert first == second
+    assert [os.path.basename(path) for path in first] == ["a.json", "b.json"]
+    assert sorted(filesystem.opened) == ["a.json", "b.json"]
+    assert open(first[1], "rb").read() == b"b" * 20
+
+
+def test_a_changed_object_gets_a_new_entry(tmp_path):
+    filesystem = _CountingFileSystem()
+    cache_dir = str(tmp_path / "cache")
+    (old,) = cache_objects(
+        [_objects(tmp_path, {"a.json": 10})["a.json"]], filesystem, cache_dir
+    )
+
+    (new,) = cache_objects(
+        [_objects(tmp_path, {"a.json": 30})["a.json"]], filesystem, cache_dir
+    )
+
+    assert new != old
+    assert filesystem.opened == ["a.json", "a.json"]
+    assert open(new, "rb").read() == b"a" * 30
+    # The stale entry stays until it is evicted.
+    assert os.path.exists(old)
+
+
+def test_the_least_recently_used_entries_are_evicted_first(tmp_path):
+    objects = _objects(tmp_path, {"a.json": 100, "b.json": 100, "c.json": 100})
+    filesystem = _CountingFileSystem()
+    cache_dir = str(tmp_path / "cache")
+    a, b = cache_objects([objects["a.json"], objects["b.json"]], filesystem, cache_dir)
+    os.utime(a, (1000, 1000))
+    os.utime(b, (2000, 2000))
+
+    # A hit makes a the most recently used entry, so b is the one evicted.
+    cache_objects([objects["a.json"]], filesystem, cache_dir)
+    (c,) = cache_objects([objects["c.json"]], filesystem, cache_dir, max_bytes=200)
+
+    assert os.path.exists(a)
+    assert not os.path.exists(b)
+    assert os.path.exists(c)
+
+
+def test_requested_entries_are_never_evicted(tmp_path):
+    objects = _objects(tmp_path, {"a.json": 100, "b.json": 100, "c.json": 100})
+    filesystem = _CountingFileSystem()
+    cache_dir = str(tmp_path / "cache")
+    (a,) = cache_objects([objects["a.json"]], filesystem, cache_dir)
+
+    b, c = cache_objects(
+        [objects["b.json"], objects["c.json"]], filesystem, cache_dir, max_bytes=0
+    )
+
+    assert not os.path.exists(a)
+    assert os.path.exists(b)
+    assert os.path.exists(c)
@@ -0,0 +1,83 @@
+import polars as pl
+from deltalake import DeltaTable
+
+from src.scripts.pipeline import pack_mac, restore_contracts, with_contract_keys
+from src.scripts.support import update_contract_keys
+
+
+def _logs(contracts):
+    return pl.LazyFrame({"Contract": contracts})
+
+
+def test_contract_keys_never_change_once_assigned(tmp_path, local_delta):
+    path = str(tmp_path / "contract_keys")
+
+    first = update_contract_keys(_logs(["HNH02", "HNH01", "0", "HNH02"]), path)
+    assert first.rows() == [("HNH01", 0), ("HNH02", 1)]
+
+    second = update_contract_keys(_logs(["HNH03", "HNH00", "HNH02", ""]), path)
+    # The known contracts keep their keys, the new ones get the next keys in sorted order.
+    assert second.sort("ContractKey").rows() == [
+        ("HNH01", 0),
+        ("HNH02", 1),
+        ("HNH00", 2),
+        ("HNH03", 3),
+    ]
+    assert (
+        pl.read_delta(path).sort("ContractKey").rows()
+        == second.sort("ContractKey").rows()
+    )
+    assert DeltaTable(path).version() == 1
+
+    third = update_contract_keys(_logs(["HNH01", "HNH03"]), path)
+    assert third.sort("ContractKey").rows() == second.sort("ContractKey").rows()
+    # Nothing new, nothing committed.
+    assert DeltaTable(path).version() == 1
+
+
+def test_keyed_logs_restore_their_contracts(tmp_path, local_delta):
+    logs = pl.LazyFrame(
+        {
+            "Contract": ["HNH01", "0", "HNH02", "HNH01"],
+            "Mac": ["0C96E62F0001", "0C96E62F0002", "0c:96:e6:2f:00:03", "bad"],
+            "TotalDuration": [1, 2, 3, 4],
+        }
+    )
+    contracts = update_contract_keys(logs, str(tmp_path / "contract_keys"))
+
+    keyed = with_contract_keys(logs, contracts).collect()
+    assert keyed.columns == ["ContractKey", "Mac", "TotalDuration"]
+    # The placeholder contract has no key, so its row is dropped.
+    assert keyed.sort("TotalDuration").rows() == [
+        (0, 0x0C96E62F0001, 1),
+        (1, 0x0C96E62F0003, 3),
+        (0, None, 4),
+    ]
+
+    restored = restore_contracts(keyed.lazy(), contracts).collect()
+    assert restored.columns == ["Contract", "Mac", "TotalDuration"]
+    assert restored.sort("TotalDuration")["Contract"].to_list() == [
+        "HNH01",
+        "HNH02",
+        "HNH01",
+    ]
+
+
+def test_pack_mac_accepts_separators_and_nulls_malformed_addresses():
+    macs = pl.DataFrame(
+        {
+            "Mac": [
+                "0C96E62F0001",
+                "0c:96:e6:2f:00:01",
+                "0C-96-E6-2F-00-01",
+                "0C96.E62F.0001",
+                "0C96E62F00",
+                "0C96E62F000100",
+                "0C96E62F00ZZ",
+                "",
+                None,
+            ]
+        }
+    )
+
+    assert macs.select(pack_mac())["Mac"].to_list() == [0x0C96E62F0001] * 4 + [None] * 5
@@ -0,0 +1,191 @@
+import json
+from datetime import date
+
+import polars as pl
+import pytest
+from pyarrow import fs
+
+import src.scripts.support as support
+from src.scripts.cache import cache_objects
+from src.scripts.schema import PA_SCHEMA, PL_SCHEMA
+from src.scripts.storage import get_filesystem, get_storage_options
+from src.scripts.support import (
+    StreamingFallbackWarning,
+    convert_to_bronze,
+    ingest_from_bronze,
+    ingest_from_local,
+    ingest_from_s3,
+    sink_incremental_delta_to_s3,
+)
+
+
+def _ndjson(logs):
+    return b"".join(json.dumps(log).encode() + b"\n" for log in logs)
+
+
+def _upload(path, logs):
+    with get_filesystem().open_output_stream(path) as sink:
+        sink.write(_ndjson(logs))
+
+
+def test_incremental_ingest_keeps_the_unchanged_objects_of_a_day(s3, logs, recwarn):
+    first, second, other_day = logs[:100], logs[100:200], logs[200:300]
+    _upload(f"{s3}/raw/20220401-a.json", first)
+    _upload(f"{s3}/raw/20220401-b.json", second)
+    _upload(f"{s3}/raw/20220402-a.json", other_day)
+
+    def ingest():
+        return sink_incremental_delta_to_s3(
+            f"{s3}/raw",
+            PA_SCHEMA,
+            target=f"s3://{s3}/bronze",
+            manifest_target=f"s3://{s3}/bronze_manifest",
+            delta_write_options={"partition_by": ["Date"]},
+        )
+
+    assert len(ingest()["files"]) == 3
+    assert ingest()["files"] == []
+
+    _upload(f"{s3}/raw/20220401-b.json", second[:10])
+    result = ingest()
+
+    assert sorted(result["files"]) == [
+        f"{s3}/raw/20220401-a.json",
+        f"{s3}/raw/20220401-b.json",
+    ]
+    bronze = pl.read_delta(f"s3://{s3}/bronze", storage_options=get_storage_options())
+    assert bronze.group_by(pl.col("Date").cast(pl.String)).len().sort(
+        "Date"
+    ).rows() == [("2022-04-01", 110), ("2022-04-02", 100)]
+    assert ingest()["files"] == []
+    assert not [w for w in recwarn if w.category is StreamingFallbackWarning]
+
+
+def test_bronze_logs_stream(tmp_path, log_files, logs):
+    localfs = fs.LocalFileSystem()
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    (raw / "20220401.json").write_bytes(open(log_files["plain"], "rb").read())
+    (raw / "20220402.json.gz").write_bytes(open(log_files["gzip"], "rb").read())
+    convert_to_bronze(str(raw), str(tmp_path / "bronze"), PA_SCHEMA, filesystem=localfs)
+
+    sources = ingest_from_bronze(
+        str(tmp_path / "bronze"),
+        PA_SCHEMA,
+        start_date=date(2022, 4, 2),
+        columns=["Date", "Contract", "TotalDuration"],
+        filters=[("Contract", "len>", 1)],
+        filesystem=localfs,
+    )
+    # Raises on a plan the streaming engine cannot run.
+    sources.sink_parquet(tmp_path / "spill.parquet")
+
+    expected = [
+        (date(2022, 4, 2), log["_source"]["Contract"], log["_source"]["TotalDuration"])
+        for log in logs
+        if len(log["_source"]["Contract"]) > 1
+    ]
+    assert pl.read_parquet(tmp_path / "spill.parquet").rows() == expected
+
+
+def test_parsed_logs_are_read_when_scanned(tmp_path, logs):
+    path = tmp_path / "20220401.json"
+    path.write_bytes(_ndjson(logs[:10]))
+
+    sources = ingest_from_local(
+        str(path),
+        PL_SCHEMA,
+        block_size=256,
+        columns=["Contract", "TotalDuration"],
+        filters=[("TotalDuration", ">", 100)],
+    )
+    path.write_bytes(_ndjson(logs))
+
+    expected = [
+        (log["_source"]["Contract"], log["_source"]["TotalDuration"])
+        for log in logs
+        if log["_source"]["TotalDuration"] > 100
+    ]
+    assert sources.collect().rows() == expected
+    # Every scan parses the files again.
+    assert sources.filter(pl.col("TotalDuration") > 4000).collect().rows() == [
+        row for row in expected if row[1] > 4000
+    ]
+
+
+@pytest.mark.parametrize("block_size", [None, 256])
+def test_local_ingest_filters_the_top_level_fields(log_files, logs, block_size):
+    sources = ingest_from_local(
+        log_files["plain"],
+        PL_SCHEMA,
+        block_size=block_size,
+        columns=["Id", "Contract"],
+        filters=[("Index", "==", "history"), ("Id", "in", ["id-3", "id-42"])],
+    )
+
+    assert sources.collect().rows() == [
+        (log["_id"], log["_source"]["Contract"])
+        for log in logs
+        if log["_id"] in ("id-3", "id-42")
+    ]
+
+
+def test_prefetched_ingest_reports_the_overlap(s3, logs):
+    for day in ("20220401", "20220402", "20220403"):
+        _upload(f"{s3}/prefetch/{day}.json", logs)
+    stats = {}
+
+    sources = ingest_from_s3(
+        f"{s3}/prefetch",
+        PA_SCHEMA,
+        start_date=date(2022, 4, 2),
+        prefetch=2,
+        columns=["Date", "Contract"],
+        stats=stats,
+    )
+    assert stats == {}
+
+    rows = sources.group_by("Date").len().sort("Date").collect().rows()
+    assert rows == [(date(2022, 4, 2), len(logs)), (date(2022, 4, 3), len(logs))]
+    assert stats["bytes"] == 2 * len(_ndjson(logs))
+    assert set(stats) == {"bytes", "downloading", "io_wait", "parsing", "overlap"}
+
+
+def test_cached_ingest_downloads_the_objects_once(s3, logs, tmp_path, monkeypatch):
+    for day in ("20220401", "20220402"):
+        _upload(f"{s3}/cached/{day}.json", logs)
+    downloads = []
+
+    class Downloads:
+        def __init__(self, filesystem):
+            self.filesystem = filesystem
+
+        def open_input_stream(self, path, compression=None):
+            downloads.append(path)
+            return self.filesystem.open_input_stream(path, compression=compression)
+
+    def cached(files, filesystem):
+        return cache_objects(files, Downloads(filesystem), str(tmp_path / "cache"))
+
+    monkeypatch.setattr(support, "cache_objects", cached)
+
+    def ingest():
+        return (
+            ingest_from_s3(
+                f"{s3}/cached",
+                PA_SCHEMA,
+                start_date=date(2022, 4, 2),
+                cache=True,
+                columns=["Date", "Contract"],
+            )
+            .group_by("Date")
+            .len()
+            .collect()
+            .rows()
+        )
+
+    assert ingest() == [(date(2022, 4, 2), len(logs))]
+    assert downloads == [f"{s3}/cached/20220402.json"]
+
+    assert ingest() == [(date(2022, 4, 2), len(logs))]
+    assert downloads == [f"{s3}/cached/20220402.json"]
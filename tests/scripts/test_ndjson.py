@@ -0,0 +1,95 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+import pytest
+from pyarrow import fs
+
+from src.scripts.ndjson import (
+    iter_ndjson,
+    parse_ndjson,
+    prefetch_ndjson,
+    read_ndjson,
+)
+from src.scripts.schema import PA_SCHEMA
+
+
+def test_parse_ndjson_decodes_the_schema(logs, log_files):
+    with open(log_files["plain"], "rb") as file:
+        table = parse_ndjson(file.read(), PA_SCHEMA)
+
+    assert table.schema == PA_SCHEMA
+    assert table.to_pylist() == logs
+
+
+@pytest.mark.parametrize("codec", ["plain", "gzip", "zstd"])
+def test_read_ndjson_in_blocks(logs, log_files, codec):
+    table = read_ndjson(
+        log_files[codec], PA_SCHEMA, fs.LocalFileSystem(), block_size=4096
+    )
+
+    assert table.to_pylist() == logs
+
+
+@pytest.mark.parametrize("codec", ["plain", "gzip", "zstd"])
+def test_read_ndjson_filters_while_parsing(logs, log_files, codec):
+    predicate = pc.field("_source", "TotalDuration") > 2500
+    table = read_ndjson(
+        log_files[codec],
+        PA_SCHEMA,
+        fs.LocalFileSystem(),
+        block_size=4096,
+        predicate=predicate,
+    )
+
+    assert table.to_pylist() == [
+        log for log in logs if log["_source"]["TotalDuration"] > 2500
+    ]
+
+
+def test_read_ndjson_decodes_only_the_schema_fields(logs, log_files):
+    schema = pa.schema(
+        [pa.field("_source", pa.struct([pa.field("Contract", pa.string())]))]
+    )
+    table = read_ndjson(log_files["plain"], schema, fs.LocalFileSystem(), 4096)
+
+    assert table.schema == schema
+    assert table.column("_source").to_pylist() == [
+        {"Contract": log["_source"]["Contract"]} for log in logs
+    ]
+
+
+def test_prefetch_ndjson_keeps_the_order_and_reports_the_overlap(logs, log_files):
+    localfs = fs.LocalFileSystem()
+    files = localfs.get_file_info(list(log_files.values()))
+    stats = {}
+
+    parsed = list(
+        prefetch_ndjson(files, PA_SCHEMA, localfs, max_in_flight=2, stats=stats)
+    )
+
+    # Compressed files come in parts, in file order.
+    paths = list(dict.fromkeys(path for path, _ in parsed))
+    assert paths == list(log_files.values())
+    for path in paths:
+        parts = [table for part_path, table in parsed if part_path == path]
+        assert pa.concat_tables(parts).to_pylist() == logs
+    assert stats["bytes"] == sum(info.size for info in files)
+    assert 0 <= stats["overlap"] <= 1
+
+
+@pytest.mark.parametrize("codec", ["gzip", "zstd"])
+def test_iter_ndjson_parses_compressed_files_in_chunks(logs, log_files, codec):
+    predicate = pc.field("_source", "TotalDuration") > 2500
+    parts = list(
+        iter_ndjson(
+            log_files[codec],
+            PA_SCHEMA,
+            fs.LocalFileSystem(),
+            block_size=4096,
+            predicate=predicate,
+        )
+    )
+
+    assert len(parts) > 2
+    assert pa.concat_tables(parts).to_pylist() == [
+        log for log in logs if log["_source"]["TotalDuration"] > 2500
+    ]
@@ -0,0 +1,239 @@
+from datetime import date, timedelta
+
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from src.scripts.pipeline import (
+    _gold_aggregates,
+    get_daily_summary,
+    get_gold_table,
+    get_gold_table_from_buckets,
+    get_gold_table_from_summaries,
+    get_most_watch,
+    get_pivot_table,
+    get_rfm_snapshots,
+    get_rfm_table,
+)
+from src.scripts.schema import Output
+from src.scripts.support import (
+    StreamingFallbackWarning,
+    _spilled,
+    partition_by_contract,
+)
+from src.scripts.validation import validate_df
+
+APP_NAMES = ["CHANNEL", "KPLUS", "VOD", "FIMS", "BHD", "SPORT", "CHILD", "RELAX"]
+COLUMN_NAMES = [
+    "TVDuration",
+    "TVDuration",
+    "MovieDuration",
+    "MovieDuration",
+    "MovieDuration",
+    "SportDuration",
+    "ChildDuration",
+    "RelaxDuration",
+]
+OPTIONS = {"app_names": APP_NAMES, "column_names": COLUMN_NAMES}
+
+
+@pytest.fixture
+def sources():
+    """A week of logs of 30 contracts, each active on its own days, before 2022-04-15."""
+    first = date(2022, 4, 8)
+    return pl.LazyFrame(
+        [
+            (
+                first + timedelta(days=day),
+                f"HNH{contract:06d}",
+                APP_NAMES[(contract + day) % len(APP_NAMES)],
+                (contract * 97 + day * 31) % 900,
+            )
+            for contract in range(30)
+            for day in range(7)
+            if (contract + day) % 3
+        ],
+        schema={
+            "Date": pl.Date,
+            "Contract": pl.String,
+            "AppName": pl.String,
+            "TotalDuration": pl.Int64,
+        },
+        orient="row",
+    )
+
+
+def test_gold_aggregates_use_the_reported_date_and_window(sources):
+    aggregates = _gold_aggregates(
+        sources,
+        APP_NAMES,
+        COLUMN_NAMES,
+        list(set(COLUMN_NAMES)),
+        reported_date="20220415",
+        total_date=7,
+    ).collect()
+
+    first = aggregates.filter(pl.col("Contract") == "HNH000000").row(0, named=True)
+    # Active on the 2nd, 3rd, 5th and 6th day of the week.
+    assert first["Recency"] == timedelta(days=2)
+    assert first["Frequency"] == pytest.approx(4 / 7 * 100, abs=0.01)
+
+
+def test_gold_tables_agree(sources, tmp_path):
+    gold = get_gold_table(sources, "20220415", 7, **OPTIONS).collect()
+
+    from_summaries = get_gold_table_from_summaries(
+        get_daily_summary(sources, APP_NAMES, COLUMN_NAMES), "20220415", 7, **OPTIONS
+    ).collect()
+    from_buckets = get_gold_table_from_buckets(
+        partition_by_contract(sources, str(tmp_path / "buckets"), buckets=4),
+        str(tmp_path / "aggregates"),
+        "20220415",
+        7,
+        **OPTIONS,
+    ).collect()
+
+    assert gold.height == 30
+    assert_frame_equal(from_summaries, gold.select(from_summaries.columns))
+    assert_frame_equal(from_buckets, gold, check_row_order=False)
+
+
+def test_sketched_gold_table_is_lazy_and_reports_its_bounds(sources):
+    stats = {}
+    sketched = get_gold_table(
+        sources, "20220415", 7, sketch_size=200, stats=stats, **OPTIONS
+    )
+    # Nothing has run yet, the sketches are fed when the plan is collected.
+    assert stats == {}
+
+    gold = get_gold_table(sources, "20220415", 7, **OPTIONS).collect()
+    assert_frame_equal(sketched.collect(), gold)
+    assert stats["contracts"] == 30
+    assert set(stats["Recency"]) == {"rank_error", "probable_rank_error"}
+
+
+def test_rfm_snapshots_are_returned_per_reported_date(sources):
+    snapshots = get_rfm_snapshots(sources, ["20220415", "20220422"], [7, 30])
+
+    assert list(snapshots) == ["20220415", "20220422"]
+    assert all(isinstance(frame, pl.LazyFrame) for frame in snapshots.values())
+
+    week = snapshots["20220415"].filter(pl.col("TotalDate") == 7).collect()
+    assert week["ReportedDate"].unique().to_list() == [date(2022, 4, 15)]
+    assert_frame_equal(
+        week.select("Contract", "RFM", "TypeOfCustomers"),
+        get_rfm_table(sources, "20220415", 7).collect(),
+        check_row_order=False,
+    )
+
+
+def test_partition_by_contract_streams_its_sources(sources, tmp_path, recwarn):
+    sources.collect().write_parquet(tmp_path / "logs.parquet")
+
+    scanned = partition_by_contract(
+        pl.scan_parquet(tmp_path / "logs.parquet"), str(tmp_path / "scanned"), buckets=4
+    )
+    batches = partition_by_contract(
+        sources.collect().to_arrow().to_reader(max_chunksize=16),
+        str(tmp_path / "batches"),
+        buckets=4,
+    )
+
+    assert not [w for w in recwarn if w.category is StreamingFallbackWarning]
+    for left, right in zip(scanned, batches):
+        assert_frame_equal(
+            pl.read_parquet(left).sort("Contract", "Date"),
+            pl.read_parquet(right).sort("Contract", "Date"),
+        )
+    assert (
+        sum(pl.read_parquet(path).height for path in scanned)
+        == sources.collect().height
+    )
+
+
+def test_gold_table_matches_the_output_schema(sources):
+    gold = get_gold_table(sources, "20220415", 7, **OPTIONS).collect()
+
+    validate_df(gold, Output)
+    most_watch = get_most_watch(get_pivot_table(sources, APP_NAMES, COLUMN_NAMES))
+    assert_frame_equal(
+        gold.select("Contract", "MostWatch"),
+        most_watch.collect().sort("Contract"),
+        check_row_order=False,
+    )
+
+
+ITEMS = ["Child", "Movie", "Relax", "Sport", "TV"]
+
+
+def _pivot(rows):
+    return pl.LazyFrame(
+        rows,
+        schema=["Contract"] + [f"{item}Duration" for item in ITEMS],
+        orient="row",
+    )
+
+
+def test_most_watch_ties_go_to_the_priority():
+    pivot = _pivot([("A", 0, 10, 5, 0, 10), ("B", 3, 1, 3, 3, 2)])
+
+    default = get_most_watch(pivot, top_k=3).collect()
+    assert default.rows() == [
+        ("A", "TV", "Movie", "Relax"),
+        ("B", "Sport", "Relax", "Child"),
+    ]
+    assert default.columns == ["Contract", "MostWatch", "MostWatch2", "MostWatch3"]
+
+    preferred = get_most_watch(
+        pivot, top_k=2, priority=["Movie", "Child", "Relax", "Sport", "TV"]
+    ).collect()
+    assert preferred.rows() == [("A", "Movie", "TV"), ("B", "Child", "Relax")]
+
+    with pytest.raises(ValueError):
+        get_most_watch(pivot, priority=["Movie", "TV"])
+    with pytest.raises(ValueError):
+        get_most_watch(pivot, top_k=len(ITEMS) + 1)
+
+
+def test_most_watch_shares_sum_to_at_most_one(sources):
+    pivot = get_pivot_table(sources, APP_NAMES, COLUMN_NAMES)
+    pivot = pl.concat([pivot, _pivot([("Z", 0, 0, 0, 0, 0)])], how="diagonal_relaxed")
+
+    ranked = get_most_watch(pivot, top_k=2, shares=True).collect()
+    assert ranked.columns == [
+        "Contract",
+        "MostWatch",
+        "MostWatchShare",
+        "MostWatch2",
+        "MostWatch2Share",
+    ]
+    watched = ranked.filter(pl.col("Contract") != "Z")
+    assert (watched["MostWatchShare"] >= watched["MostWatch2Share"]).all()
+    assert (watched["MostWatchShare"] + watched["MostWatch2Share"] <= 1 + 1e-9).all()
+    # Nothing watched, nothing shared.
+    assert ranked.filter(pl.col("Contract") == "Z").select(
+        "MostWatchShare", "MostWatch2Share"
+    ).rows() == [(None, None)]
+
+    every_item = get_most_watch(pivot, top_k=len(ITEMS), shares=True).collect()
+    total = every_item.filter(pl.col("Contract") != "Z").select(
+        pl.sum_horizontal(pl.col("^MostWatch.*Share$"))
+    )
+    assert total.to_series().to_list() == pytest.approx([1.0] * 30)
+
+
+def test_gold_table_from_buckets_streams(sources, tmp_path, recwarn):
+    gold = get_gold_table_from_buckets(
+        partition_by_contract(sources, str(tmp_path / "buckets"), buckets=4),
+        str(tmp_path / "aggregates"),
+        "20220415",
+        7,
+        **OPTIONS,
+    )
+
+    # Raises on a plan the streaming engine cannot run.
+    gold.sink_parquet(tmp_path / "gold.parquet")
+    with _spilled(gold, 1024) as spill:
+        assert spill.count_rows() == 30
+
+    assert not [w for w in recwarn if w.category is StreamingFallbackWarning]
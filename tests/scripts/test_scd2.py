@@ -0,0 +1,230 @@
+from datetime import datetime
+
+import polars as pl
+import pytest
+from deltalake import DeltaTable
+
+import src.scripts.support as support
+from src.scripts.support import (
+    StreamingFallbackWarning,
+    read_scd2_as_of,
+    scan_delta_from_s3,
+    type2_scd_upsert_bucketed,
+    type2_scd_upsert_pl,
+    with_row_hash,
+)
+
+APRIL = datetime(2022, 4, 1)
+MAY = datetime(2022, 5, 1)
+
+
+def _dimension(path, rows, **write_options):
+    pl.DataFrame(
+        rows,
+        schema={
+            "Contract": pl.String,
+            "RFM": pl.Int64,
+            "is_current": pl.Boolean,
+            "effective_time": pl.Datetime("us"),
+            "end_time": pl.Datetime("us"),
+        },
+        orient="row",
+    ).write_delta(path, delta_write_options=write_options or None)
+
+
+def _rows(path):
+    return pl.read_delta(path).sort("Contract", "effective_time").rows()
+
+
+@pytest.fixture
+def updates():
+    """B changed, C unchanged and D new."""
+    return pl.LazyFrame(
+        {"Contract": ["B", "C", "D"], "RFM": [5, 3, 4], "effective_time": [MAY] * 3}
+    )
+
+
+def test_upsert_closes_changed_rows_and_inserts_new_ones(
+    tmp_path, local_delta, updates
+):
+    path = str(tmp_path / "dim")
+    _dimension(
+        path,
+        [
+            ("A", 0, False, datetime(2022, 3, 1), APRIL),
+            ("A", 1, True, APRIL, None),
+            ("B", 2, True, APRIL, None),
+            ("C", 3, True, APRIL, None),
+        ],
+    )
+
+    # pl.scan_delta scans a PyArrow dataset, which the streaming engine cannot run.
+    with pytest.warns(StreamingFallbackWarning):
+        metrics = type2_scd_upsert_pl(
+            pl.scan_delta(path), updates, "Contract", path, ["RFM"]
+        )
+
+    assert metrics["num_source_rows"] == 3
+    assert _rows(path) == [
+        ("A", 0, False, datetime(2022, 3, 1), APRIL),
+        ("A", 1, True, APRIL, None),
+        ("B", 2, False, APRIL, MAY),
+        ("B", 5, True, MAY, None),
+        ("C", 3, True, APRIL, None),
+        ("D", 4, True, MAY, None),
+    ]
+
+
+def test_upsert_keeps_every_row_of_a_table_partitioned_on_is_current(
+    tmp_path, local_delta, updates
+):
+    path = str(tmp_path / "dim")
+    _dimension(
+        path,
+        [
+            ("A", 0, False, datetime(2022, 3, 1), APRIL),
+            ("A", 1, True, APRIL, None),
+            ("B", 2, True, APRIL, None),
+            ("C", 3, True, APRIL, None),
+        ],
+        partition_by=["is_current"],
+    )
+
+    metrics = type2_scd_upsert_pl(
+        scan_delta_from_s3(path), updates, "Contract", path, ["RFM"]
+    )
+
+    # Only the file of the current partition may hold rows to close.
+    assert metrics["num_target_files"] == 2
+    assert metrics["num_target_files_candidates"] == 1
+
+    assert _rows(path) == [
+        ("A", 0, False, datetime(2022, 3, 1), APRIL),
+        ("A", 1, True, APRIL, None),
+        ("B", 2, False, APRIL, MAY),
+        ("B", 5, True, MAY, None),
+        ("C", 3, True, APRIL, None),
+        ("D", 4, True, MAY, None),
+    ]
+
+
+def test_as_of_reads_follow_a_merge_into_the_partitioned_layout(
+    tmp_path, local_delta, updates
+):
+    path = str(tmp_path / "dim")
+    _dimension(
+        path,
+        [("B", 2, True, APRIL, None), ("C", 3, True, APRIL, None)],
+        partition_by=["is_current"],
+    )
+    type2_scd_upsert_pl(scan_delta_from_s3(path), updates, "Contract", path, ["RFM"])
+
+    def rfm(frame):
+        return frame.select("Contract", "RFM").collect().sort("Contract").rows()
+
+    assert rfm(read_scd2_as_of(path)) == [("B", 5), ("C", 3), ("D", 4)]
+    assert rfm(read_scd2_as_of(path, datetime(2022, 4, 15))) == [("B", 2), ("C", 3)]
+    assert rfm(read_scd2_as_of(path, MAY, keys=["B"])) == [("B", 5)]
+
+
+def test_upsert_without_changes_does_not_commit(tmp_path, local_delta):
+    path = str(tmp_path / "dim")
+    _dimension(path, [("A", 1, True, APRIL, None)])
+    unchanged = pl.LazyFrame({"Contract": ["A"], "RFM": [1], "effective_time": [MAY]})
+
+    # pl.scan_delta scans a PyArrow dataset, which the streaming engine cannot run.
+    with pytest.warns(StreamingFallbackWarning):
+        metrics = type2_scd_upsert_pl(
+            pl.scan_delta(path), unchanged, "Contract", path, ["RFM"]
+        )
+
+    assert metrics["num_source_rows"] == 0
+    assert DeltaTable(path).version() == 0
+
+
+def test_upsert_spills_the_changes_without_collecting(
+    tmp_path, local_delta, updates, recwarn
+):
+    path = str(tmp_path / "dim")
+    _dimension(path, [("B", 2, True, APRIL, None), ("C", 3, True, APRIL, None)])
+
+    metrics = type2_scd_upsert_pl(
+        scan_delta_from_s3(path), updates, "Contract", path, ["RFM"]
+    )
+
+    assert not [w for w in recwarn if w.category is StreamingFallbackWarning]
+    assert metrics["num_source_rows"] == 3
+    assert _rows(path) == [
+        ("B", 2, False, APRIL, MAY),
+        ("B", 5, True, MAY, None),
+        ("C", 3, True, APRIL, None),
+        ("D", 4, True, MAY, None),
+    ]
+
+
+def test_row_hash_only_depends_on_the_values():
+    rows = {
+        "RFM": [311, None],
+        "Segment": ["champions", None],
+        "Since": [APRIL, None],
+    }
+    hashes = with_row_hash(pl.LazyFrame(rows), list(rows)).collect()["row_hash"]
+    # The same values in narrower types, which must not look like a change.
+    narrow = with_row_hash(
+        pl.LazyFrame(rows).with_columns(
+            pl.col("RFM").cast(pl.Int32),
+            pl.col("Segment").cast(pl.Categorical),
+            pl.col("Since").dt.cast_time_unit("ms"),
+        ),
+        list(rows),
+    ).collect()["row_hash"]
+
+    # Pinned, the hashes are stored in the dimension and must not change with the polars version.
+    assert hashes.to_list() == [-7775944725928583992, 2095136252964884444]
+    assert narrow.to_list() == hashes.to_list()
+
+
+def test_bucketed_upsert_streams_the_updates(
+    tmp_path, local_delta, updates, recwarn, monkeypatch
+):
+    path = str(tmp_path / "dim")
+    _dimension(
+        path,
+        [
+            ("B", 1, False, datetime(2022, 3, 1), APRIL),
+            ("B", 2, True, APRIL, None),
+            ("C", 3, True, APRIL, None),
+        ],
+    )
+    updates.collect().write_parquet(tmp_path / "updates.parquet")
+    partitioned = []
+    original = support.partition_by_contract
+
+    def partition_by_contract(*args, **kwargs):
+        paths = original(*args, **kwargs)
+        partitioned.append(sum(pl.read_parquet(path).height for path in paths))
+        return paths
+
+    monkeypatch.setattr(support, "partition_by_contract", partition_by_contract)
+
+    results = type2_scd_upsert_bucketed(
+        scan_delta_from_s3(path),
+        pl.scan_parquet(tmp_path / "updates.parquet"),
+        "Contract",
+        path,
+        ["RFM"],
+        buckets=4,
+        buckets_per_commit=4,
+    )
+
+    assert not [w for w in recwarn if w.category is StreamingFallbackWarning]
+    # The updates, then the current rows of the dimension, each partitioned once.
+    assert partitioned == [3, 2]
+    assert len(results) == 1
+    assert _rows(path) == [
+        ("B", 1, False, datetime(2022, 3, 1), APRIL),
+        ("B", 2, False, APRIL, MAY),
+        ("B", 5, True, MAY, None),
+        ("C", 3, True, APRIL, None),
+        ("D", 4, True, MAY, None),
+    ]
@@ -0,0 +1,145 @@
+from datetime import date
+
+import patito as pt
+import polars as pl
+import pyarrow.dataset as pads
+import pytest
+from deltalake import DeltaTable
+from patito.exceptions import DataFrameValidationError
+
+from src.scripts.support import (
+    EmptyReplaceWarning,
+    StreamingFallbackWarning,
+    _in_predicate,
+    scan_delta_from_s3,
+    sink_delta_to_s3,
+)
+from src.scripts.validation import validate_dataset
+
+DAYS = {"Date": pl.Date, "Contract": pl.String, "TotalDuration": pl.Int64}
+
+
+class Summary(pt.Model):
+    Date: date = pt.Field(dtype=pl.Date)
+    Contract: str = pt.Field(dtype=pl.String, unique=True)
+    TotalDuration: int = pt.Field(dtype=pl.Int64)
+
+
+def _days(rows):
+    return pl.DataFrame(rows, schema=DAYS, orient="row")
+
+
+def _rows(path):
+    return pl.read_delta(path).sort("Date", "Contract", nulls_last=True).rows()
+
+
+def test_in_predicate_matches_nulls():
+    assert _in_predicate("Date", [date(2022, 4, 2), date(2022, 4, 1)]) == (
+        "Date IN (DATE '2022-04-01', DATE '2022-04-02')"
+    )
+    assert _in_predicate("Date", [None, date(2022, 4, 1)]) == (
+        "(Date IN (DATE '2022-04-01') OR Date IS NULL)"
+    )
+    assert _in_predicate("Date", [None]) == "Date IS NULL"
+    assert _in_predicate("Date", []) is None
+
+
+def test_replace_only_rewrites_the_written_days(tmp_path, local_delta):
+    path = str(tmp_path / "summary")
+    _days(
+        [
+            (date(2022, 4, 1), "A", 1),
+            (date(2022, 4, 2), "A", 2),
+            (None, "A", 3),
+        ]
+    ).write_delta(path)
+
+    sink_delta_to_s3(
+        _days([(date(2022, 4, 2), "B", 20), (None, "B", 30)]).lazy(),
+        target=path,
+        mode="replace",
+    )
+
+    assert _rows(path) == [
+        (date(2022, 4, 1), "A", 1),
+        (date(2022, 4, 2), "B", 20),
+        (None, "B", 30),
+    ]
+
+
+def test_replace_with_an_empty_table_writes_nothing(tmp_path, local_delta):
+    path = str(tmp_path / "summary")
+    _days([(date(2022, 4, 1), "A", 1)]).write_delta(path)
+
+    with pytest.warns(EmptyReplaceWarning):
+        sink_delta_to_s3(_days([]).lazy(), target=path, mode="replace")
+
+    assert _rows(path) == [(date(2022, 4, 1), "A", 1)]
+
+
+def test_plans_the_streaming_engine_cannot_run_are_collected(tmp_path, local_delta):
+    path = str(tmp_path / "summary")
+    rows = [(date(2022, 4, 1), "A", 1)]
+
+    with pytest.warns(StreamingFallbackWarning):
+        sink_delta_to_s3(
+            pl.scan_pyarrow_dataset(pads.dataset(_days(rows).to_arrow())), path
+        )
+
+    assert _rows(path) == rows
+
+
+def test_duplicates_split_across_batches_are_found():
+    days = _days(
+        [
+            (date(2022, 4, 1), "A", 1),
+            (date(2022, 4, 1), "B", 2),
+            (date(2022, 4, 1), "C", 3),
+            (date(2022, 4, 1), "A", 4),
+        ]
+    )
+    # Every batch of two rows is valid on its own.
+    for batch in days.iter_slices(2):
+        Summary.validate(batch)
+
+    with pytest.raises(DataFrameValidationError, match="Contract"):
+        validate_dataset(pads.dataset(days.to_arrow()), Summary, batch_size=2)
+
+
+def test_invalid_tables_are_not_committed(tmp_path, local_delta):
+    path = str(tmp_path / "summary")
+    rows = [(date(2022, 4, 1), "A", 1)]
+    _days(rows).write_delta(path)
+    duplicated = _days([(date(2022, 4, 2), "B", 2), (date(2022, 4, 2), "B", 3)])
+
+    with pytest.raises(DataFrameValidationError):
+        sink_delta_to_s3(duplicated.lazy(), path, model=Summary, batch_size=1)
+    with pytest.raises(DataFrameValidationError):
+        sink_delta_to_s3(
+            duplicated.lazy(), path, mode="replace", model=Summary, batch_size=1
+        )
+
+    assert DeltaTable(path).version() == 0
+    assert _rows(path) == rows
+
+    sink_delta_to_s3(duplicated.head(1).lazy(), path, model=Summary, batch_size=1)
+    assert DeltaTable(path).version() == 1
+
+
+def test_scan_delta_from_s3_streams_the_partitions(tmp_path, local_delta):
+    path = str(tmp_path / "summary")
+    rows = [(date(2022, 4, 1), "A", 1), (date(2022, 4, 2), "A", 2), (None, "B", 3)]
+    _days(rows).write_delta(path, delta_write_options={"partition_by": ["Date"]})
+
+    scan = scan_delta_from_s3(path)
+    # Raises on a plan the streaming engine cannot run.
+    scan.sink_parquet(tmp_path / "spill.parquet")
+
+    assert scan.schema == DAYS
+    assert (
+        pl.read_parquet(tmp_path / "spill.parquet").sort("Date", nulls_last=True).rows()
+        == rows
+    )
+    assert scan_delta_from_s3(
+        path, partition_filters=[("Date", "=", "2022-04-02")]
+    ).collect().rows() == [(date(2022, 4, 2), "A", 2)]
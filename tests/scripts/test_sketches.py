@@ -0,0 +1,63 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from src.scripts.pipeline import merge_rfm_sketches, rfm_breaks, rfm_sketches
+from src.scripts.sketches import QuantileSketch
+
+FRACTIONS = np.linspace(0, 1, 101)
+
+
+def _rank_error(sketch, values):
+    """The largest normalized distance between the rank of a quantile and the rank it was asked for."""
+    values, quantiles = np.sort(values), sketch.quantiles(FRACTIONS)
+    # A repeated value stands for every rank it spans.
+    first = np.searchsorted(values, quantiles, side="left")
+    last = np.searchsorted(values, quantiles, side="right") - 1
+    wanted = (FRACTIONS * (len(values) - 1)).astype(int)
+    return np.maximum(np.maximum(first - wanted, wanted - last), 0).max() / len(values)
+
+
+def test_merged_sketches_stay_within_their_rank_error():
+    k, partitions = 32, 4
+    values = np.random.default_rng(0).permutation(20_000).astype(np.float64)
+
+    sketches = [
+        QuantileSketch(k, seed=seed).update(part)
+        for seed, part in enumerate(np.array_split(values, partitions))
+    ]
+    merged = QuantileSketch(k, seed=partitions)
+    for sketch in sketches:
+        merged.merge(sketch)
+
+    assert merged.count == len(values)
+    # Far more values than k were compacted into a few times k items.
+    assert sum(map(len, merged.levels)) < 4 * k
+    assert 0 < merged.probable_rank_error() <= merged.rank_error < 1
+    assert _rank_error(merged, values) <= merged.rank_error
+
+    with pytest.raises(ValueError):
+        merged.merge(QuantileSketch(k + 1))
+
+
+def test_merged_rfm_sketches_stay_within_their_rank_error():
+    rng = np.random.default_rng(1)
+    rfm = pl.DataFrame(
+        {
+            "Recency": pl.Series(rng.permutation(12_000), dtype=pl.Duration("us")),
+            "Frequency": rng.integers(1, 30, 12_000),
+            "Monetary": rng.permutation(12_000) * 7,
+        }
+    )
+
+    merged = merge_rfm_sketches(
+        [rfm_sketches(part, sketch_size=16) for part in rfm.iter_slices(3_000)]
+    )
+
+    breaks = rfm_breaks(merged)
+    for metric, sketch in merged.items():
+        values = rfm[metric].to_physical().to_numpy()
+        assert sketch.count == rfm.height
+        assert sketch.rank_error > 0
+        assert _rank_error(sketch, values) <= sketch.rank_error
+        assert breaks[metric] == sketch.quantiles([1 / 3, 2 / 3])
@@ -0,0 +1,77 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+from deltalake import DeltaTable, write_deltalake
+
+from src.scripts.storage import (
+    get_filesystem,
+    get_scan_options,
+    get_settings,
+    get_storage_options,
+    open_output_stream,
+)
+from src.scripts.support import scan_delta_from_s3, sink_to_s3
+
+
+def test_settings_are_read_on_every_call(monkeypatch):
+    monkeypatch.setenv("AWS_ENDPOINT_URL", "http://localhost:9999")
+    monkeypatch.setenv("STORAGE_REQUEST_TIMEOUT", "2.5")
+
+    assert get_settings()["endpoint"] == "http://localhost:9999"
+    assert get_storage_options()["AWS_ENDPOINT_URL"] == "http://localhost:9999"
+    assert get_storage_options()["timeout"] == "2.5s"
+    assert get_scan_options()["aws_endpoint_url"] == "http://localhost:9999"
+
+
+def test_filesystem_is_shared_until_the_settings_change(monkeypatch):
+    monkeypatch.setenv("AWS_ENDPOINT_URL", "http://localhost:9001")
+    first = get_filesystem()
+    assert get_filesystem() is first
+
+    monkeypatch.setenv("AWS_ENDPOINT_URL", "http://localhost:9002")
+    assert get_filesystem() is not first
+
+
+def test_output_stream_round_trip(s3):
+    payload = b"0123456789" * 100_000
+    with open_output_stream(f"{s3}/raw/blob.bin") as sink:
+        sink.write(payload)
+
+    with get_filesystem().open_input_stream(f"{s3}/raw/blob.bin") as source:
+        assert source.read() == payload
+
+
+def test_sink_to_s3_writes_parquet(s3):
+    import polars as pl
+
+    frame = pl.DataFrame({"Contract": ["A", "B", "C"], "TotalDuration": [1, 2, 3]})
+    written = sink_to_s3(frame.lazy(), f"{s3}/gold/table.parquet", row_group_size=2)
+
+    assert written["rows"] == 3
+    table = pq.read_table(f"{s3}/gold/table.parquet", filesystem=get_filesystem())
+    assert table.to_pydict() == frame.to_dict(as_series=False)
+
+
+def test_delta_round_trip(s3):
+    table = pa.table({"Contract": ["A", "B"], "RFM": [111, 333]})
+    write_deltalake(f"s3://{s3}/delta", table, storage_options=get_storage_options())
+
+    read = DeltaTable(
+        f"s3://{s3}/delta", storage_options=get_storage_options()
+    ).to_pyarrow_table()
+    assert read.sort_by("Contract").to_pydict() == table.to_pydict()
+
+
+def test_scan_delta_from_s3_reads_with_the_native_reader(s3, tmp_path):
+    table = pa.table({"Contract": ["A", "B"], "RFM": [111, 333]})
+    write_deltalake(
+        f"s3a://{s3}/scanned",
+        table,
+        partition_by=["RFM"],
+        storage_options=get_storage_options(),
+    )
+
+    scan = scan_delta_from_s3(f"s3a://{s3}/scanned")
+    scan.sink_parquet(tmp_path / "spill.parquet")
+
+    read = pq.read_table(tmp_path / "spill.parquet")
+    assert read.sort_by("Contract").to_pydict() == table.to_pydict()